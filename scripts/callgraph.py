@@ -0,0 +1,287 @@
+#
+# In-memory call graph of a database generated by mk-dwarf-db.py.
+#
+# The symbols and calls tables are loaded once into compressed sparse
+# row (CSR) arrays, so following callers or callees of a function
+# doesn't query the database at all.
+#
+# For a symbol of id N,
+#
+#   callees: fwd_targets[fwd_offsets[N]:fwd_offsets[N + 1]]
+#   callers: rev_targets[rev_offsets[N]:rev_offsets[N + 1]]
+#
+# Targets of a symbol are sorted by id, the same order as querying
+# the calls table by its primary key or the calls_callee index.
+#
+# Usage:
+#
+#   import callgraph
+#   graph = callgraph.load(conn)
+#   for callee in graph.callees(graph.get_id('main')):
+#       print(graph.get_name(callee))
+#
+import heapq
+from array import array
+from itertools import accumulate
+from operator import itemgetter
+
+class CallGraph:
+    def __init__(self, names, fwd_offsets, fwd_targets,
+                 rev_offsets, rev_targets, cus=None, cu_names=None):
+        # names[id] is the name of the symbol; None for unused ids.
+        self.names = names
+        self.ids = {name: id for id, name in enumerate(names)
+                    if name is not None}
+        self.fwd_offsets = fwd_offsets
+        self.fwd_targets = fwd_targets
+        self.rev_offsets = rev_offsets
+        self.rev_targets = rev_targets
+        # cus[id] is the id of the compile unit of the symbol, and
+        # cu_names maps compile unit names to ids.
+        self.cus = cus
+        self.cu_names = cu_names or {}
+        pass
+
+    def has_name(self, name):
+        return name in self.ids
+
+    def get_id(self, name):
+        return self.ids[name]
+
+    def get_name(self, id):
+        return self.names[id]
+
+    def callees(self, id):
+        return self.fwd_targets[self.fwd_offsets[id]:self.fwd_offsets[id + 1]]
+
+    def callers(self, id):
+        return self.rev_targets[self.rev_offsets[id]:self.rev_offsets[id + 1]]
+
+    # Return callees if to_callee is True, or callers.
+    def neighbors(self, id, to_callee):
+        if to_callee:
+            return self.callees(id)
+        return self.callers(id)
+
+    def num_callees(self, id):
+        return self.fwd_offsets[id + 1] - self.fwd_offsets[id]
+
+    def num_callers(self, id):
+        return self.rev_offsets[id + 1] - self.rev_offsets[id]
+
+    # Return up to "limit" of neighbors(id, to_callee), skipping the
+    # first "offset" ones, without copying the others.
+    def neighbors_page(self, id, to_callee, offset, limit):
+        if to_callee:
+            offsets, targets = self.fwd_offsets, self.fwd_targets
+        else:
+            offsets, targets = self.rev_offsets, self.rev_targets
+            pass
+        start = offsets[id] + offset
+        end = offsets[id + 1]
+        return targets[start:min(start + limit, end)] if start < end else []
+
+    def get_cu_id(self, cu_name):
+        return self.cu_names.get(cu_name)
+
+    # Return names of functions in the compile unit cu2_id called by
+    # functions in the compile unit cu1_id.
+    def get_cu_callee_names(self, cu1_id, cu2_id):
+        cus = self.cus
+        names = set()
+        for id, cu in enumerate(cus):
+            if cu != cu1_id:
+                continue
+            for callee in self.callees(id):
+                if cus[callee] == cu2_id:
+                    names.add(self.names[callee])
+                    pass
+                pass
+            pass
+        return names
+
+    def num_symbols(self):
+        return len(self.ids)
+
+    def num_calls(self):
+        return len(self.fwd_targets)
+    pass
+
+# Return a dict mapping ids reachable from start, following callees
+# if to_callee is True or callers otherwise, to their distances.
+#
+# Only ids at most max_dist calls away are visited.  The dict is in
+# the order of visiting (BFS).  If "stop" is given, the search goes
+# no further than it; it gets a distance but its neighbors are not
+# visited through it, unless it is the start.
+def bfs(graph, start, to_callee, max_dist, stop=None):
+    dists = {start: 0}
+    frontier = [start]
+    dist = 0
+    while frontier and dist < max_dist:
+        dist += 1
+        next_frontier = []
+        for id in frontier:
+            for neighbor in graph.neighbors(id, to_callee):
+                if neighbor in dists:
+                    continue
+                dists[neighbor] = dist
+                if neighbor != stop:
+                    next_frontier.append(neighbor)
+                    pass
+                pass
+            pass
+        frontier = next_frontier
+        pass
+    return dists
+
+# Expand one level of a search of shortest_path().
+#
+# Return the ids of the new frontier and the ids met by the other
+# search.
+def expand_level(graph, frontier, to_callee, parents, dists, other_dists,
+                 blocked, blocked_edges):
+    next_frontier = []
+    met = []
+    for id in frontier:
+        dist = dists[id] + 1
+        for neighbor in graph.neighbors(id, to_callee):
+            if neighbor in parents or neighbor in blocked:
+                continue
+            edge = (id, neighbor) if to_callee else (neighbor, id)
+            if edge in blocked_edges:
+                continue
+            parents[neighbor] = id
+            dists[neighbor] = dist
+            next_frontier.append(neighbor)
+            if neighbor in other_dists:
+                met.append(neighbor)
+                pass
+            pass
+        pass
+    return next_frontier, met
+
+# Return a shortest call path from src to tgt as a list of ids, or
+# None if there is no path.
+#
+# Ids in "blocked" never appear on the path, and (caller, callee)
+# pairs in "blocked_edges" are never followed.  Searches run from
+# both ends, expanding the smaller frontier a level at a time, and
+# stop at the first level where they meet.
+def shortest_path(graph, src, tgt, blocked=frozenset(),
+                  blocked_edges=frozenset()):
+    if src == tgt:
+        return [src]
+    fwd_parents = {src: None}
+    fwd_dists = {src: 0}
+    fwd_frontier = [src]
+    bwd_parents = {tgt: None}
+    bwd_dists = {tgt: 0}
+    bwd_frontier = [tgt]
+    while fwd_frontier and bwd_frontier:
+        if len(fwd_frontier) <= len(bwd_frontier):
+            fwd_frontier, met = expand_level(graph, fwd_frontier, True,
+                                             fwd_parents, fwd_dists,
+                                             bwd_dists,
+                                             blocked, blocked_edges)
+        else:
+            bwd_frontier, met = expand_level(graph, bwd_frontier, False,
+                                             bwd_parents, bwd_dists,
+                                             fwd_dists,
+                                             blocked, blocked_edges)
+            pass
+        if not met:
+            continue
+        middle = min(met, key=lambda id: fwd_dists[id] + bwd_dists[id])
+        path = []
+        id = middle
+        while id is not None:
+            path.append(id)
+            id = fwd_parents[id]
+            pass
+        path.reverse()
+        id = bwd_parents[middle]
+        while id is not None:
+            path.append(id)
+            id = bwd_parents[id]
+            pass
+        return path
+    return None
+
+# Return up to k shortest loopless call paths from src to tgt, in the
+# order of their lengths (Yen's algorithm).
+#
+# Every path after the first one deviates from one of the found paths
+# at a "spur" id.  The part before the spur id is kept, and a
+# shortest path from the spur id is searched without the ids of the
+# kept part and without the calls the found paths make at the spur id.
+def k_shortest_paths(graph, src, tgt, k, blocked=frozenset()):
+    path = shortest_path(graph, src, tgt, blocked)
+    if path is None:
+        return []
+    paths = [path]
+    seen = {tuple(path)}
+    candidates = []
+    while len(paths) < k:
+        prev = paths[-1]
+        for i in range(len(prev) - 1):
+            root = prev[:i + 1]
+            blocked_edges = set()
+            for found in paths:
+                if len(found) > i + 1 and found[:i + 1] == root:
+                    blocked_edges.add((found[i], found[i + 1]))
+                    pass
+                pass
+            spur_path = shortest_path(graph, prev[i], tgt,
+                                      blocked.union(root[:-1]),
+                                      blocked_edges)
+            if spur_path is None:
+                continue
+            candidate = root[:-1] + spur_path
+            if tuple(candidate) in seen:
+                continue
+            seen.add(tuple(candidate))
+            heapq.heappush(candidates, (len(candidate), candidate))
+            pass
+        if not candidates:
+            break
+        paths.append(heapq.heappop(candidates)[1])
+        pass
+    return paths
+
+# Build CSR arrays.
+#
+# "counts" gives (id, number of targets) pairs, and "targets" gives
+# 1-tuples of targets ordered by their sources.
+def build_csr(num_ids, counts, targets):
+    offsets = array('q', bytes(8 * (num_ids + 1)))
+    for id, count in counts:
+        offsets[id + 1] = count
+        pass
+    offsets = array('q', accumulate(offsets))
+    targets = array('q', map(itemgetter(0), targets))
+    return offsets, targets
+
+# Load the call graph from a database connection.
+def load(conn):
+    max_id = conn.execute('select max(id) from symbols').fetchone()[0] or 0
+    names = [None] * (max_id + 1)
+    cus = array('q', bytes(8 * (max_id + 1)))
+    for id, name, cu in conn.execute('select id, name, cu from symbols'):
+        names[id] = name
+        cus[id] = cu or 0
+        pass
+    cu_names = {name: id for id, name in
+                conn.execute('select id, name from compile_units')}
+
+    num_ids = max_id + 1
+    fwd_offsets, fwd_targets = build_csr(
+        num_ids,
+        conn.execute('select caller, count(*) from calls group by caller'),
+        conn.execute('select callee from calls order by caller, callee'))
+    rev_offsets, rev_targets = build_csr(
+        num_ids,
+        conn.execute('select callee, count(*) from calls group by callee'),
+        conn.execute('select caller from calls order by callee, caller'))
+    return CallGraph(names, fwd_offsets, fwd_targets,
+                     rev_offsets, rev_targets, cus, cu_names)
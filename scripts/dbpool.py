@@ -0,0 +1,113 @@
+#
+# Read-only connections to databases generated by mk-dwarf-db.py.
+#
+# mk-dwarf-db.py and upgrade-dwarf-db.py never modify a finished
+# database; they build a new file and rename it over the old one.  So
+# connections are opened with 'immutable=1', and SQLite skips file
+# locking and change detection entirely.  A connection keeps reading
+# the file it has opened, even after the file has been replaced.
+#
+# connect() opens one connection, for scripts reading the database
+# once.  ConnectionPool keeps connections for servers answering many
+# requests from many threads.  A thread takes a connection from the
+# pool, uses it and puts it back.  The pool is a deque; its append()
+# and pop() are atomic, so threads never wait on a lock for it.
+# Connections live across requests, and so do SQLite's page cache,
+# the memory map and the statements compiled by the sqlite3 module
+# (it caches CACHED_STATEMENTS prepared statements per connection).
+# When the file is replaced, connections to the old file are closed
+# instead of being used again, and new ones open the new file.
+#
+# Usage:
+#
+#   import dbpool
+#   pool = dbpool.ConnectionPool('callgraph.sqlite3')
+#   with pool.connection() as conn:
+#       conn.execute(...)
+#
+import os
+import sqlite3
+import urllib.parse
+from collections import deque
+from contextlib import contextmanager
+
+# Bytes of the database file mapped into memory; the OS shares mapped
+# pages between all connections and processes.
+MMAP_SIZE = 1 << 30
+# KiB of SQLite's page cache per connection (negative in the pragma).
+CACHE_SIZE = 64 * 1024
+# Prepared statements kept by each connection.
+CACHED_STATEMENTS = 256
+
+# Return the URI opening a file read-only.
+def read_only_uri(filename):
+    return 'file:%s?mode=ro&immutable=1' % \
+        urllib.parse.quote(os.path.abspath(filename))
+
+# Open a database read-only.  With check_same_thread=False, the
+# connection may be used by another thread than the one opening it,
+# but only by one thread at a time.
+def connect(filename, check_same_thread=True):
+    conn = sqlite3.connect(read_only_uri(filename), uri=True,
+                           check_same_thread=check_same_thread,
+                           cached_statements=CACHED_STATEMENTS)
+    conn.execute('pragma mmap_size = %d' % MMAP_SIZE)
+    conn.execute('pragma cache_size = %d' % -CACHE_SIZE)
+    return conn
+
+# Identify a build of a database file; a new build is a new file.
+def get_file_key(filename):
+    st = os.stat(filename)
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+class ConnectionPool:
+    def __init__(self, filename, max_idle=16):
+        self.filename = filename
+        # Connections not used now; at most max_idle are kept.
+        self.max_idle = max_idle
+        self.idle = deque()
+        pass
+
+    def acquire(self):
+        key = get_file_key(self.filename)
+        while True:
+            try:
+                conn_key, conn = self.idle.pop()
+            except IndexError:
+                return key, connect(self.filename, check_same_thread=False)
+            if conn_key == key:
+                return key, conn
+            # The file has been replaced.
+            conn.close()
+            pass
+        pass
+
+    def release(self, key, conn):
+        # A connection to a replaced file is closed by acquire().
+        if len(self.idle) < self.max_idle:
+            self.idle.append((key, conn))
+        else:
+            conn.close()
+            pass
+        pass
+
+    # Use a connection in a with statement and put it back at the end.
+    @contextmanager
+    def connection(self):
+        key, conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(key, conn)
+            pass
+        pass
+
+    def close(self):
+        while self.idle:
+            try:
+                self.idle.pop()[1].close()
+            except IndexError:
+                break
+            pass
+        pass
+    pass
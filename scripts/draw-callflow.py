@@ -4,22 +4,32 @@
 #
 # Usage: draw-callflow.py [-f <+caller|~callee>] [-n <levels>]
 #                         [-t <source>:<target>]
+#                         [-s <source>:<target> [-k <paths>]]
 #                         [-x <exclude-symbol>]
 #                         [-r <removed-symbol>]
 #                         [-L <symbol>]
-#                         [-o <output-file>] <database>
+#                         [-o <output-file>] [--server <host>:<port>]
+#                         <database>
 #
 # Options:
 #   -f <+caller|-callee>  Follow caller to functions called by the caller, or
 #                         follow callee to functions calling the callee.
 #   -n <levels>           Number of levels to follow.
 #   -t <source>:<target>  Follow the call path from the source to the target.
+#   -s <source>:<target>  Draw the shortest call path from the source to the
+#                         target. -n doesn't apply.
+#   -k <paths>            Draw the <paths> shortest call paths for -s.
 #   -x <exclude-symbol>   Exclude the specified symbol. Stop following the
 #                         symbol.
 #   -r <exclude-symbol>   Remove the specified symbol. Stop following the
 #                         symbol and remove the edges to the symbol.
+#                         For -s, paths never go through symbols given
+#                         by -x or -r.
 #   -L <symbol>           Highlight the specified symbol.
 #   -o <output-file>      Output file name. If not specified, output to stdout.
+#   --server <host>:<port>
+#                         Send the query to query-server.py instead of
+#                         loading the database.
 #
 # You can specify multiple -f options to follow multiple call paths.
 #
@@ -29,9 +39,16 @@
 # This will draw a call flow graph with two levels of callers and two levels of
 # callees.
 #
+#   draw-callflow.py -s sys_sendmsg:dev_queue_xmit -k 3 my-database
+#
+# This will draw the three shortest call paths from sys_sendmsg to
+# dev_queue_xmit.
+#
 import sys
 import optparse
-import sqlite3
+import dbpool
+import callgraph
+import queryclient
 
 #
 # Database schema:
@@ -43,8 +60,14 @@ import sqlite3
 #
 #    CREATE TABLE calls (
 #        caller integer,
-#        callee integer
-#    );
+#        callee integer,
+#        primary key(caller, callee)
+#    ) WITHOUT ROWID;
+#
+#    CREATE INDEX calls_callee ON calls(callee, caller);
+#
+# Both tables are loaded once into a CallGraph (see callgraph.py);
+# all traversals run in memory.
 #
 
 class CallflowNode:
@@ -53,13 +76,17 @@ class CallflowNode:
         self.name = name
         self.tree = tree
         self.children = []
+        # For membership tests; hubs like kfree have many thousands
+        # of callers.
+        self.children_set = set()
         self.extra_label = []
         pass
 
     def add_non_existing_child(self, child):
-        if child in self.children:
+        if child in self.children_set:
             return False
         self.children.append(child)
+        self.children_set.add(child)
         return True
 
     def is_in_set(self, set):
@@ -151,31 +178,21 @@ class CallflowTree:
         pass
     pass
 
-def create_callflow_tree(conn, name, levels, exclude, remove,
+def create_callflow_tree(graph, name, levels, exclude, remove,
                          highlight, to_callee):
-    id = conn.execute("SELECT id FROM symbols WHERE name = ?",
-                      (name,)).fetchone()[0]
+    id = graph.get_id(name)
     tree = CallflowTree(id, name, to_callee)
     if tree.root.is_in_set(highlight):
         tree.root.mark_as_highlight()
         pass
-    tasks = [(name, levels)]
+    tasks = [(id, levels)]
     while tasks:
-        (name, level) = tasks.pop()
+        (id, level) = tasks.pop()
         if level == 0:
             continue
-        id = conn.execute("SELECT id FROM symbols WHERE name = ?",
-                          (name,)).fetchone()[0]
-        if to_callee:
-            query = "SELECT callee FROM calls WHERE caller = ?"
-        else:
-            query = "SELECT caller FROM calls WHERE callee = ?"
-            pass
-        for row in conn.execute(query, (id,)):
-            callee_or_caller = row[0]
-            child_name = \
-                conn.execute("SELECT name FROM symbols WHERE id = ?",
-                             (callee_or_caller,)).fetchone()[0]
+        parent_node = tree.symbols[graph.get_name(id)]
+        for callee_or_caller in graph.neighbors(id, to_callee):
+            child_name = graph.get_name(callee_or_caller)
             if child_name in remove:
                 continue
             if child_name in tree.symbols:
@@ -189,89 +206,268 @@ def create_callflow_tree(conn, name, levels, exclude, remove,
             if node.is_in_set(highlight):
                 node.mark_as_highlight()
                 pass
-            if tree.symbols[name].add_non_existing_child(node) \
+            if parent_node.add_non_existing_child(node) \
                and new_node \
                and child_name not in exclude:
-                tasks.append((child_name, level - 1))
+                tasks.append((callee_or_caller, level - 1))
                 pass
             pass
         pass
     return tree
 
-def create_callflow_tree_target(conn, source, target, levels, highlight):
+# Distances from sources and to targets of -t, shared by all pairs
+# with the same ends.  Paths stop at the target and don't go back to
+# the source, so a search from one end stops at the other.
+class TargetSearches:
+    def __init__(self, graph, levels):
+        self.graph = graph
+        # A call on a path of at most "levels" calls is at most
+        # levels - 1 calls away from both ends.
+        self.max_dist = levels - 1
+        self.from_sources = {}
+        self.to_targets = {}
+        pass
+
+    def from_source(self, src_id, tgt_id):
+        key = (src_id, tgt_id)
+        if key not in self.from_sources:
+            self.from_sources[key] = \
+                callgraph.bfs(self.graph, src_id, True, self.max_dist,
+                              tgt_id)
+            pass
+        return self.from_sources[key]
+
+    def to_target(self, src_id, tgt_id):
+        key = (src_id, tgt_id)
+        if key not in self.to_targets:
+            self.to_targets[key] = \
+                callgraph.bfs(self.graph, tgt_id, False, self.max_dist,
+                              src_id)
+            pass
+        return self.to_targets[key]
+    pass
+
+def create_callflow_tree_target(graph, source, target, levels, highlight,
+                                searches):
     '''Create a call flow tree from the source to the target.
 
-    This function creates a call flow tree from the source to the target.
-    The function returns the call flow tree.
+    This function creates a call flow tree of all calls lying on a call
+    path from the source to the target with at most the given number of
+    calls. The function returns the call flow tree.
+
+    A call from u to v is on such a path if
+
+        dist(source, u) + 1 + dist(v, target) <= levels
+
+    Distances are found by a BFS from the source over callees and a BFS
+    from the target over callers, so the time is linear to the size of
+    the graph instead of the number of paths.  Paths stop at the target
+    and don't go back to the source; the searches don't go past either
+    end.  Recursive calls are not on any simple path and are skipped,
+    but other cycles within the bound may show up.
 
     Args:
-        conn: The database connection.
+        graph: The call graph loaded by callgraph.load().
         source: The source function name.
         target: The target function name.
         levels: The number of levels to follow.
         highlight: The set of symbols to highlight.
+        searches: The TargetSearches shared by all -t options.
 
     Returns:
         The call flow tree.
     '''
-    src_id = conn.execute("SELECT id FROM symbols WHERE name = ?",
-                            (source,)).fetchone()[0]
-    tgt_id = conn.execute("SELECT id FROM symbols WHERE name = ?",
-                            (target,)).fetchone()[0]
+    src_id = graph.get_id(source)
+    tgt_id = graph.get_id(target)
     tree = CallflowTree(src_id, source, True)
     if tree.root.is_in_set(highlight):
         tree.root.mark_as_highlight()
         pass
-    tasks = [([source], levels)]
-    while tasks:
-        (path, level) = tasks.pop()
-        if level == 0:
+    if levels <= 0:
+        return tree
+    from_source = searches.from_source(src_id, tgt_id)
+    to_target = searches.to_target(src_id, tgt_id)
+    for caller, caller_dist in from_source.items():
+        if caller == tgt_id and caller != src_id:
             continue
-        name = path[-1]
-        id = conn.execute("SELECT id FROM symbols WHERE name = ?",
-                            (name,)).fetchone()[0]
-        for row in conn.execute("SELECT callee FROM calls WHERE caller = ?",
-                                (id,)):
-            callee = row[0]
-            callee_name = \
-                conn.execute("SELECT name FROM symbols WHERE id = ?",
-                             (callee,)).fetchone()[0]
-            if callee_name == target:
-                fullpath = path + [callee_name]
-                for i in range(1, len(fullpath)):
-                    parent_name = fullpath[i - 1]
-                    child_name = fullpath[i]
-
-                    parent_id = conn.execute("SELECT id FROM symbols WHERE name = ?",
-                                            (parent_name,)).fetchone()[0]
-                    child_id = conn.execute("SELECT id FROM symbols WHERE name = ?",
-                                            (child_name,)).fetchone()[0]
-                    parent_node = tree.symbols[parent_name]
-                    if child_name in tree.symbols:
-                        node = tree.symbols[child_name]
-                    else:
-                        node = CallflowNode(child_id, child_name, tree)
-                        tree.symbols[child_name] = node
-                        pass
-                    if node.is_in_set(highlight):
-                        node.mark_as_highlight()
-                        pass
-                    parent_node.add_non_existing_child(node)
-                    pass
+        for callee in graph.callees(caller):
+            if callee == caller and callee != tgt_id:
+                continue
+            if callee == src_id and callee != tgt_id:
+                continue
+            callee_dist = to_target.get(callee)
+            if callee_dist is None or \
+               caller_dist + 1 + callee_dist > levels:
+                continue
+            # Callers are visited in the order of the BFS, so a caller
+            # on a path has been added by the call before it.
+            parent_node = tree.symbols.get(graph.get_name(caller))
+            if parent_node is None:
+                continue
+            callee_name = graph.get_name(callee)
+            if callee_name in tree.symbols:
+                node = tree.symbols[callee_name]
+            else:
+                node = CallflowNode(callee, callee_name, tree)
+                tree.symbols[callee_name] = node
+                pass
+            if node.is_in_set(highlight):
+                node.mark_as_highlight()
+                pass
+            parent_node.add_non_existing_child(node)
+            pass
+        pass
+    return tree
+
+def create_callflow_tree_paths(graph, source, target, num_paths,
+                               exclude, remove, highlight):
+    '''Create a call flow tree of the shortest paths from the source to
+    the target.
+
+    Like -f, symbols in "exclude" are not followed and symbols in
+    "remove" never show up; so neither can be in the middle of a path.
+    The source is always followed, and the target can be excluded but
+    not removed.
+
+    Args:
+        graph: The call graph loaded by callgraph.load().
+        source: The source function name.
+        target: The target function name.
+        num_paths: The number of shortest paths to find.
+        exclude: The set of symbols to exclude.
+        remove: The set of symbols to remove.
+        highlight: The set of symbols to highlight.
+
+    Returns:
+        The call flow tree, or None if there is no path.
+    '''
+    src_id = graph.get_id(source)
+    tgt_id = graph.get_id(target)
+    if target in remove:
+        return None
+    blocked = set(graph.get_id(name) for name in exclude + remove
+                  if graph.has_name(name))
+    blocked.discard(src_id)
+    blocked.discard(tgt_id)
+    paths = callgraph.k_shortest_paths(graph, src_id, tgt_id, num_paths,
+                                       blocked)
+    if not paths:
+        return None
+    tree = CallflowTree(src_id, source, True)
+    if tree.root.is_in_set(highlight):
+        tree.root.mark_as_highlight()
+        pass
+    for path in paths:
+        for i in range(1, len(path)):
+            parent_node = tree.symbols[graph.get_name(path[i - 1])]
+            child_name = graph.get_name(path[i])
+            if child_name in tree.symbols:
+                node = tree.symbols[child_name]
+            else:
+                node = CallflowNode(path[i], child_name, tree)
+                tree.symbols[child_name] = node
                 pass
-            elif callee_name not in path:
-                tasks.append((path + [callee_name], level - 1))
+            if node.is_in_set(highlight):
+                node.mark_as_highlight()
                 pass
+            parent_node.add_non_existing_child(node)
             pass
         pass
     return tree
 
 def usage():
     print("Usage: %s [-f <+caller|-callee>] [-n <levels>]" % sys.argv[0])
-    print("          [-t <source>:<target>] [-x <exclude-symbol>] [-r <remove-symbol>] [-o <output-file>] <database>")
+    print("          [-t <source>:<target>] [-s <source>:<target> [-k <paths>]]")
+    print("          [-x <exclude-symbol>] [-r <remove-symbol>] [-o <output-file>] <database>")
     sys.exit(1)
     pass
 
+# Replace None of options of main() with their defaults.
+def normalize_options(options):
+    for name in ("follow", "target", "shortest", "exclude", "remove",
+                 "highlight"):
+        if getattr(options, name, None) is None:
+            setattr(options, name, [])
+            pass
+        pass
+
+    if getattr(options, "levels", None) is None:
+        options.levels = 5
+        pass
+
+    if getattr(options, "paths", None) is None:
+        options.paths = 1
+        pass
+    pass
+
+def split_pair(pair):
+    if pair.count(":") != 1:
+        raise queryclient.QueryError("Expect <source>:<target>, not %s." % pair)
+    (source, target) = pair.split(":")
+    return (source.strip(), target.strip())
+
+def draw_callflow(graph, options, out, err=sys.stderr):
+    '''Draw the call flow graph asked by options of main().
+
+    Args:
+        graph: The call graph loaded by callgraph.load().
+        options: The options of main() with lists instead of None.
+        out: The stream to write the dot file to.
+        err: The stream to write warnings to.
+
+    Raises:
+        queryclient.QueryError: Bad options or unknown symbols.
+    '''
+    for follow in options.follow:
+        if follow[:1] not in ("+", "~"):
+            raise queryclient.QueryError("Expect +caller or ~callee, not %s." % follow)
+        pass
+    pairs = [split_pair(pair) for pair in options.target + options.shortest]
+    for name in [follow[1:] for follow in options.follow] + \
+        [name for pair in pairs for name in pair]:
+        if not graph.has_name(name):
+            raise queryclient.QueryError("Symbol %s is not found." % name)
+        pass
+
+    tries = []
+    for follow in options.follow:
+        tree = create_callflow_tree(graph, follow[1:],
+                                    options.levels,
+                                    options.exclude,
+                                    options.remove,
+                                    options.highlight,
+                                    follow.startswith("+"))
+        tries.append(tree)
+        pass
+    searches = TargetSearches(graph, options.levels)
+    for target in options.target:
+        (source, target) = split_pair(target)
+        tree = create_callflow_tree_target(graph, source, target,
+                                           options.levels, options.highlight,
+                                           searches)
+        tries.append(tree)
+        pass
+    for shortest in options.shortest:
+        (source, target) = split_pair(shortest)
+        tree = create_callflow_tree_paths(graph, source, target,
+                                          options.paths,
+                                          options.exclude,
+                                          options.remove,
+                                          options.highlight)
+        if tree is None:
+            err.write("No call path from %s to %s.\n" % (source, target))
+            continue
+        tries.append(tree)
+        pass
+
+    draw_hist = set()
+    out.write("digraph callflow {\n")
+    for tree in tries:
+        tree.draw(out, draw_hist)
+        pass
+    out.write("}\n")
+    pass
+
 def main():
     parser = optparse.OptionParser()
     parser.add_option("-f", "--follow", dest="follow", action="append",
@@ -281,6 +477,11 @@ def main():
                       help="Number of levels to follow.")
     parser.add_option("-t", "--target", dest="target", action="append",
                       help="Follow the call path from the source to the target.")
+    parser.add_option("-s", "--shortest", dest="shortest", action="append",
+                      help="Draw the shortest call path from the source to "
+                      "the target.")
+    parser.add_option("-k", "--paths", dest="paths", type="int", default=1,
+                      help="Number of shortest call paths to draw for -s.")
     parser.add_option("-x", "--exclude", dest="exclude", action="append",
                         help="Exclude the specified symbol. Stop following the "
                         "symbol.")
@@ -291,39 +492,21 @@ def main():
                       help="Highlight the specified symbol.")
     parser.add_option("-o", "--output", dest="output",
                       help="Output file name. If not specified, output to stdout.")
+    parser.add_option("--server", dest="server", metavar="HOST:PORT",
+                      help="Send the query to query-server.py (default "
+                      "address: %s)." % queryclient.DEFAULT_SERVER)
     (options, args) = parser.parse_args()
 
     if len(args) != 1:
         usage()
         pass
 
-    if options.follow is None and options.target is None:
+    if options.follow is None and options.target is None \
+       and options.shortest is None:
         usage()
         pass
 
-    if options.follow is None:
-        options.follow = []
-        pass
-
-    if options.levels is None:
-        options.levels = 5
-        pass
-
-    if options.target is None:
-        options.target = []
-        pass
-
-    if options.exclude is None:
-        options.exclude = []
-        pass
-
-    if options.remove is None:
-        options.remove = []
-        pass
-
-    if options.highlight is None:
-        options.highlight = []
-        pass
+    normalize_options(options)
 
     if options.output is None:
         out = sys.stdout
@@ -331,47 +514,24 @@ def main():
         out = open(options.output, "w")
         pass
 
-    conn = sqlite3.connect(args[0])
-
-    tries = []
-    for follow in options.follow:
-        if follow.startswith("+"):
-            tree = create_callflow_tree(conn, follow[1:],
-                                        options.levels,
-                                        options.exclude,
-                                        options.remove,
-                                        options.highlight,
-                                        True)
-        elif follow.startswith("~"):
-            tree = create_callflow_tree(conn, follow[1:],
-                                        options.levels,
-                                        options.exclude,
-                                        options.remove,
-                                        options.highlight,
-                                        False)
+    try:
+        if options.server:
+            query = {key: value for key, value in vars(options).items()
+                     if key not in ("output", "server")}
+            out.write(queryclient.query_output(options.server, "/callflow",
+                                               args[0], {"options": query}))
         else:
-            usage()
+            conn = dbpool.connect(args[0])
+            graph = callgraph.load(conn)
+            conn.close()
+            draw_callflow(graph, options, out)
             pass
-        tries.append(tree)
-        pass
-    for target in options.target:
-        (source, target) = target.split(":")
-        source = source.strip()
-        target = target.strip()
-        tree = create_callflow_tree_target(conn, source, target,
-                                           options.levels, options.highlight)
-        tries.append(tree)
-        pass
-
-    draw_hist = set()
-    out.write("digraph callflow {\n")
-    for tree in tries:
-        tree.draw(out, draw_hist)
+    except queryclient.QueryError as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
         pass
-    out.write("}\n")
     pass
 
 if __name__ == "__main__":
     main()
     pass
-
@@ -8,43 +8,32 @@
 #                      [-x <exclude-type>] [-X <strict-exclude-type>]
 #                      [-L <highlight-type>]
 #                      [-o <output-file>]
-#                      [-i]
+#                      [-i] [--server <host>:<port>]
 #                      <database>
 #
-# Schema of the DB
-#   create table symbols(id integer primary key asc, name text unique)
-#   create table calls(caller integer, callee integer)
+# Schema of the DB (version 2 and later)
+#   create table symbols(id integer primary key asc, name text unique, \
+#                        cu integer, binary integer)
+#   create table calls(caller integer, callee integer, \
+#                      primary key(caller, callee)) without rowid
 #   create table types(id integer primary key asc, name text, \
-#                      addr integer unique, meta_type text, declaration integer)
+#                      addr integer, meta_type integer, declaration integer, \
+#                      binary integer, unique(binary, addr))
 #   create table members(type_id integer, name text, \
-#                        type integer, offset integer)
+#                        type integer, offset integer, seq integer, \
+#                        primary key(type_id, seq)) without rowid
+#   create table meta_types(id integer primary key asc, name text unique)
+#   create table schema_info(key text primary key, value)
+#   create index members_type on members(type, type_id)
+#   create index types_name on types(name)
+#
+# The DB is read through typegraph.TypeQueries, or typegraph.TypeGraph
+# by query-server.py; both are called "db" below.
 import sys
-import sqlite3
 import argparse
-
-# Return a list of type IDs of a given type name
-def get_type_ids(db, name):
-    cur = db.cursor()
-    cur.execute('select id from types where name = ?', (name,))
-    return [row[0] for row in cur]
-
-# Return a list of members of a given type ID.
-def get_members(db, type_id):
-    cur = db.cursor()
-    cur.execute('select * from members where type_id = ?', (type_id,))
-    return cur
-
-# Return the type of a given ID.
-def get_type(db, type_id):
-    cur = db.cursor()
-    cur.execute('select * from types where id = ?', (type_id,))
-    return cur.fetchone()
-
-# Return a list of type IDs depending on a given type ID.
-def get_dependant_ids(db, type_id):
-    cur = db.cursor()
-    cur.execute('select type_id from members where type = ?', (type_id,))
-    return [row[0] for row in cur]
+import dbpool
+import typegraph
+import queryclient
 
 class Member:
     def __init__(self, name, type_id, offset):
@@ -65,7 +54,7 @@ class Type:
         db = self.db
         id = self.id
 
-        row = get_type(db, id)
+        row = db.get_type(id)
         self.id = row[0]
         self.name = row[1]
         self.addr = row[2]
@@ -73,12 +62,10 @@ class Type:
         self.declaration = row[4]
         self.members = []
 
-        cur = get_members(db, id)
-        for row in cur:
+        for row in db.get_members(id):
             member = Member(row[1], row[2], row[3])
             self.members.append(member)
             pass
-        cur.close()
         pass
 
     def get_full_name_slow(self):
@@ -146,7 +133,7 @@ transit_types = [
 def in_set(_type, set):
     return _type.name in set or '@' + str(_type.id) in set
 
-def draw_type_node(_type, show_id, highlight_types):
+def draw_type_node(_type, show_id, highlight_types, out):
     attrs = ['shape=rect']
     if in_set(_type, highlight_types):
         attrs.append('color=red')
@@ -156,13 +143,13 @@ def draw_type_node(_type, show_id, highlight_types):
     else:
         attrs.append('label="%s"' % _type.get_full_name())
         pass
-    print('  "%s" [%s];' % (_type.id, ','.join(attrs)))
+    out.write('  "%s" [%s];\n' % (_type.id, ','.join(attrs)))
     pass
 
 def draw_types(db, type_ids, max_levels,
                exclude_types, strict_exclude_types,
                highlight_types,
-               show_id=False):
+               show_id=False, out=sys.stdout):
     tasks = [(Type(db, type_id), to_descendant, 0, None)
              for type_id, to_descendant in type_ids]
     visited = set()
@@ -180,7 +167,7 @@ def draw_types(db, type_ids, max_levels,
             continue
         visited.add(_type.id)
         if _type.id not in has_labels:
-            draw_type_node(_type, show_id, highlight_types)
+            draw_type_node(_type, show_id, highlight_types, out)
             has_labels.add(_type.id)
             pass
         if lvl > max_levels and max_levels > 0:
@@ -200,7 +187,7 @@ def draw_types(db, type_ids, max_levels,
                     continue
                 pass
             if member_type.id not in has_labels:
-                draw_type_node(member_type, show_id, highlight_types)
+                draw_type_node(member_type, show_id, highlight_types, out)
                 has_labels.add(member_type.id)
                 pass
             if _type.meta_type in ('DW_TAG_structure_type', 'DW_TAG_union_type'):
@@ -212,9 +199,9 @@ def draw_types(db, type_ids, max_levels,
                 pass
             if edge not in visited:
                 if do_label:
-                    print('  "%s" -> "%s" [label="%s"];' % (_type.id, member_type.id, member.name))
+                    out.write('  "%s" -> "%s" [label="%s"];\n' % (_type.id, member_type.id, member.name))
                 else:
-                    print('  "%s" -> "%s";' % (_type.id, member_type.id))
+                    out.write('  "%s" -> "%s";\n' % (_type.id, member_type.id))
                     pass
                 visited.add(edge)
                 if to_descendant:
@@ -229,13 +216,49 @@ def draw_types(db, type_ids, max_levels,
                 continue
             if _type.name in exclude_types or ('@' + str(_type.id)) in exclude_types:
                 continue
-            for dependant_id in get_dependant_ids(db, _type.id):
+            for dependant_id in db.get_dependant_ids(_type.id):
                 tasks.append((Type(db, dependant_id), to_descendant, lvl + 1, _type.id))
                 pass
             pass
         pass
     pass
 
+# Draw the diagram of the types given by -t options.
+#
+# "args" holds options of main(), as attributes.  Raise
+# queryclient.QueryError for bad options.
+def draw_types_diagram(db, args, out):
+    # Get the type IDs of the given type names
+    type_ids = []
+    for type_name in args.type or []:
+        if type_name[:1] == '+':
+            to_descendant = True
+        elif type_name[:1] == '~':
+            to_descendant = False
+        else:
+            raise queryclient.QueryError('Type name must start with + or ~: %s' % type_name)
+        if type_name[1:].startswith('@'):
+            type_id = int(type_name[2:])
+            if db.get_type(type_id) is None:
+                raise queryclient.QueryError('Type %s is not found.' % type_name[1:])
+            type_ids.append((type_id, to_descendant))
+        else:
+            type_ids += [(type_id, to_descendant)
+                         for type_id in db.get_type_ids(type_name[1:])]
+            pass
+        pass
+
+    out.write('digraph G {\n')
+    out.write('  graph [rankdir=LR];\n')
+    out.write('  node [shape=record];\n')
+    draw_types(db, type_ids, args.max_levels or 5,
+               set(args.exclude_type or []),
+               set(args.strict_exclude_type or []),
+               args.highlight or [],
+               show_id=args.show_id, out=out)
+    out.write('}\n')
+    pass
+
 def main():
     parser = argparse.ArgumentParser(description='Draw a diagram of given types and their dependencies.')
     parser.add_argument('db', help='database file')
@@ -246,46 +269,30 @@ def main():
     parser.add_argument('-L', '--highlight', action='append', help='type name or id to highlight')
     parser.add_argument('-i', '--show-id', action='store_true', help='show address of types')
     parser.add_argument('-o', '--output-file', help='output file')
+    parser.add_argument('--server', metavar='HOST:PORT',
+                        help='send the query to query-server.py (default address: %s)' % queryclient.DEFAULT_SERVER)
     args = parser.parse_args()
 
-    if not args.highlight:
-        args.highlight = []
-        pass
     if args.output_file:
-        sys.stdout = open(args.output_file, 'w')
-
-    print('digraph G {')
-    print('  graph [rankdir=LR];')
-    print('  node [shape=record];')
-
-    db = sqlite3.connect(args.db)
-    db.row_factory = sqlite3.Row
+        out = open(args.output_file, 'w')
+    else:
+        out = sys.stdout
+        pass
 
-    # Get the type IDs of the given type names
-    type_ids = []
-    for type_name in args.type:
-        if type_name[0] == '+':
-            to_descendant = True
-        elif type_name[0] == '~':
-            to_descendant = False
+    try:
+        if args.server:
+            options = {key: value for key, value in vars(args).items()
+                       if key not in ('db', 'output_file', 'server')}
+            out.write(queryclient.query_output(args.server, '/types', args.db,
+                                               {'options': options}))
         else:
-            raise 'Type name must start with + or ~'
-            pass
-        if type_name[1:].startswith('@'):
-            type_id = int(type_name[2:])
-            type_ids.append((type_id, to_descendant))
-        else:
-            type_ids += [(type_id, to_descendant)
-                         for type_id in get_type_ids(db, type_name[1:])]
+            db = dbpool.connect(args.db)
+            draw_types_diagram(typegraph.TypeQueries(db), args, out)
             pass
+    except (queryclient.QueryError, typegraph.SchemaError) as e:
+        print('%s: %s' % (sys.argv[0], e), file=sys.stderr)
+        sys.exit(1)
         pass
-    draw_types(db, type_ids, args.max_levels or 5,
-               set(args.exclude_type or []),
-               set(args.strict_exclude_type or []),
-               args.highlight,
-               show_id=args.show_id)
-
-    print('}')
     pass
 
 if __name__ == '__main__':
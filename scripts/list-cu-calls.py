@@ -5,51 +5,78 @@ This program reads a database generated by mk-dwarf-db.py and lists calls
 from one CU to another CU. The program reads the database and prints the
 calls between the two CUs.
 
-Usage: list-cu-calls.py <database> <cu1> <cu2>
+Usage: list-cu-calls.py [--server <host>:<port>] <database> <cu1> <cu2>
+
+With --server, the query is sent to a running query-server.py instead.
 '''
 import sys
-import sqlite3
+import dbpool
+import optparse
+import queryclient
 
-def list_cu_calls(db_file, cu1, cu2):
-    '''List calls between two CUs from a database.
+def find_cu_calls(conn, cu1, cu2):
+    '''Find calls between two CUs in a database.
 
-    This function reads a database and lists calls from one CU to another CU.
+    This function returns the names of functions in cu2 called by
+    functions in cu1, sorted.
     '''
-    conn = sqlite3.connect(db_file)
     c = conn.cursor()
 
     # Get the ID of the CUs
     c.execute('SELECT id FROM compile_units WHERE name = ?', (cu1,))
     cu1_id = c.fetchone()
     if cu1_id is None:
-        print(f'CU {cu1} not found.')
-        sys.exit(1)
-        pass
+        raise queryclient.QueryError(f'CU {cu1} not found.')
     cu1_id = cu1_id[0]
 
     c.execute('SELECT id FROM compile_units WHERE name = ?', (cu2,))
     cu2_id = c.fetchone()
     if cu2_id is None:
-        print(f'CU {cu2} not found.')
-        sys.exit(1)
-        pass
+        raise queryclient.QueryError(f'CU {cu2} not found.')
     cu2_id = cu2_id[0]
 
     # Get the calls between the two CUs
     c.execute('SELECT sym_b.name FROM calls INNER JOIN symbols sym_a ON caller == sym_a.id INNER JOIN symbols sym_b ON callee == sym_b.id WHERE sym_a.cu = ? AND sym_b.cu = ?', (cu1_id, cu2_id))
-    calls = set([r[0] for r in c.fetchall()])
-    print(f'Calls from {cu1} to {cu2}:')
+    return sorted(set([r[0] for r in c.fetchall()]))
+
+def print_cu_calls(cu1, cu2, calls, out=sys.stdout):
+    out.write(f'Calls from {cu1} to {cu2}:\n')
     for callee_name in calls:
-        print(f' - {callee_name}')
+        out.write(f' - {callee_name}\n')
         pass
+    pass
+
+def list_cu_calls(db_file, cu1, cu2):
+    '''List calls between two CUs from a database.
 
+    This function reads a database and lists calls from one CU to another CU.
+    '''
+    conn = dbpool.connect(db_file)
+    calls = find_cu_calls(conn, cu1, cu2)
     conn.close()
+    print_cu_calls(cu1, cu2, calls)
     pass
 
 if __name__ == '__main__':
-    if len(sys.argv) != 4:
+    parser = optparse.OptionParser(usage=__doc__)
+    parser.add_option('--server', dest='server', metavar='HOST:PORT',
+                      help='send the query to query-server.py (default'
+                      ' address: %s)' % queryclient.DEFAULT_SERVER)
+    (options, args) = parser.parse_args()
+    if len(args) != 3:
         print(__doc__)
         sys.exit(1)
         pass
-    list_cu_calls(sys.argv[1], sys.argv[2], sys.argv[3])
+    try:
+        if options.server:
+            sys.stdout.write(queryclient.query_output(
+                options.server, '/cu-calls', args[0],
+                {'cu1': args[1], 'cu2': args[2]}))
+        else:
+            list_cu_calls(args[0], args[1], args[2])
+            pass
+    except queryclient.QueryError as e:
+        print(e)
+        sys.exit(1)
+        pass
     pass
@@ -6,11 +6,26 @@ import os
 import time
 import itertools
 import hashlib
+import heapq
+import multiprocessing
+import fnmatch
+import pickle
+import json
+import mmap
+import zlib
+from io import BytesIO
+import contextlib
+import resource
 from pprint import pprint
+import dataclasses
 from dataclasses import dataclass, field
 from typing import List
 from elftools.elf.elffile import ELFFile
-from collections import deque
+from elftools.dwarf.enums import ENUM_DW_FORM
+from elftools.dwarf.die import DIE
+from elftools.dwarf.dwarfinfo import DebugSectionDescriptor
+from elftools.elf.relocation import RelocationHandler
+from collections import deque, namedtuple
 
 origin_attrs = ('DW_AT_abstract_origin', 'DW_AT_call_origin')
 
@@ -73,6 +88,16 @@ MT_table = {
 
 MT_table_rev = {v: k for k, v in MT_table.items()}
 
+# Version of the schema of the database.  Bump it for every change of
+# the schema, and teach upgrade-dwarf-db.py to convert the old one.
+#
+#  1. meta_type in text.
+#  2. meta_type in integer (meta_types table), WITHOUT ROWID calls
+#     and members tables, indexes for reverse lookups and the
+#     schema_info table.
+#  3. name_index, a full-text index of names for completion.
+SCHEMA_VERSION = 3
+
 type_tags = (MT_array,
              MT_base,
              MT_const,
@@ -128,8 +153,8 @@ class TypeInfo:
     replaced_by: int = -1
     visited: int = -1
     chosen: bool = False
-    to_loop_head: bool = False
     sig: str = ''
+    sig_id: int = -1
     def choose_params(self, members=False, values=False, params=False):
         if int(members) + int(values) + int(params) != 1:
             raise ValueError('Only one of members, values, params can be True')
@@ -187,135 +212,236 @@ def find_enclosing_type(stk):
 class CFDB:
     def __init__(self, conn):
         self.conn = conn
+        # Maps from names to ids.  Ids are assigned here instead of by
+        # sqlite so that we don't have to query them back.
+        self.cu_ids = {}
+        self.symbol_ids = {}
+        self.binary_ids = {}
+        # Names of symbols defined (having low_pc) by a binary
+        # persisted so far.
+        self.defined_symbols = set()
+        self.type_id = 0
+        # The DB is built in tmp_filename and moved to filename when
+        # it is done.  See create_CFDB() and finish_CFDB().
+        self.filename = None
+        self.tmp_filename = None
+        pass
+
+    def init_build_pragmas(self):
+        # The DB is built from scratch by a single writer.  We don't
+        # need a journal or durability until the final commit.
+        conn = self.conn
+        conn.execute('pragma journal_mode = off')
+        conn.execute('pragma synchronous = off')
+        conn.execute('pragma locking_mode = exclusive')
+        conn.execute('pragma temp_store = memory')
+        conn.execute('pragma cache_size = -1048576') # 1GB
+        pass
+
+    # Prepare the DB for readers once all rows and indexes are in.
+    #
+    # The DB is never written again, so the rollback journal is
+    # enough; readers never wait for a writer.  WAL is not used since
+    # its -wal and -shm files are looked up by the path, and would be
+    # shared by readers of the replaced file and the new one.
+    def init_read_pragmas(self):
+        conn = self.conn
+        conn.execute('analyze')
+        conn.execute('pragma optimize')
+        conn.execute('pragma journal_mode = delete')
+        self.commit()
         pass
 
     def init_schema(self):
         # All functions (subprograms). The name "symbols" is misleading.
-        self.conn.execute('create table symbols(id integer primary key asc, name text unique, cu integer)')
-        # Calls between functions
-        self.conn.execute('create table calls(caller integer, callee integer, unique(caller, callee))')
+        self.conn.execute('create table symbols(id integer primary key asc, name text unique, cu integer, binary integer)')
+        # Calls between functions.  Clustered by caller; see
+        # create_indexes() for the reverse direction.
+        self.conn.execute('create table calls(caller integer, callee integer, primary key(caller, callee)) without rowid')
         # Types
-        self.conn.execute('create table types(id integer primary key asc, name text, addr integer unique, meta_type text, declaration integer)')
+        # "addr" is the offset of the DIE in the binary.
+        # "meta_type" is the key to the "meta_types" table.
+        self.conn.execute('create table types(id integer primary key asc, name text, addr integer, meta_type integer, declaration integer, binary integer, unique(binary, addr))')
         # Members of a type. "type_id" is the id in the "types" table.
-        self.conn.execute('create table members(type_id integer, name text, type integer, offset integer)')
+        # "seq" keeps the order of members in a type.
+        self.conn.execute('create table members(type_id integer, name text, type integer, offset integer, seq integer, primary key(type_id, seq)) without rowid')
         # Compile units. "cu" in symbols table is the key to this table.
         self.conn.execute('create table compile_units(id integer primary key asc, name text unique)')
+        # ELF files.  "binary" in symbols and types tables is the key
+        # to this table.
+        self.conn.execute('create table binaries(id integer primary key asc, name text unique)')
+        # Names of meta types, DW_TAG_*.
+        self.conn.execute('create table meta_types(id integer primary key asc, name text unique)')
+        self.conn.executemany('insert into meta_types(id, name) values(?, ?)',
+                              sorted(MT_table_rev.items()))
+        self.conn.execute('create table schema_info(key text primary key, value)')
+        self.conn.execute('insert into schema_info(key, value) values(?, ?)',
+                          ('version', SCHEMA_VERSION))
+        self.commit()
         pass
 
-    def insert_symbols(self, symbols):
+    # Indexes are created after all rows are inserted.  It is much
+    # faster than maintaining them during bulk inserts.
+    def create_indexes(self):
         conn = self.conn
-        for symbol, cu_id in symbols:
-            try:
-                conn.execute('insert into symbols (name, cu) values(?, ?)',
-                             (symbol, cu_id))
-            except sqlite3.IntegrityError:
-                #print('symbol %s already exists' % symbol)
-                pass
-            pass
+        # Callers of a function.
+        conn.execute('create index calls_callee on calls(callee, caller)')
+        # Types having a member of a type.
+        conn.execute('create index members_type on members(type, type_id)')
+        conn.execute('create index types_name on types(name)')
+        conn.execute('create index symbols_cu on symbols(cu)')
+        self.commit()
         pass
 
-    def update_symbol_cu(self, symbol, cu_id):
+    # Index names of symbols, types and compile units for searching
+    # substrings of them, e.g. completion in the web app.
+    #
+    # "kind" is 'symbol', 'type' or 'cu'.  The trigram tokenizer
+    # matches any substring of 3 or more characters, case
+    # insensitively.  Names of types repeat a lot across CUs, so only
+    # distinct ones are indexed.
+    def create_name_index(self):
         conn = self.conn
-        conn.execute('update symbols set cu = ? where name = ?',
-                     (cu_id, symbol))
+        try:
+            conn.execute("create virtual table name_index using fts5(name, kind unindexed, tokenize = 'trigram')")
+        except sqlite3.OperationalError as e:
+            # SQLite without FTS5 or the trigram tokenizer (< 3.34).
+            print(' (no name index: %s)' % e, end='', flush=True)
+            return
+        conn.execute("insert into name_index(name, kind) select name, 'symbol' from symbols")
+        conn.execute("insert into name_index(name, kind) select distinct name, 'type' from types where name is not null and name != '<unknown>'")
+        conn.execute("insert into name_index(name, kind) select name, 'cu' from compile_units")
+        conn.execute("insert into name_index(name_index) values('optimize')")
+        self.commit()
+        pass
+
+    def insert_symbols(self, symbols):
+        self.conn.executemany('insert or ignore into symbols (id, name, cu, binary) values(?, ?, ?, ?)',
+                              symbols)
+        pass
+
+    def update_symbols(self, symbols):
+        self.conn.executemany('update symbols set cu = ?, binary = ? where id = ?',
+                              symbols)
         pass
 
     def insert_compile_units(self, compile_units):
-        conn = self.conn
-        for cu in compile_units:
-            try:
-                conn.execute('insert into compile_units(name) values(?)',
-                             (cu,))
-            except sqlite3.IntegrityError:
-                #print('compile unit %s already exists' % cu)
-                pass
-            pass
+        self.conn.executemany('insert or ignore into compile_units(id, name) values(?, ?)',
+                              compile_units)
         pass
 
     def get_compile_unit_id(self, cu):
-        conn = self.conn
-        cur = conn.execute('select id from compile_units where name = ?',
-                           (cu,))
-        row = cur.fetchone()
-        return row[0]
+        return self.cu_ids[cu]
 
     def insert_calls(self, calls):
-        conn = self.conn
-        for caller, callee in calls:
-            try:
-                conn.execute('insert into calls values(?, ?)',
-                             (caller, callee))
-            except sqlite3.IntegrityError:
-                #print('call %d -> %d already exists' % (caller, callee))
-                pass
-            pass
+        self.conn.executemany('insert or ignore into calls values(?, ?)',
+                              calls)
         pass
 
     def get_symbol_id(self, symbol):
-        conn = self.conn
-        cur = conn.execute('select id from symbols where name = ?',
-                           (symbol,))
-        row = cur.fetchone()
-        if not row:
+        if symbol not in self.symbol_ids:
             print(symbol)
             pass
-        return row[0]
+        return self.symbol_ids[symbol]
+
+    def persist_binary(self, binary):
+        binary_id = len(self.binary_ids) + 1
+        self.binary_ids[binary] = binary_id
+        self.conn.execute('insert into binaries(id, name) values(?, ?)',
+                          (binary_id, binary))
+        return binary_id
 
     def persist_compile_units(self, compile_units):
-        self.insert_compile_units(compile_units)
+        cu_ids = self.cu_ids
+        new_cus = []
+        for cu in compile_units:
+            if cu in cu_ids:
+                continue
+            cu_ids[cu] = len(cu_ids) + 1
+            new_cus.append((cu_ids[cu], cu))
+            pass
+        self.insert_compile_units(new_cus)
         self.commit()
         pass
 
-    def persist_subprogram_info(self, subprograms):
-        symbols = [(get_symbol_name(subprogram),
-                    self.get_compile_unit_id(subprogram.cu_name))
-                   for subprogram in subprograms.values()]
-        self.insert_symbols(symbols)
+    def persist_subprogram_info(self, subprograms, binary_id):
+        # A symbol belongs to the CU of the first subprogram having
+        # the name, unless a later one with an address (low_pc)
+        # defines it.  Across binaries, the first binary defining a
+        # symbol owns it; so, calls from modules to functions exported
+        # by vmlinux end up at the same symbols.
+        symbol_ids = self.symbol_ids
+        symbol_cus = {}
+        defined_cus = {}
         for subp in subprograms.values():
+            name = get_symbol_name(subp)
+            if name not in symbol_ids:
+                symbol_ids[name] = len(symbol_ids) + 1
+                symbol_cus[name] = subp.cu_name
+                pass
             if subp.low_pc > -1:
-                self.update_symbol_cu(get_symbol_name(subp), self.get_compile_unit_id(subp.cu_name))
+                defined_cus[name] = subp.cu_name
                 pass
             pass
+        cu_ids = self.cu_ids
+        self.insert_symbols((symbol_ids[name],
+                             name,
+                             cu_ids[defined_cus.get(name, cu_name)],
+                             binary_id)
+                            for name, cu_name in symbol_cus.items())
+        defined_symbols = self.defined_symbols
+        self.update_symbols((cu_ids[cu_name], binary_id, symbol_ids[name])
+                            for name, cu_name in defined_cus.items()
+                            if name not in symbol_cus and
+                            name not in defined_symbols)
+        defined_symbols.update(defined_cus.keys())
 
         self.commit()
 
-        for subp in subprograms.values():
-            caller = self.get_symbol_id(get_symbol_name(subp))
-            calls = [(caller, self.get_symbol_id(callee))
-                     for callee in subp.call_names]
-            self.insert_calls(calls)
-            pass
+        get_symbol_id = self.get_symbol_id
+        self.insert_calls((symbol_ids[get_symbol_name(subp)], get_symbol_id(callee))
+                          for subp in subprograms.values()
+                          for callee in subp.call_names)
 
         self.commit()
         pass
 
-    def persist_types_info(self, types):
+    def persist_types_info(self, types, binary_id):
         conn = self.conn
+        type_rows = []
+        type_id = self.type_id
         for addr, type_info in types.items():
             if type_info.meta_type == MT_placeholder:
                 continue
-            name = get_symbol_name(type_info)
-            meta_type = MT_table_rev[type_info.meta_type]
-            declaration = 1 if type_info.declaration else 0
-            conn.execute('insert into types(name, addr, meta_type, declaration) values(?, ?, ?, ?)',
-                         (name, addr, meta_type, declaration))
-            cur = conn.execute('select id from types where addr = ?',
-                               (addr,))
-            row = cur.fetchone()
-            type_id = row[0]
+            type_id += 1
             type_info.id = type_id
+            type_rows.append((type_id, get_symbol_name(type_info), addr,
+                              type_info.meta_type,
+                              1 if type_info.declaration else 0,
+                              binary_id))
             pass
+        self.type_id = type_id
+        conn.executemany('insert into types(id, name, addr, meta_type, declaration, binary) values(?, ?, ?, ?, ?, ?)',
+                         type_rows)
+        del type_rows
+
+        conn.executemany('insert into members(type_id, name, type, offset, seq) values(?, ?, ?, ?, ?)',
+                         self.iter_member_rows(types))
+        self.commit()
+        pass
 
+    def iter_member_rows(self, types):
         for type_info in types.values():
             if type_info.meta_type == MT_placeholder:
                 continue
             type_id = type_info.id
+            seq = 0
             if type_info.members:
                 for member in type_info.comm_params:
-                    conn.execute('insert into members values(?, ?, ?, ?)',
-                                 (type_id, get_symbol_name(member),
-                                  get_real_type(member.value, types).id,
-                                  member.offset or 0))
+                    yield (type_id, get_symbol_name(member),
+                           get_real_type(member.value, types).id,
+                           member.offset or 0, seq)
+                    seq += 1
                     pass
                 pass
             if type_info.type >= 0:
@@ -327,21 +453,18 @@ class CFDB:
                 if type_type.id < 0:
                     print(type_info.type, types[type_info.type], type_type)
                     pass
-                conn.execute('insert into members values(?, ?, ?, ?)',
-                             (type_id, '',
-                              type_type.id,
-                              0))
+                yield (type_id, '', type_type.id, 0, seq)
+                seq += 1
                 pass
             if type_info.params:
                 for i, param in enumerate(type_info.comm_params):
-                    conn.execute('insert into members values(?, ?, ?, ?)',
-                                 (type_id, str(i),
-                                  get_real_type(param.value, types).id,
-                                  0))
+                    yield (type_id, str(i),
+                           get_real_type(param.value, types).id,
+                           0, seq)
+                    seq += 1
                     pass
                 pass
             pass
-        self.commit()
         pass
 
     def commit(self):
@@ -363,17 +486,63 @@ def get_real_type(addr, types):
         return types[types[addr].real_type]
     return types[addr]
 
-def persist_info(subprograms, types, filename):
-    conn = sqlite3.connect(filename)
+# Create a DB to be moved to the given filename by finish_CFDB().
+#
+# The DB is built in a temporary file next to the target, so readers
+# of an existing DB keep seeing the old one until the new one is
+# complete.  A temporary file left by a crashed build is removed.
+def create_CFDB(filename):
+    tmp_filename = filename + '.tmp'
+    if os.path.exists(tmp_filename):
+        print('temporary file %s already exists, delete it' % tmp_filename)
+        os.remove(tmp_filename)
+        pass
+    conn = sqlite3.connect(tmp_filename)
     db = CFDB(conn)
+    db.filename = filename
+    db.tmp_filename = tmp_filename
 
+    db.init_build_pragmas()
     db.init_schema()
+    return db
+
+def persist_info(subprograms, types, db, binary):
+    binary_id = db.persist_binary(binary)
     cu_names = set([subprogram.cu_name for subprogram in subprograms.values()])
     db.persist_compile_units(cu_names)
-    db.persist_subprogram_info(subprograms)
-    db.persist_types_info(types)
+    db.persist_subprogram_info(subprograms, binary_id)
+    db.persist_types_info(types, binary_id)
+    pass
 
+# Finish a DB created by create_CFDB() and atomically replace the
+# target file with it.
+#
+# Steps:
+#  1. create indexes and the name index,
+#  2. collect statistics for the query planner, and switch to the
+#     settings for readers,
+#  3. flush the file to the disk, since it is built without syncs,
+#  4. rename it to the target, and
+#  5. flush the directory to keep the rename across a crash.
+def finish_CFDB(db):
+    db.create_indexes()
+    db.create_name_index()
+    db.init_read_pragmas()
     db.close()
+
+    fd = os.open(db.tmp_filename, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+        pass
+    os.replace(db.tmp_filename, db.filename)
+    fd = os.open(os.path.dirname(os.path.abspath(db.filename)), os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+        pass
     pass
 
 def prepend_namespace(name, stk):
@@ -574,12 +743,330 @@ def parse_die_formal_parameter(die, stk):
         pass
     pass
 
+# Decode DIEs without pyelftools.
+#
+# pyelftools decodes every attribute of every DIE into AttributeValue
+# objects, but the parse_die_*() functions only read a few of them.
+# FastDIEReader walks DIEs with plans precomputed for every abbrev;
+# attributes in fast_die_attrs are decoded and others are skipped by
+# their sizes.  It yields FastDIEs having the same interface, as far
+# as parse_CU() uses, as pyelftools DIEs.
+#
+# DIEs with a form that can not be decoded here are decoded by
+# pyelftools.  So are the attributes of DW_TAG_formal_parameter since
+# parse_die_formal_parameter() reads all of them; lazily since it
+# returns early for most of them.
+form_sizes = {
+    'DW_FORM_flag_present': 0, 'DW_FORM_implicit_const': 0,
+    'DW_FORM_data1': 1, 'DW_FORM_ref1': 1, 'DW_FORM_flag': 1,
+    'DW_FORM_strx1': 1, 'DW_FORM_addrx1': 1,
+    'DW_FORM_data2': 2, 'DW_FORM_ref2': 2,
+    'DW_FORM_strx2': 2, 'DW_FORM_addrx2': 2,
+    'DW_FORM_strx3': 3, 'DW_FORM_addrx3': 3,
+    'DW_FORM_data4': 4, 'DW_FORM_ref4': 4, 'DW_FORM_ref_sup4': 4,
+    'DW_FORM_strx4': 4, 'DW_FORM_addrx4': 4,
+    'DW_FORM_data8': 8, 'DW_FORM_ref8': 8, 'DW_FORM_ref_sig8': 8,
+    'DW_FORM_ref_sup8': 8,
+    'DW_FORM_data16': 16,
+}
+uleb_forms = ('DW_FORM_udata', 'DW_FORM_ref_udata', 'DW_FORM_strx',
+              'DW_FORM_addrx', 'DW_FORM_loclistx', 'DW_FORM_rnglistx',
+              'DW_FORM_GNU_addr_index', 'DW_FORM_GNU_str_index')
+offset_forms = ('DW_FORM_strp', 'DW_FORM_line_strp', 'DW_FORM_sec_offset',
+                'DW_FORM_strp_sup', 'DW_FORM_GNU_strp_alt',
+                'DW_FORM_GNU_ref_alt')
+block_len_sizes = {'DW_FORM_block1': 1, 'DW_FORM_block2': 2,
+                   'DW_FORM_block4': 4}
+strx_forms = ('DW_FORM_strx', 'DW_FORM_strx1', 'DW_FORM_strx2',
+              'DW_FORM_strx3', 'DW_FORM_strx4')
+addrx_forms = ('DW_FORM_addrx', 'DW_FORM_addrx1', 'DW_FORM_addrx2',
+               'DW_FORM_addrx3', 'DW_FORM_addrx4')
+form_names = {code: name for name, code in ENUM_DW_FORM.items()}
+
+fast_die_attrs = {
+    'DW_AT_name', 'DW_AT_linkage_name', 'DW_AT_type',
+    'DW_AT_abstract_origin', 'DW_AT_call_origin', 'DW_AT_specification',
+    'DW_AT_low_pc', 'DW_AT_inline', 'DW_AT_declaration',
+    'DW_AT_data_member_location', 'DW_AT_external', 'DW_AT_const_value',
+}
+lazy_attrs_tags = ('DW_TAG_formal_parameter',)
+
+def read_uleb(data, pos):
+    value = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+        pass
+    pass
+
+def read_sleb(data, pos):
+    value, end = read_uleb(data, pos)
+    if data[end - 1] & 0x40:
+        value -= 1 << (7 * (end - pos))
+        pass
+    return value, end
+
+def read_indirect_form(data, pos):
+    form = 'DW_FORM_indirect'
+    while form == 'DW_FORM_indirect':
+        form_code, pos = read_uleb(data, pos)
+        form = form_names[form_code]
+        pass
+    return form, pos
+
+def read_CU_bytes(dwarfinfo, cu):
+    stream = dwarfinfo.debug_info_sec.stream
+    stream.seek(cu.cu_offset)
+    return stream.read(cu['unit_length'] +
+                       cu.structs.initial_length_field_size())
+
+def read_str_sections(dwarfinfo):
+    str_data = {}
+    for secname in ('debug_str_sec', 'debug_line_str_sec',
+                    'debug_str_offsets_sec'):
+        sec = getattr(dwarfinfo, secname, None)
+        if sec is None:
+            str_data[secname] = b''
+            continue
+        # Without a copy; see MappedELFFile.
+        str_data[secname] = sec.stream.getvalue()
+        pass
+    return str_data
+
+class UnitLayout:
+    '''Sizes and bases of values in a CU'''
+    __slots__ = ('offset_size', 'address_size', 'ref_addr_size',
+                 'byteorder', 'str_offsets_base')
+
+    def __init__(self, cu):
+        self.offset_size = 8 if cu.structs.dwarf_format == 64 else 4
+        self.address_size = cu['address_size']
+        if cu['version'] == 2:
+            self.ref_addr_size = self.address_size
+        else:
+            self.ref_addr_size = self.offset_size
+            pass
+        self.byteorder = 'little' if cu.structs.little_endian else 'big'
+        top = cu.get_top_DIE()
+        if 'DW_AT_str_offsets_base' in top.attributes:
+            self.str_offsets_base = top.attributes['DW_AT_str_offsets_base'].value
+        else:
+            self.str_offsets_base = None
+            pass
+        pass
+    pass
+
+def skip_value(data, pos, form, unit):
+    '''Return the position following a value of the given form'''
+    if form in form_sizes:
+        return pos + form_sizes[form]
+    if form in uleb_forms or form == 'DW_FORM_sdata':
+        while data[pos] & 0x80:
+            pos += 1
+            pass
+        return pos + 1
+    if form in offset_forms:
+        return pos + unit.offset_size
+    if form == 'DW_FORM_addr':
+        return pos + unit.address_size
+    if form == 'DW_FORM_ref_addr':
+        return pos + unit.ref_addr_size
+    if form in block_len_sizes:
+        size = block_len_sizes[form]
+        return pos + size + int.from_bytes(data[pos:pos + size], unit.byteorder)
+    if form in ('DW_FORM_block', 'DW_FORM_exprloc'):
+        size, pos = read_uleb(data, pos)
+        return pos + size
+    if form == 'DW_FORM_string':
+        return data.index(b'\0', pos) + 1
+    raise ValueError('unknown form %s' % form)
+
+FastAttr = namedtuple('FastAttr', ('name', 'form', 'value'))
+
+class SlowDIE(Exception):
+    '''Raised for DIEs that should be decoded by pyelftools'''
+    pass
+
+class FastDIE:
+    __slots__ = ('cu', 'offset', 'tag', 'has_children', 'lazy_attributes')
+
+    def __init__(self, cu, offset, tag, has_children, attributes):
+        self.cu = cu
+        self.offset = offset
+        self.tag = tag
+        self.has_children = has_children
+        self.lazy_attributes = attributes
+        pass
+
+    @property
+    def attributes(self):
+        if self.lazy_attributes is None:
+            stream = self.cu.dwarfinfo.debug_info_sec.stream
+            self.lazy_attributes = DIE(self.cu, stream, self.offset).attributes
+            pass
+        return self.lazy_attributes
+    pass
+
+class FastDIEReader:
+    def __init__(self, dwarfinfo):
+        self.dwarfinfo = dwarfinfo
+        self.str_data = read_str_sections(dwarfinfo)
+        self.plans = {}
+        pass
+
+    def get_plan(self, cu, code):
+        key = (cu['debug_abbrev_offset'], code)
+        if key not in self.plans:
+            abbrev = cu.get_abbrev_table().get_abbrev(code)
+            tag = abbrev['tag']
+            lazy = tag in lazy_attrs_tags
+            steps = []
+            for spec in abbrev['attr_spec']:
+                want = not lazy and spec.name in fast_die_attrs
+                value = spec.value if spec.form == 'DW_FORM_implicit_const' else None
+                steps.append((spec.name, spec.form, want, value))
+                pass
+            self.plans[key] = (tag, abbrev.has_children(), lazy, steps)
+            pass
+        return self.plans[key]
+
+    def get_string(self, secname, offset):
+        data = self.str_data[secname]
+        return data[offset:data.find(b'\0', offset)]
+
+    def decode_value(self, data, pos, form, unit, cu):
+        byteorder = unit.byteorder
+        if form in form_sizes:
+            end = pos + form_sizes[form]
+            if form == 'DW_FORM_flag_present':
+                return True, end
+            if form == 'DW_FORM_flag':
+                return data[pos] != 0, end
+            if form == 'DW_FORM_data16':
+                return list(data[pos:end]), end
+            value = int.from_bytes(data[pos:end], byteorder)
+        elif form in uleb_forms:
+            if form in ('DW_FORM_loclistx', 'DW_FORM_rnglistx'):
+                raise SlowDIE()
+            value, end = read_uleb(data, pos)
+        elif form == 'DW_FORM_sdata':
+            return read_sleb(data, pos)
+        elif form in offset_forms:
+            end = pos + unit.offset_size
+            value = int.from_bytes(data[pos:end], byteorder)
+            if form == 'DW_FORM_strp':
+                return self.get_string('debug_str_sec', value), end
+            if form == 'DW_FORM_line_strp':
+                return self.get_string('debug_line_str_sec', value), end
+            if form in ('DW_FORM_strp_sup', 'DW_FORM_GNU_strp_alt') and \
+               self.dwarfinfo.supplementary_dwarfinfo:
+                raise SlowDIE()
+            return value, end
+        elif form == 'DW_FORM_string':
+            end = data.index(b'\0', pos)
+            return data[pos:end], end + 1
+        elif form == 'DW_FORM_addr':
+            end = pos + unit.address_size
+            return int.from_bytes(data[pos:end], byteorder), end
+        elif form == 'DW_FORM_ref_addr':
+            end = pos + unit.ref_addr_size
+            return int.from_bytes(data[pos:end], byteorder), end
+        elif form in block_len_sizes:
+            size = block_len_sizes[form]
+            start = pos + size
+            end = start + int.from_bytes(data[pos:start], byteorder)
+            return list(data[start:end]), end
+        elif form in ('DW_FORM_block', 'DW_FORM_exprloc'):
+            size, start = read_uleb(data, pos)
+            end = start + size
+            return list(data[start:end]), end
+        else:
+            raise SlowDIE()
+
+        if form in strx_forms:
+            if unit.str_offsets_base is None:
+                raise SlowDIE()
+            entry = unit.str_offsets_base + value * unit.offset_size
+            offset = int.from_bytes(
+                self.str_data['debug_str_offsets_sec'][entry:entry + unit.offset_size],
+                byteorder)
+            return self.get_string('debug_str_sec', offset), end
+        if form in addrx_forms:
+            return self.dwarfinfo.get_addr(cu, value), end
+        return value, end
+
+    def iter_DIEs(self, cu):
+        # The top DIE is decoded by pyelftools.  The bases of indirect
+        # values are there.
+        top = cu.get_top_DIE()
+        yield top
+        if self.dwarfinfo.supplementary_dwarfinfo:
+            yield from itertools.islice(cu.iter_DIEs(), 1, None)
+            return
+
+        unit = UnitLayout(cu)
+        data = read_CU_bytes(self.dwarfinfo, cu)
+        cu_offset = cu.cu_offset
+        pos = top.offset + top.size - cu_offset
+        end = len(data)
+        null_die = FastDIE(cu, -1, None, False, {})
+        while pos < end:
+            die_pos = pos
+            code, pos = read_uleb(data, pos)
+            if code == 0:
+                yield null_die
+                continue
+            tag, has_children, lazy, steps = self.get_plan(cu, code)
+            attributes = None if lazy else {}
+            try:
+                for name, form, want, value in steps:
+                    if form == 'DW_FORM_indirect':
+                        form, pos = read_indirect_form(data, pos)
+                        pass
+                    if not want:
+                        pos = skip_value(data, pos, form, unit)
+                        continue
+                    if value is None:
+                        value, pos = self.decode_value(data, pos, form, unit, cu)
+                        pass
+                    attributes[name] = FastAttr(name, form, value)
+                    pass
+            except SlowDIE:
+                die = DIE(cu, self.dwarfinfo.debug_info_sec.stream,
+                          die_pos + cu_offset)
+                pos = die_pos + die.size
+                yield die
+                continue
+            yield FastDIE(cu, die_pos + cu_offset, tag, has_children, attributes)
+            pass
+        pass
+    pass
+
+# The reader of DIEs used by parse_CU(); pyelftools if it is None.
+die_reader = None
+
+def init_die_reader(dwarfinfo, fast):
+    global die_reader
+    die_reader = FastDIEReader(dwarfinfo) if fast else None
+    pass
+
 def parse_CU(cu, subprograms_lst, types_lst):
     stk = []
     cu_name = ''
     tmp_subprograms_lst = deque()
+    tmp_types_lst = deque()
 
-    for die in cu.iter_DIEs():
+    if die_reader is None:
+        dies = cu.iter_DIEs()
+    else:
+        dies = die_reader.iter_DIEs(cu)
+        pass
+    for die in dies:
         if not die.tag:
             stk.pop()
             continue
@@ -591,7 +1078,7 @@ def parse_CU(cu, subprograms_lst, types_lst):
         if die_tag in subprogram_tags:
             parse_die_subprogram(die, tmp_subprograms_lst, stk)
         elif die_tag in type_tags:
-            parse_die_type(die, types_lst, stk)
+            parse_die_type(die, tmp_types_lst, stk)
         elif die_tag == MT_member:
             parse_die_member(die, stk)
         elif die_tag == MT_enumerator:
@@ -618,270 +1105,900 @@ def parse_CU(cu, subprograms_lst, types_lst):
         subp.cu_name = cu_name
         pass
     subprograms_lst.extend(tmp_subprograms_lst)
+    types_lst.extend(tmp_types_lst)
 
     assert not stk
     pass
 
-def parse_DIEs(fo):
-    subprograms = {}
-    subprograms_lst = deque()
-    void = TypeInfo(0, MT_base)
-    void.name = 'void'
-    types = {0: void}
-    types_lst = deque()
+# Open an ELF file mapped in memory.
+#
+# pyelftools reads with seek() and read(), which mmap objects support.
+# Reading a section is a copy from the page cache instead of system
+# calls, and nothing is read before it is needed.
+def open_ELF(filename):
+    with open(filename, 'rb') as fo:
+        return mmap.mmap(fo.fileno(), 0, access=mmap.ACCESS_READ)
+
+# ELFFile reading DWARF sections from a mapped file.
+#
+# pyelftools reads a section to bytes and writes them to an empty
+# BytesIO, copying every section twice.  Here, a section is sliced, or
+# decompressed, from the mapping once, and wrapped by a BytesIO that
+# shares the bytes until it is written.  Compressed sections are
+# decompressed only here, so nothing decompresses them again later.
+# Sections needing relocations (ET_REL, like kernel modules) take the
+# path of pyelftools.
+class MappedELFFile(ELFFile):
+    def _read_dwarf_section(self, section, relocate_dwarf_sections):
+        if self.has_phantom_bytes() or \
+           section['sh_type'] == 'SHT_NOBITS' or \
+           (section.compressed and
+            getattr(section, '_compression_type', None) != 'ELFCOMPRESS_ZLIB') or \
+           (relocate_dwarf_sections and
+            RelocationHandler(self).find_relocations_for_section(section)
+            is not None):
+            return super()._read_dwarf_section(section,
+                                               relocate_dwarf_sections)
+        start = section['sh_offset']
+        end = start + section['sh_size']
+        with memoryview(self.stream) as view:
+            if section.compressed:
+                hdr_size = section.structs.Elf_Chdr.sizeof()
+                data = zlib.decompress(view[start + hdr_size:end])
+            else:
+                data = bytes(view[start:end])
+                pass
+            pass
+        if len(data) != section.data_size:
+            raise Exception('section %s is %d bytes, should be %d bytes' %
+                            (section.name, len(data), section.data_size))
+        return DebugSectionDescriptor(stream=BytesIO(data),
+                                      name=section.name,
+                                      global_offset=start,
+                                      size=section.data_size,
+                                      address=section['sh_addr'])
+    pass
 
-    elffile = ELFFile(fo)
+def load_dwarf_info(filename):
+    elffile = MappedELFFile(open_ELF(filename))
     if not elffile.has_dwarf_info():
-        print('no dwarf info')
-        return
+        return None
     dwarfinfo = elffile.get_dwarf_info()
     if hasattr(dwarfinfo, 'skip_cache'):
         dwarfinfo.skip_cache()
         pass
-    for cu in dwarfinfo.iter_CUs():
-        parse_CU(cu, subprograms_lst, types_lst)
+    return dwarfinfo
+
+# Parse CUs in worker processes.
+#
+# Workers parse batches of CUs given by their offsets.  A batch is a
+# contiguous range of CUs, and batches are merged by the parent in the
+# order of CUs.  So, the result is identical to parsing all CUs
+# serially.
+#
+# Workers forked from the parent inherit the DWARF sections already
+# read, and decompressed, by the parent.  Otherwise, every worker
+# loads the ELF file by itself.
+worker_dwarfinfo = None
+
+def start_parse_workers(filename, dwarfinfo, jobs):
+    global worker_dwarfinfo
+    if multiprocessing.get_start_method() == 'fork':
+        worker_dwarfinfo = dwarfinfo
+        pass
+    pool = multiprocessing.Pool(jobs, init_parse_worker,
+                                (filename, die_reader is not None))
+    worker_dwarfinfo = None
+    return pool
+
+def init_parse_worker(filename, fast):
+    global worker_dwarfinfo
+    if worker_dwarfinfo is not None:
+        # Forked with the DWARF and the DIE reader of the parent.
+        return
+    worker_dwarfinfo = load_dwarf_info(filename)
+    init_die_reader(worker_dwarfinfo, fast)
+    pass
+
+def parse_CU_batch_blobs(cu_offsets):
+    return [parse_CU_to_blob(worker_dwarfinfo.get_CU_at(offset))
+            for offset in cu_offsets]
+
+def parse_CU_batch(cu_offsets):
+    subprograms_lst = deque()
+    types_lst = deque()
+    for offset in cu_offsets:
+        parse_CU(worker_dwarfinfo.get_CU_at(offset), subprograms_lst, types_lst)
         pass
+    return subprograms_lst, types_lst
 
-    subprograms.fromkeys([subprog.addr for subprog in subprograms_lst])
-    subprograms.update((subprog.addr, subprog) for subprog in subprograms_lst)
-    types.fromkeys([t.addr for t in types_lst])
-    types.update((type.addr, type) for type in types_lst)
+# Split CUs into batches of similar sizes.
+#
+# We create several batches for each worker to balance the load
+# since the sizes of CUs vary a lot.
+def make_CU_batches(cus, jobs):
+    cus = [(cu.cu_offset, cu['unit_length']) for cu in cus]
+    total_size = sum(size for offset, size in cus)
+    batch_size = max(total_size // (jobs * 8), 1)
+    batches = []
+    batch = []
+    acc_size = 0
+    for offset, size in cus:
+        batch.append(offset)
+        acc_size += size
+        if acc_size >= batch_size:
+            batches.append(batch)
+            batch = []
+            acc_size = 0
+            pass
+        pass
+    if batch:
+        batches.append(batch)
+        pass
+    return batches
 
-    def get_real_addr(addr):
-        while addr in subprograms:
-            if not subprograms[addr].is_original():
-                addr = subprograms[addr].origin
+# Names received from workers are not shared with the names from
+# other batches.  Put them back to the flyweight.
+def refly_names(lst):
+    for info in lst:
+        info.name = fly_name(info.name)
+        info.linkage_name = fly_name(info.linkage_name)
+        if isinstance(info, TypeInfo):
+            for param in info.comm_params:
+                param.name = fly_name(param.name)
+                pass
+            pass
+        pass
+    pass
+
+def parse_CUs_parallel(filename, dwarfinfo, cus, jobs,
+                       subprograms_lst, types_lst):
+    batches = make_CU_batches(cus, jobs)
+    with start_parse_workers(filename, dwarfinfo, jobs) as pool:
+        for batch_subprograms, batch_types in pool.imap(parse_CU_batch, batches):
+            refly_names(batch_subprograms)
+            refly_names(batch_types)
+            subprograms_lst.extend(batch_subprograms)
+            types_lst.extend(batch_types)
+            pass
+        pass
+    pass
+
+def parse_CU_to_blob(cu):
+    subprograms_lst = deque()
+    types_lst = deque()
+    parse_CU(cu, subprograms_lst, types_lst)
+    return pickle.dumps((subprograms_lst, types_lst), pickle.HIGHEST_PROTOCOL)
+
+# Move parsing results of a CU to a new offset of the CU.
+#
+# References are offsets of DIEs computed by adding the offset of the
+# CU.  0 (void) and -1 (none) are not references.
+def rebase_subprograms(subprograms_lst, delta):
+    for subp in subprograms_lst:
+        subp.addr += delta
+        if subp.origin > 0:
+            subp.origin += delta
+            pass
+        if subp.specification > 0:
+            subp.specification += delta
+            pass
+        subp.calls = [call + delta for call in subp.calls]
+        pass
+    pass
+
+def rebase_types(types_lst, delta):
+    for _type in types_lst:
+        _type.addr += delta
+        if _type.type > 0:
+            _type.type += delta
+            pass
+        if _type.members or _type.params:
+            for param in _type.comm_params:
+                if param.value > 0:
+                    param.value += delta
+                    pass
+                pass
+            pass
+        pass
+    pass
+
+# Attributes having values depending on the position of the CU or
+# the addresses of code and data.  These values change whenever the
+# CUs or the code before them change, but parse_CU() doesn't use them.
+position_attrs = {
+    'DW_AT_stmt_list', 'DW_AT_ranges', 'DW_AT_location', 'DW_AT_frame_base',
+    'DW_AT_str_offsets_base', 'DW_AT_addr_base', 'DW_AT_rnglists_base',
+    'DW_AT_loclists_base', 'DW_AT_macros', 'DW_AT_macro_info',
+    'DW_AT_GNU_macros', 'DW_AT_GNU_addr_base', 'DW_AT_GNU_ranges_base',
+    'DW_AT_GNU_locviews', 'DW_AT_call_value', 'DW_AT_call_target',
+    'DW_AT_call_data_value', 'DW_AT_call_data_location',
+    'DW_AT_GNU_call_site_value', 'DW_AT_GNU_call_site_target',
+    'DW_AT_GNU_call_site_data_value',
+}
+
+# Compute fingerprints of CUs independent of their positions.
+#
+# A fingerprint is the hash of the name and the DIEs of a CU.  DIEs
+# are walked with the abbrev table of the CU.  Strings referred by
+# offsets are hashed by their content, and values depending on
+# positions (see position_attrs and DW_FORM_addr) are skipped.  So, a
+# CU keeps its fingerprint if only other CUs change.
+class CUFingerprinter:
+    def __init__(self, dwarfinfo):
+        self.dwarfinfo = dwarfinfo
+        self.str_data = read_str_sections(dwarfinfo)
+        self.plans = {}
+        pass
+
+    def get_plan(self, cu, code):
+        key = (cu['debug_abbrev_offset'], code)
+        if key not in self.plans:
+            abbrev = cu.get_abbrev_table().get_abbrev(code)
+            self.plans[key] = [(form, name in position_attrs)
+                               for name, form in abbrev.iter_attr_specs()]
+            pass
+        return self.plans[key]
+
+    def get_string(self, secname, offset):
+        data = self.str_data[secname]
+        return data[offset:data.find(b'\0', offset) + 1]
+
+    def fingerprint(self, cu):
+        top = cu.get_top_DIE()
+        pieces = [bytes(str((cu['version'], cu['address_size'])), 'utf-8')]
+        if 'DW_AT_name' in top.attributes:
+            pieces.append(top.attributes['DW_AT_name'].value)
+            pass
+        unit = UnitLayout(cu)
+        byteorder = unit.byteorder
+        offset_size = unit.offset_size
+
+        data = read_CU_bytes(self.dwarfinfo, cu)
+        pos = cu.cu_die_offset - cu.cu_offset
+        end = len(data)
+        # Bytes from span_start to the current position are hashed as
+        # they are.
+        span_start = pos
+        while pos < end:
+            code, pos = read_uleb(data, pos)
+            if code == 0:
                 continue
-            break
+            for form, skip in self.get_plan(cu, code):
+                if form == 'DW_FORM_indirect':
+                    form, pos = read_indirect_form(data, pos)
+                    pass
+                value_start = pos
+                pos = skip_value(data, pos, form, unit)
+
+                string = None
+                if skip or form == 'DW_FORM_addr':
+                    string = b''
+                elif form == 'DW_FORM_strp':
+                    offset = int.from_bytes(data[value_start:pos], byteorder)
+                    string = self.get_string('debug_str_sec', offset)
+                elif form == 'DW_FORM_line_strp':
+                    offset = int.from_bytes(data[value_start:pos], byteorder)
+                    string = self.get_string('debug_line_str_sec', offset)
+                elif form in strx_forms:
+                    if form == 'DW_FORM_strx':
+                        index = read_uleb(data, value_start)[0]
+                    else:
+                        index = int.from_bytes(data[value_start:pos], byteorder)
+                        pass
+                    entry = (unit.str_offsets_base or 0) + index * offset_size
+                    offset = int.from_bytes(
+                        self.str_data['debug_str_offsets_sec'][entry:entry + offset_size],
+                        byteorder)
+                    string = self.get_string('debug_str_sec', offset)
+                    pass
+                if string is not None:
+                    pieces.append(data[span_start:value_start])
+                    pieces.append(string)
+                    span_start = pos
+                    pass
+                pass
+            pass
+        pieces.append(data[span_start:end])
+        return hashlib.sha256(b'\0'.join(pieces)).digest()
+    pass
+
+# Cache of parsing results of CUs for incremental rebuilding.
+#
+# The results of parse_CU() are kept with the offset of the CU and
+# keyed by the fingerprint of the CU.  DIEs of an unchanged CU move
+# when CUs before it change, so the results are rebased to the new
+# offset of the CU when being loaded.
+#
+# The low_pc of cached subprograms may be out of date since addresses
+# are not a part of fingerprints.  Only its presence is used.
+class CUCache:
+    # Pickled results of CUs only load with the same fields of the
+    # classes.
+    VERSION = (2, tuple(fld.name for cls in (SubpInfo, TypeInfo, TypeCommonParam)
+                        for fld in dataclasses.fields(cls)))
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.entries = {}
+        self.new_entries = {}
+        self.hits = 0
+        pass
+
+    def load(self):
+        if not os.path.exists(self.filename):
+            return
+        try:
+            with open(self.filename, 'rb') as fo:
+                version, entries = pickle.load(fo)
+                pass
+        except Exception as e:
+            print(' (ignore broken CU cache %s: %s)' % (self.filename, e), end='')
+            return
+        if version != self.VERSION:
+            return
+        self.entries = entries
+        pass
+
+    # Save the entries of the CUs of this run.  Entries of other CUs
+    # are of CUs changed or gone, and are dropped, unless "merge" is
+    # true for runs parsing only some CUs, e.g. with --include-cu.
+    def save(self, merge=False):
+        entries = self.new_entries
+        if merge:
+            entries = dict(self.entries)
+            entries.update(self.new_entries)
+            pass
+        tmp = self.filename + '.tmp'
+        with open(tmp, 'wb') as fo:
+            pickle.dump((self.VERSION, entries), fo,
+                        pickle.HIGHEST_PROTOCOL)
+            pass
+        os.replace(tmp, self.filename)
+        pass
+
+    def lookup(self, fp):
+        entry = self.entries.get(fp)
+        if entry is not None:
+            self.hits += 1
+            pass
+        return entry
+
+    def store(self, fp, cu_offset, blob):
+        self.new_entries[fp] = (cu_offset, blob)
+        pass
+    pass
+
+def parse_CUs_cached(filename, dwarfinfo, cus, jobs, cu_cache,
+                     subprograms_lst, types_lst):
+    cus = list(cus)
+    fingerprinter = CUFingerprinter(dwarfinfo)
+    fingerprints = [fingerprinter.fingerprint(cu) for cu in cus]
+    entries = [cu_cache.lookup(fp) for fp in fingerprints]
+
+    parsing = [i for i, entry in enumerate(entries) if entry is None]
+    if jobs > 1 and parsing:
+        batches = make_CU_batches([cus[i] for i in parsing], jobs)
+        with start_parse_workers(filename, dwarfinfo, jobs) as pool:
+            blobs = list(itertools.chain.from_iterable(
+                pool.imap(parse_CU_batch_blobs, batches)))
+            pass
+    else:
+        blobs = [parse_CU_to_blob(cus[i]) for i in parsing]
+        pass
+    for i, blob in zip(parsing, blobs):
+        entries[i] = (cus[i].cu_offset, blob)
+        pass
+
+    for fp, cu, (cu_offset, blob) in zip(fingerprints, cus, entries):
+        try:
+            cu_subprograms, cu_types = pickle.loads(blob)
+        except Exception as e:
+            # A cached result that doesn't load any more; parse the CU
+            # again instead of giving up the build.
+            print(' (reparse CU at 0x%x: %s)' % (cu.cu_offset, e), end='')
+            cu_cache.hits -= 1
+            cu_offset = cu.cu_offset
+            blob = parse_CU_to_blob(cu)
+            cu_subprograms, cu_types = pickle.loads(blob)
+            pass
+        cu_cache.store(fp, cu_offset, blob)
+        delta = cu.cu_offset - cu_offset
+        if delta:
+            rebase_subprograms(cu_subprograms, delta)
+            rebase_types(cu_types, delta)
+            pass
+        refly_names(cu_subprograms)
+        refly_names(cu_types)
+        subprograms_lst.extend(cu_subprograms)
+        types_lst.extend(cu_types)
+        pass
+    print(' (%d of %d CUs from cache)' % (cu_cache.hits, len(cus)), end='')
+    pass
+
+# Select CUs by globs of their names.
+#
+# A CU is selected if its name matches one of the include globs, or
+# there is no include glob, and it doesn't match any exclude glob.
+# Only the top DIEs of CUs are decoded to get their names.
+#
+# References in DIEs are resolved in their CUs; so, the CUs filtered
+# out are not needed by others.  Functions defined in these CUs but
+# called by the selected CUs still show up with declarations.
+def get_CU_name(cu):
+    top = cu.get_top_DIE()
+    if 'DW_AT_name' not in top.attributes:
+        return ''
+    return top.attributes['DW_AT_name'].value.decode('utf-8')
+
+def filter_CUs(cus, includes, excludes):
+    for cu in cus:
+        name = get_CU_name(cu)
+        if includes and \
+           not any(fnmatch.fnmatchcase(name, glob) for glob in includes):
+            continue
+        if any(fnmatch.fnmatchcase(name, glob) for glob in excludes):
+            continue
+        yield cu
+        pass
+    pass
+
+# Find original subprograms of inlined and concrete instances.
+#
+# An instance points to its abstract instance with 'origin', which may
+# be an instance of another.  The chains are followed once; every
+# subprogram on the way is remembered with the original it reaches.
+class OriginResolver:
+    def __init__(self, subprograms):
+        self.subprograms = subprograms
+        self.originals = {}
+        pass
+
+    def find(self, addr):
+        subprograms = self.subprograms
+        originals = self.originals
+        path = []
+        while addr in subprograms:
+            if addr in originals:
+                addr = originals[addr]
+                break
+            subp = subprograms[addr]
+            if subp.is_original():
+                break
+            path.append(addr)
+            addr = subp.origin
+            pass
+        for visited in path:
+            originals[visited] = addr
+            pass
         return addr
+    pass
 
-    for subp in subprograms_lst:
-        if not subp.is_original():
-            origin = subprograms[get_real_addr(subp.origin)]
-            for call in subp.calls:
-                if call in origin.calls:
-                    continue
-                origin.calls.append(call)
+def get_origin_resolver(subprograms, context):
+    if 'origin_resolver' not in context:
+        context['origin_resolver'] = OriginResolver(subprograms)
+        pass
+    return context['origin_resolver']
+
+# Lists without duplicates keyed by addresses.
+#
+# Items are kept in the order of adding, and a set for every list
+# tells whether an item is in the list already.
+class OrderedSets:
+    def __init__(self):
+        self.lists = {}
+        self.sets = {}
+        pass
+
+    def __contains__(self, key):
+        return key in self.lists
+
+    # Start a list with the given items as they are.
+    def init(self, key, items):
+        self.lists[key] = list(items)
+        self.sets[key] = set(self.lists[key])
+        pass
+
+    def add_all(self, key, items):
+        if key not in self.lists:
+            self.lists[key] = []
+            self.sets[key] = set()
+            pass
+        lst = self.lists[key]
+        seen = self.sets[key]
+        for item in items:
+            if item in seen:
+                continue
+            seen.add(item)
+            lst.append(item)
+            pass
+        pass
+
+    def items(self):
+        return self.lists.items()
+    pass
+
+# Drop duplicates of types while CUs are parsed.
+#
+# Every CU has its own copies of the types of the headers it
+# includes.  Most of them are merged by merge_types at the end, but
+# until then they take most of the memory.  Types parsed are taken
+# by extend() and compared with the types kept so far, a batch of CUs
+# at a time, by partition refinement: types are put in classes of the
+# same attributes, and classes are split by the classes of the types
+# referenced until no class splits.  The types in a class have the
+# same structure, including loops, and any of them can stand for the
+# others.  The first type of every class is kept, and references to
+# the others are redirected to it.
+#
+# A batch is compared when it gets as large as the types kept, so
+# every type is compared a few times at most.  References are in
+# their CUs; types kept never reference types of later batches.
+class TypeDedup:
+    MIN_BATCH = 10000
+
+    def __init__(self, types):
+        self.types = types
+        self.pending = []
+        self.dropped = 0
+        pass
+
+    def extend(self, types_lst):
+        self.pending.extend(types_lst)
+        if len(self.pending) >= max(len(self.types), self.MIN_BATCH):
+            self.flush()
+            pass
+        pass
+
+    # Return the types kept in the order they are parsed.
+    def finish(self):
+        self.flush()
+        return self.types
+
+    def flush(self):
+        if not self.pending:
+            return
+        batch = list(self.types.values())
+        batch.extend(self.pending)
+        self.pending = []
+
+        # Refine classes until the number of classes doesn't change.
+        # References to addresses not parsed are told apart by
+        # negative numbers.
+        refs = [tuple(iter_type_refs(_type)) for _type in batch]
+        labels = {}
+        classes = [labels.setdefault(self.get_label(_type), len(labels))
+                   for _type in batch]
+        num_classes = len(labels)
+        while True:
+            colors = dict(zip((_type.addr for _type in batch), classes))
+            labels = {}
+            new_classes = [
+                labels.setdefault((cls, tuple([colors.get(ref, -2 - ref)
+                                               for ref in type_refs])),
+                                  len(labels))
+                for cls, type_refs in zip(classes, refs)]
+            if len(labels) == num_classes:
+                break
+            classes = new_classes
+            num_classes = len(labels)
+            pass
+
+        firsts = {}
+        replaced = {}
+        kept = {}
+        for _type, cls in zip(batch, classes):
+            first = firsts.setdefault(cls, _type.addr)
+            if first != _type.addr:
+                replaced[_type.addr] = first
+                continue
+            kept[_type.addr] = _type
+            pass
+        self.dropped += len(replaced)
+        for _type in itertools.islice(kept.values(), len(self.types), None):
+            if _type.type >= 0:
+                _type.type = replaced.get(_type.type, _type.type)
+                pass
+            if _type.members or _type.params:
+                for param in _type.comm_params:
+                    param.value = replaced.get(param.value, param.value)
+                    pass
                 pass
             pass
+        self.types = kept
+        pass
+
+    # Attributes of a type other than references.  The values of
+    # enumerators are values, and the values of members and
+    # parameters are references.
+    @staticmethod
+    def get_label(_type):
+        return (_type.meta_type, _type.name, _type.linkage_name,
+                _type.declaration, _type.members, _type.values,
+                _type.params, _type.type < 0,
+                tuple([(param.meta_type, param.name, param.linkage_name,
+                        param.offset, param.external,
+                        param.value if _type.values else None)
+                       for param in _type.comm_params]))
+    pass
+
+def parse_DIEs(filename, jobs=1, cu_cache=None, fast=False,
+               cu_includes=(), cu_excludes=()):
+    void = TypeInfo(0, MT_base)
+    void.name = 'void'
+    subprograms_lst = deque()
+    types_lst = TypeDedup({0: void})
+
+    dwarfinfo = load_dwarf_info(filename)
+    if dwarfinfo is None:
+        print('no dwarf info')
+        return
+    init_die_reader(dwarfinfo, fast)
+    cus = dwarfinfo.iter_CUs()
+    if cu_includes or cu_excludes:
+        all_cus = list(cus)
+        cus = list(filter_CUs(all_cus, cu_includes, cu_excludes))
+        print(' (%d of %d CUs selected)' % (len(cus), len(all_cus)),
+              end='', flush=True)
+        del all_cus
+        pass
+    if cu_cache is not None:
+        parse_CUs_cached(filename, dwarfinfo, cus, jobs, cu_cache,
+                         subprograms_lst, types_lst)
+    elif jobs > 1:
+        parse_CUs_parallel(filename, dwarfinfo, cus, jobs,
+                           subprograms_lst, types_lst)
+    else:
+        for cu in cus:
+            parse_CU(cu, subprograms_lst, types_lst)
+            pass
+        pass
+
+    subprograms = {}
+    subprograms.update((subprog.addr, subprog) for subprog in subprograms_lst)
+    types = types_lst.finish()
+    print(' (%d duplicate types dropped)' % types_lst.dropped, end='')
+
+    origins = OriginResolver(subprograms)
+    merged_calls = OrderedSets()
+    for subp in subprograms.values():
+        if not subp.is_original():
+            origin_addr = origins.find(subp.origin)
+            if origin_addr not in merged_calls:
+                merged_calls.init(origin_addr, subprograms[origin_addr].calls)
+                pass
+            merged_calls.add_all(origin_addr, subp.calls)
         else:
             if subp.name == '<unknown>':
                 subp.name += hex(subp.addr)[2:]
                 pass
             pass
         pass
+    for addr, calls in merged_calls.items():
+        subprograms[addr].calls = calls
+        pass
 
     return subprograms, types
 
-def make_signature(_type, types):
-    if _type.meta_type == MT_placeholder:
-        return get_symbol_name(_type)
-    if _type.meta_type == MT_base:
-        return get_symbol_name(_type)
-    if _type.meta_type == MT_unspecified:
-        return get_symbol_name(_type)
+# Intern signatures of types as small integers.
+#
+# A signature is a tuple of the meta type, the name, and the
+# signatures or addresses of the types referenced by the type.  Equal
+# tuples are mapped to the same integer, so that types can be compared
+# by integers instead of building and hashing long strings.
+class SignatureTable:
+    def __init__(self):
+        self.sigs = {}
+        pass
+
+    def intern(self, key):
+        sig = self.sigs.get(key)
+        if sig is None:
+            sig = len(self.sigs)
+            self.sigs[key] = sig
+            pass
+        return sig
+
+    def __len__(self):
+        return len(self.sigs)
+    pass
+
+# Make a signature of a type from the addresses of the types it
+# references.  The referenced types should have been merged already.
+def make_signature(_type, types, sig_table):
+    if _type.meta_type in (MT_placeholder, MT_base, MT_unspecified):
+        return sig_table.intern((get_symbol_name(_type),))
     if _type.meta_type in ptr_tags:
         if types[_type.type].meta_type == MT_placeholder:
-            return '<pointer>:' + get_symbol_name(types[_type.type])
-        return '<pointer>:' + hex(_type.type)
-    sig = MT_table_rev[_type.meta_type] + ' ' + get_symbol_name(_type)
-    if _type.type >= 0:
-        sig += ' ' + hex(_type.type)
+            return sig_table.intern(('<pointer>',
+                                     get_symbol_name(types[_type.type])))
+        return sig_table.intern(('<pointer>', _type.type))
+    refs = ()
     if _type.members:
-        sig += ' {'
-        sig += ','.join([get_symbol_name(member) + ':' + hex(member.value)
-                         for member in _type.comm_params])
-        sig += '}'
-    if _type.values:
-        sig += ' {'
-        sig += ','.join([get_symbol_name(value) + ':' + str(value.value)
-                         for value in _type.comm_params])
-        sig += '}'
-    if _type.params:
-        sig += '('
-        sig += ','.join([hex(p.value) for p in _type.comm_params])
-        sig += ')'
-        pass
-    return sig
-
-def make_sig_recur_(_type, types, lvl=0):
-    if _type.sig:
-        return _type.sig
+        refs = tuple((get_symbol_name(member), member.value)
+                     for member in _type.comm_params)
+    elif _type.values:
+        refs = tuple((get_symbol_name(value), value.value)
+                     for value in _type.comm_params)
+    elif _type.params:
+        refs = tuple(param.value for param in _type.comm_params)
+        pass
+    return sig_table.intern((_type.meta_type, get_symbol_name(_type),
+                             _type.type, refs))
+
+# Make a signature of a type from the signatures of the types it
+# references recursively.  The result is cached in 'sig_id'.
+def make_sig_recur_(_type, types, sig_table, lvl=0):
+    if _type.sig_id >= 0:
+        return _type.sig_id
 
     if lvl == 200:
-        raise 'too deep'
-    if _type.meta_type == MT_placeholder:
-        return get_symbol_name(_type)
-    if _type.meta_type == MT_base:
-        return get_symbol_name(_type)
-    if _type.meta_type == MT_unspecified:
-        return get_symbol_name(_type)
-    if _type.declaration:
-        sig = MT_table_rev[_type.meta_type] + '+' + get_symbol_name(_type)
-    else:
-        sig = MT_table_rev[_type.meta_type] + ' ' + get_symbol_name(_type)
-        pass
+        raise Exception('too deep')
+    if _type.meta_type in (MT_placeholder, MT_base, MT_unspecified):
+        return sig_table.intern((get_symbol_name(_type),))
+    backing = -1
     if _type.type >= 0:
-        sig += ' ' + make_sig_recur_(types[_type.type], types, lvl+1)
-    if _type.members:
-        sig += ' {'
-        sig += ','.join([get_symbol_name(member) + ':' +
-                         make_sig_recur_(types[member.value], types, lvl+1)
-                         for member in _type.comm_params])
-        sig += '}'
-    if _type.values:
-        sig += ' {'
-        sig += ','.join([get_symbol_name(value) + ':' + str(value.value)
-                         for value in _type.comm_params])
-        sig += '}'
-    if _type.params:
-        sig += '('
-        sig += ','.join([make_sig_recur_(types[param.value], types, lvl+1)
-                         for param in _type.comm_params])
-        sig += ')'
+        backing = make_sig_recur_(types[_type.type], types, sig_table, lvl+1)
         pass
-
-    sig = hashlib.sha256(sig.encode('utf-8')).hexdigest()
-    _type.sig = sig
+    refs = ()
+    if _type.members:
+        refs = tuple((get_symbol_name(member),
+                      make_sig_recur_(types[member.value], types, sig_table,
+                                      lvl+1))
+                     for member in _type.comm_params)
+    elif _type.values:
+        refs = tuple((get_symbol_name(value), value.value)
+                     for value in _type.comm_params)
+    elif _type.params:
+        refs = tuple(make_sig_recur_(types[param.value], types, sig_table,
+                                     lvl+1)
+                     for param in _type.comm_params)
+        pass
+
+    sig = sig_table.intern((_type.meta_type, _type.declaration,
+                            get_symbol_name(_type), backing, refs))
+    _type.sig_id = sig
 
     return sig
 
-def make_sig_recur(_type, types):
-    sig = make_sig_recur_(_type, types)
+def make_sig_recur(_type, types, sig_table):
+    sig = make_sig_recur_(_type, types, sig_table)
     return sig
 
 # Break the circular reference
 # DW_TAG_pointer_type -> DW_TAG_structure_type -> DW_TAG_pointer_type
 #
-# We will follow pointer types until we reach a type that is not a pointer
-# type or a type visited before. If we reach a type that is visited before,
-# we will break the circular reference by replacing a pointer type pointing
-# to a placeholder of the real type. The placeholder is a type with no
-# members.
+# We follow the references of types from every type, in the order of
+# 'types', until we reach a type visited before.  If the type is on
+# the path from the start, we break the loop by replacing the type
+# pointed by a pointer type in the loop with a placeholder of the real
+# type.  A placeholder is a type with no members.  The names of the
+# pointed types are kept in placeholder_names, and every pointer type
+# pointing to a type with one of these names points to a placeholder
+# at the end.
+#
+# A search skips types visited by earlier searches, so every type is
+# visited once, except the types following a broken pointer type in
+# a loop; they are visited again if reached again by the same search
+# to find the loops left through them.  Types in a circular reference
+# are in the same strongly connected component (SCC) of the graph of
+# types.  Loops the searches miss, if any, are broken SCC by SCC.
 #
 # Steps:
-# 1. Create a list of tasks of types to be processed. Each task is a tuple
-#    of a type and a list of visited types.
-# 2. Repeat until all tasks are done:
-#    2.1. Pop a task from the list.
-#    2.2. If the type is marked as visited and with the same start addr,
-#         skip it.
-#    2.3. If the type has been visited from the current start addr,
-#         replace a pointer type with a placeholder type to break
-#         the circular reference.
-#    2.4. Mark the type as visited.
-#    2.5. Repeat for each member of the type.
-#         2.5.1. Creat a task to process the member type. Add the current
-#                type to the list of visited types of the new task.
-# 3. Stop.
+# 1. Search loops from every type not visited yet, choosing
+#    placeholder names for the loops found.
+# 2. Find all SCCs of the graph of types.
+# 3. For each SCC still having a loop:
+#    3.1. Choose names for placeholders to break loops in the SCC,
+#         and add them to placeholder_names.
+#    3.2. Replace the types pointed by pointer types in the SCC with
+#         placeholders if their names are in placeholder_names.
+#    3.3. Find SCCs of the types of the SCC again, and repeat 3. for
+#         every SCC still having a loop.
+# 4. Replace the types pointed by all pointer types with placeholders
+#    if their names are in placeholder_names.
+# 5. Stop.
 def break_circular_reference(subprograms, types, context):
     placeholder_names = set()
-    context['placeholder_names'] = placeholder_names
-    if len(types) == 0:
-        return
-
-    tpiter = iter(list(types.keys()))
-    # 1. Create a list of tasks of types to be processed. Each task is a tuple
-    #    of a type and a list of visited types.
-    tasks = []
-    # 2. Repeat until all tasks are done:
-    pop_cnt = 0
-    while True:
-        if not tasks:
-            try:
-                next_start_addr = next(tpiter)
-                tasks.append((types[next_start_addr], [], next_start_addr))
-            except StopIteration:
-                break
-            else:
-                pop_cnt += 1
-                if pop_cnt % 10000 == 0:
-                    print('.', end='', flush=True)
-                    pass
-                pass
-            pass
-        # 2.1. Pop a task from the list.
-        _type, visited, start_addr = tasks.pop()
-        # 2.2. If the type is marked as visited and with same start
-        #      addr, skip it.
-        if _type.visited >= 0 and _type.visited != start_addr:
-            continue
-        # 2.3. If the type has been visited from the current start addr,
-        #      replace a pointer type with a placeholder type to break
-        #      the circular reference.
-        if _type.visited == start_addr:
-            path_lst = []
-            while isinstance(visited[0], list):
-                path_lst.append(visited[1:])
-                visited = visited[0]
-                pass
-            path_lst.append(visited)
-            path_lst.reverse()
-            visited = list(itertools.chain(*path_lst))
-            try:
-                circular_path = visited[visited.index(_type.addr):]
-            except ValueError:
-                if not _type.to_loop_head:
-                    continue
-                pass
-            else:
-                break_circular_path(circular_path, types, placeholder_names)
-                continue
-            pass
-        # 2.4. Mark the type as visited.
-        _type.visited = start_addr
-
-        visited.append(_type.addr)
-        if len(visited) >= 1024:
-            visited = [visited]
-            pass
-        # 2.5. Repeat for each member of the type.
-        if _type.members:
-            for member in _type.comm_params:
-                # 2.5.1. Creat a task to process the member type. Add the
-                #        current type to the list of visited types of the
-                #        new task.
-                if member.value < 0:
-                    print(_type)
-                    pass
-                tasks.append((types[member.value], visited.copy(), start_addr))
-                pass
-            pass
-        if _type.type >= 0:
-            tasks.append((types[_type.type], visited.copy(), start_addr))
+    context['placeholder_names'] = placeholder_names
+    if len(types) == 0:
+        return
+
+    # 1. Search loops from every type not visited yet.
+    visited = {}
+    loop_heads = set()
+    for start_addr in list(types.keys()):
+        if start_addr in visited:
+            continue
+        search_circular_paths(start_addr, types, placeholder_names,
+                              visited, loop_heads)
+        pass
+    # 2. Find all SCCs of the graph of types.
+    sccs = find_type_SCCs(list(types.keys()), types)
+    # 3. For each SCC still having a loop:
+    for scc in sccs:
+        if is_circular_SCC(scc, types):
+            break_circular_SCC(scc, types, placeholder_names)
             pass
-        if _type.params:
-            for param in _type.comm_params:
-                tasks.append((types[param.value], visited.copy(), start_addr))
+        pass
+    # 4. Replace the types pointed by all pointer types with
+    #    placeholders if their names are in placeholder_names.
+    create_placeholders(types, placeholder_names)
+    # 5. Stop.
+    pass
+
+# Search loops from a type with a depth-first search.
+#
+# References of a type are followed from the last one; see
+# iter_search_refs().  'visited' maps the address of every type
+# visited to the address of the type starting the search visiting it.  A type visited by the current
+# search is visited again only if it is in 'loop_heads'.  The path
+# from the start is kept in a list with the index of every type on
+# it, so finding whether a type is on the path takes a constant time.
+def search_circular_paths(start_addr, types, placeholder_names,
+                          visited, loop_heads):
+    visited[start_addr] = start_addr
+    path = [start_addr]
+    on_path = {start_addr: 0}
+    work = [iter_search_refs(types[start_addr])]
+    while work:
+        for ref in work[-1]:
+            if ref in visited:
+                if visited[ref] != start_addr:
+                    continue
+                if ref in on_path:
+                    # A loop from path[on_path[ref]] to the current type.
+                    break_circular_path(path[on_path[ref]:], types,
+                                        placeholder_names, loop_heads)
+                    continue
+                if ref not in loop_heads:
+                    continue
                 pass
+            visited[ref] = start_addr
+            on_path[ref] = len(path)
+            path.append(ref)
+            work.append(iter_search_refs(types[ref]))
+            break
+        else:
+            work.pop()
+            del on_path[path.pop()]
             pass
         pass
-    # 3. Stop.
-    create_placeholders(types, placeholder_names)
     pass
 
+# Return addresses of types referenced by the given type in the order
+# search_circular_paths() follows them; members, the type and params,
+# from the last one.
+def iter_search_refs(_type):
+    refs = []
+    if _type.members:
+        refs.extend(member.value for member in _type.comm_params)
+        pass
+    if _type.type >= 0:
+        refs.append(_type.type)
+        pass
+    if _type.params:
+        refs.extend(param.value for param in _type.comm_params)
+        pass
+    return reversed(refs)
+
 # Break the circular reference described by the given path.
 #
-# The path is a list of addresses of types. The first type in the path
-# is a pointer type pointing to the second type in the path. The second
-# type in the path is a pointer type pointing to the third type in the
-# path. And so on. The last type in the path is a pointer type pointing
-# to the first type in the path.
-#
-# We choose the pointer type pointing to a type with a name that is
-# first in the dictionary order. The pointed type will be replaced by
-# a placeholder type.
+# The path is a list of addresses of types.  Every type in the path
+# references the next one, and the last type references the first
+# one.
 #
 # Steps:
 # 1. Create a list of pointer types pointing to a type having a name.
 # 2. Replace the pointed type of the last pointer type in the list
-#    with a placeholder type.  It make sure we break as many furture
+#    with a placeholder type.  It makes sure we break as many future
 #    loops as possible.
-# 3. Mark all types following the last pointer type in the list as
-#    to_loop_head.
+# 3. Add all types following the last pointer type in the list to
+#    loop_heads.
 # 4. Stop.
-def break_circular_path(circular_path, types, placeholder_names):
-    if try_existing_placeholders(circular_path, types, placeholder_names):
+def break_circular_path(circular_path, types, placeholder_names, loop_heads):
+    if try_existing_placeholders(circular_path, types, placeholder_names,
+                                 loop_heads):
         return
     # 1. Create a list of pointer types pointing to a type having a name.
     ptrs = []
@@ -893,31 +2010,27 @@ def break_circular_path(circular_path, types, placeholder_names):
             pass
         pass
     if not ptrs:
-        print('No pointer type found in the circular path')
-        print([types[addr] for addr in circular_path])
-        pass
+        raise Exception('No pointer type found in the circular types %s' %
+                        [get_symbol_name(types[addr])
+                         for addr in circular_path])
     # 2. Replace the pointed type of the last pointer type in the list
-    #    with a placeholder type.  It make sure we break as many
-    #    furture loops as possible.
+    #    with a placeholder type.
     ptr = ptrs[-1]
     placeholder_names.add(get_symbol_name(types[ptr.type]))
     ptr.type = create_placeholder(ptr.type, types)
-    # 3. Mark all types following the last pointer type in the list as
-    #    to_loop_head.
-    for addr in circular_path[circular_path.index(ptr.addr) + 1:]:
-        types[addr].to_loop_head = True
-        pass
+    # 3. Add all types following the last pointer type in the list to
+    #    loop_heads.
+    loop_heads.update(circular_path[circular_path.index(ptr.addr) + 1:])
     # 4. Stop.
     pass
 
 # Try to use existing placeholders to break the circular reference.
 #
-# If a pointer type pointing to a type having a name that is the name
-# of another type, and a placeholder has been created for that type,
-# we will create a placeholder for the pointed type and replace the
-# pointed type with the placeholder.
-def try_existing_placeholders(circular_path, types, placeholder_names):
-    for addr in circular_path:
+# If a pointer type points to a type having a name in
+# placeholder_names, we replace the pointed type with a placeholder.
+def try_existing_placeholders(circular_path, types, placeholder_names,
+                              loop_heads):
+    for i, addr in enumerate(circular_path):
         _type = types[addr]
         if _type.meta_type not in ptr_tags:
             continue
@@ -926,13 +2039,205 @@ def try_existing_placeholders(circular_path, types, placeholder_names):
             if pointed_type.meta_type != MT_placeholder:
                 _type.type = create_placeholder(_type.type, types)
                 pass
-            for addr in circular_path[circular_path.index(_type.addr) + 1:]:
-                types[addr].to_loop_head = True
-                pass
+            loop_heads.update(circular_path[i + 1:])
             return True
         pass
     return False
 
+# Generate addresses of types referenced by the given type.
+def iter_type_refs(_type):
+    if _type.members or _type.params:
+        for param in _type.comm_params:
+            yield param.value
+            pass
+        pass
+    if _type.type >= 0:
+        yield _type.type
+        pass
+    pass
+
+# Find strongly connected components of the graph of types.
+#
+# It is Tarjan's algorithm without recursion.  It visits every type
+# and reference once.  If 'within' is given, only references to types
+# in 'within' are followed.
+#
+# Return a list of SCCs.  Every SCC is a list of addresses of types.
+# An SCC always comes after the SCCs it references.
+def find_type_SCCs(addrs, types, within=None):
+    index = {}
+    lowlink = {}
+    stack = []
+    on_stack = set()
+    sccs = []
+    for root in addrs:
+        if root in index:
+            continue
+        index[root] = lowlink[root] = len(index)
+        stack.append(root)
+        on_stack.add(root)
+        work = [(root, iter_type_refs(types[root]))]
+        while work:
+            addr, refs = work[-1]
+            for ref in refs:
+                if within is not None and ref not in within:
+                    continue
+                if ref not in index:
+                    index[ref] = lowlink[ref] = len(index)
+                    stack.append(ref)
+                    on_stack.add(ref)
+                    work.append((ref, iter_type_refs(types[ref])))
+                    break
+                if ref in on_stack and index[ref] < lowlink[addr]:
+                    lowlink[addr] = index[ref]
+                    pass
+                pass
+            else:
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    if lowlink[addr] < lowlink[parent]:
+                        lowlink[parent] = lowlink[addr]
+                        pass
+                    pass
+                if lowlink[addr] == index[addr]:
+                    scc = []
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        scc.append(member)
+                        if member == addr:
+                            break
+                        pass
+                    sccs.append(scc)
+                    pass
+                pass
+            pass
+        pass
+    return sccs
+
+def is_circular_SCC(scc, types):
+    if len(scc) > 1:
+        return True
+    return scc[0] in iter_type_refs(types[scc[0]])
+
+# Break all loops in the given SCC.
+#
+# Pointer types pointing to types with names in placeholder_names are
+# redirected to placeholders.  It removes some edges from the SCC, and
+# the remaining types are divided into smaller SCCs to be handled in
+# the same way until no loop is left.
+def break_circular_SCC(scc, types, placeholder_names):
+    tasks = [scc]
+    while tasks:
+        scc = tasks.pop()
+        within = set(scc)
+        # 2.1. Choose names for placeholders to break loops in the SCC.
+        choose_placeholder_names(scc, within, types, placeholder_names)
+        # 2.2. Replace the types pointed by pointer types in the SCC
+        #      with placeholders if their names are in
+        #      placeholder_names.
+        replace_with_placeholders(scc, types, placeholder_names)
+        # 2.3. Find SCCs of the types of the SCC again.
+        for sub_scc in find_type_SCCs(scc, types, within):
+            if is_circular_SCC(sub_scc, types):
+                tasks.append(sub_scc)
+                pass
+            pass
+        pass
+    pass
+
+def is_ptr_to_placeholder_name(_type, types, placeholder_names):
+    return _type.meta_type in ptr_tags and \
+        get_symbol_name(types[_type.type]) in placeholder_names
+
+# Choose names for placeholders with a depth-first search in the SCC.
+#
+# Pointer types pointing to a type with a name in placeholder_names
+# are not followed since they will be redirected to placeholders.
+# For every loop found, we choose the type pointed by the last pointer
+# type in the loop.  It makes sure we break as many future loops as
+# possible.
+#
+# A loop found later may be broken by a name chosen earlier in the
+# same search.  It is fine to have redundant names; the caller will
+# search again for loops left.
+def choose_placeholder_names(scc, within, types, placeholder_names):
+    visited = set()
+    for root in scc:
+        if root in visited:
+            continue
+        visited.add(root)
+        # The path from the root to the current type.
+        path = [root]
+        on_path = {root: 0}
+        # last_ptrs[i] is the index of the last pointer type in
+        # path[:i + 1] pointing to a type having a name.
+        last_ptrs = []
+        work = []
+
+        def enter(addr):
+            _type = types[addr]
+            last_ptr = last_ptrs[-1] if last_ptrs else -1
+            if is_ptr_to_placeholder_name(_type, types, placeholder_names):
+                refs = iter(())
+            else:
+                if _type.meta_type in ptr_tags and \
+                   get_symbol_name(types[_type.type]) != '<unknown>':
+                    last_ptr = len(path) - 1
+                    pass
+                refs = iter_type_refs(_type)
+                pass
+            last_ptrs.append(last_ptr)
+            work.append(refs)
+            pass
+
+        enter(root)
+        while work:
+            for ref in work[-1]:
+                if ref not in within:
+                    continue
+                if ref in on_path:
+                    # A loop from path[on_path[ref]] to the current type.
+                    last_ptr = last_ptrs[-1]
+                    if last_ptr < on_path[ref]:
+                        raise Exception('No pointer type found in the circular types %s' %
+                                        [get_symbol_name(types[addr])
+                                         for addr in path[on_path[ref]:]])
+                    ptr = types[path[last_ptr]]
+                    placeholder_names.add(get_symbol_name(types[ptr.type]))
+                    continue
+                if ref in visited:
+                    continue
+                visited.add(ref)
+                on_path[ref] = len(path)
+                path.append(ref)
+                enter(ref)
+                break
+            else:
+                work.pop()
+                last_ptrs.pop()
+                del on_path[path.pop()]
+                pass
+            pass
+        pass
+    pass
+
+# Replace the types pointed by pointer types at the given addresses
+# with placeholders if their names are in placeholder_names.
+def replace_with_placeholders(addrs, types, placeholder_names):
+    for addr in addrs:
+        _type = types[addr]
+        if _type.meta_type not in ptr_tags:
+            continue
+        pointed_type = types[_type.type]
+        if pointed_type.meta_type != MT_placeholder and \
+           get_symbol_name(pointed_type) in placeholder_names:
+            _type.type = create_placeholder(_type.type, types)
+            pass
+        pass
+    pass
+
 # Create a placholders for each pointer type pointing to a
 # non-placholder type but with a name in the set of placholder names.
 def create_placeholders(types, placeholder_names):
@@ -960,47 +2265,11 @@ def create_placeholder(addr, types):
     types[placeholder_addr] = placeholder
     return placeholder_addr
 
+# Make sure no circular reference left.
 def check_circular(subprograms, types, context):
-    for _type in types.values():
-        _type.visited = -1
-        pass
-    tasks = []
-    typeiter = iter(types.values())
-    while True:
-        if not tasks:
-            try:
-                tasks.append((next(typeiter), []))
-            except StopIteration:
-                break
-            pass
-        _type, visited = tasks.pop()
-        if _type.visited >= 0:
-            if _type.addr in visited:
-                raise Exception(f'circular type {get_symbol_name(_type)}')
-            continue
-        _type.visited = 1
-        visited.append(_type.addr)
-
-        # 2.5. Repeat for each member of the type.
-        if _type.members:
-            for member in _type.comm_params:
-                # 2.5.1. Creat a task to process the member type. Add the
-                #        current type to the list of visited types of the
-                #        new task.
-                if member.value < 0:
-                    print(_type)
-                    pass
-                tasks.append((types[member.value], visited.copy()))
-                pass
-            pass
-        if _type.type >= 0:
-            tasks.append((types[_type.type], visited.copy()))
-            pass
-        if _type.params:
-            for param in _type.comm_params:
-                tasks.append((types[param.value], visited.copy()))
-                pass
-            pass
+    for scc in find_type_SCCs(list(types.keys()), types):
+        if is_circular_SCC(scc, types):
+            raise Exception(f'circular type {get_symbol_name(types[scc[0]])}')
         pass
     pass
 
@@ -1057,36 +2326,54 @@ def init_transit_type_names(subprograms, types, context):
     pass
 
 # Dump the tree rooted at the given type.
-def dump_tree(_type, types, indent=0):
-    print(' ' * indent + get_symbol_name(_type) + '@' + _type.addr + ' ' + _type.meta_type + '\tsig: ' + make_signature(_type, types))
+def dump_tree(_type, types, sig_table, indent=0):
+    print('%s%s@%x %s\tsig: %d' % (' ' * indent, get_symbol_name(_type),
+                                    _type.addr, MT_table_rev[_type.meta_type],
+                                    make_signature(_type, types, sig_table)))
     if _type.members:
         for member in _type.comm_params:
-            dump_tree(types[member.value], types, indent + 2)
+            dump_tree(types[member.value], types, sig_table, indent + 2)
             pass
         pass
     if _type.type >= 0:
-        dump_tree(types[_type.type], types, indent + 2)
+        dump_tree(types[_type.type], types, sig_table, indent + 2)
         pass
     if _type.params:
         for param in _type.comm_params:
-            dump_tree(types[param.value], types, indent + 2)
+            dump_tree(types[param.value], types, sig_table, indent + 2)
             pass
         pass
     pass
 
+# Merge types having the same signature.
+#
+# A type is ready to be merged once all types it references are
+# chosen or replaced.  Instead of scanning all types round by round
+# until nothing changes, we count the references of every type not
+# chosen yet to types not ready, and put a type in a worklist when the
+# count drops to zero.
+#
+# The worklist is ordered by (round, position) that the type would
+# have been processed at by scanning rounds: a reference to a type
+# settled earlier in the same round is seen in the round, and a
+# reference to a type settled later is seen in the next round.  A
+# replaced parameter is seen one more round later since it is
+# redirected first.  It keeps the types chosen for every signature
+# the same as scanning rounds.
 def merge_types(subprograms, types, context):
     chosen_types = {}
+    sig_table = SignatureTable()
     type_merge_sets = context.setdefault('type_merge_sets', {})
 
     for _type in types.values():
         if _type.chosen or _type.replaced_by >= 0:
             continue
         if _type.meta_type in (MT_base, MT_unspecified):
-            name = get_symbol_name(_type)
-            if name in chosen_types:
-                _type.replaced_by = chosen_types[name].addr
+            sig = make_signature(_type, types, sig_table)
+            if sig in chosen_types:
+                _type.replaced_by = chosen_types[sig].addr
             else:
-                chosen_types[name] = _type
+                chosen_types[sig] = _type
                 _type.chosen = True
                 pass
             pass
@@ -1094,84 +2381,112 @@ def merge_types(subprograms, types, context):
             _type.chosen = True
             pass
         pass
-    replacing_cnt = 1
-    choosing_cnt = 1
-    rounds = 0
-    while (replacing_cnt + choosing_cnt) > 0:
-        replacing_cnt = 0
-        choosing_cnt = 0
-        for _type in types.values():
-            if _type.replaced_by >= 0:
-                continue
-            # If the type is already chosen, skip it.  But if the type
-            # is in type_merge_sets, we don't skip it because we can
-            # not register it in chosen_types at the beginning of this
-            # function.  It is because the signature of the type is
-            # still changing.  Its dependencies may be replaced.
-            if _type.chosen and _type.addr not in type_merge_sets:
-                continue
 
-            chosen_cnt = 0
-            should_chosen = 0
-            if _type.type >= 0:
-                backing = types[_type.type]
-                if backing.replaced_by >= 0:
-                    _type.type = backing.replaced_by
-                    replacing_cnt += 1
-                    pass
-                backing = types[_type.type]
-                if backing.chosen:
-                    chosen_cnt += 1
+    positions = {}
+    for pos, addr in enumerate(types.keys()):
+        positions[addr] = pos
+        pass
+
+    # Count references to types not ready for every type not chosen.
+    dependents = {}
+    pending = {}
+    rounds = {}
+    ready = []
+    for _type in types.values():
+        if _type.chosen or _type.replaced_by >= 0:
+            continue
+        addr = _type.addr
+        cnt = 0
+        rnd = 0
+        for ref, is_param in iter_merge_deps(_type):
+            dep = types[ref]
+            if dep.chosen or dep.replaced_by >= 0:
+                if is_param and dep.replaced_by >= 0:
+                    rnd = 1
                     pass
-                should_chosen += 1
+                continue
+            dependents.setdefault(ref, []).append((addr, is_param))
+            cnt += 1
+            pass
+        rounds[addr] = rnd
+        if cnt:
+            pending[addr] = cnt
+        else:
+            ready.append((rnd, positions[addr], addr))
+            pass
+        pass
+    heapq.heapify(ready)
+
+    merged_cnt = 0
+    while ready:
+        rnd, pos, addr = heapq.heappop(ready)
+        _type = types[addr]
+        redirect_replaced_refs(_type, types)
+        sig = make_signature(_type, types, sig_table)
+        if sig in chosen_types:
+            _type.replaced_by = chosen_types[sig].addr
+            merged_cnt += 1
+        else:
+            chosen_types[sig] = _type
+            _type.chosen = True
+            pass
+        for dep_addr, is_param in dependents.pop(addr, ()):
+            dep_pos = positions[dep_addr]
+            dep_rnd = rnd if pos < dep_pos else rnd + 1
+            if is_param and _type.replaced_by >= 0:
+                dep_rnd += 1
                 pass
-            if _type.members:
-                members = _type.comm_params
-                for i in range(len(members)):
-                    member = members[i]
-                    member_backing = types[member.value]
-                    if member_backing.replaced_by >= 0:
-                        member.value = member_backing.replaced_by
-                        replacing_cnt += 1
-                        pass
-                    member_backing = types[member.value]
-                    if member_backing.chosen:
-                        chosen_cnt += 1
-                        pass
-                    pass
-                should_chosen += len(members)
+            if dep_rnd > rounds[dep_addr]:
+                rounds[dep_addr] = dep_rnd
                 pass
-            if _type.params:
-                params = _type.comm_params
-                for i in range(len(params)):
-                    param = params[i].value
-                    param_backing = types[param]
-                    if param_backing.replaced_by >= 0:
-                        params[i].value = param_backing.replaced_by
-                        replacing_cnt += 1
-                        pass
-                    param_backing = types[param]
-                    if param_backing.chosen:
-                        chosen_cnt += 1
-                        pass
-                    pass
-                should_chosen += len(params)
+            pending[dep_addr] -= 1
+            if pending[dep_addr] == 0:
+                del pending[dep_addr]
+                heapq.heappush(ready, (rounds[dep_addr], dep_pos, dep_addr))
                 pass
+            pass
+        pass
 
-            if chosen_cnt == should_chosen and not _type.chosen:
-                sig = make_signature(_type, types)
-                if sig in chosen_types:
-                    _type.replaced_by = chosen_types[sig].addr
-                    replacing_cnt += 1
-                else:
-                    chosen_types[sig] = _type
-                    _type.chosen = True
-                    choosing_cnt += 1
-                    pass
+    # Types never chosen and types in merge sets may still reference
+    # replaced types.
+    for _type in types.values():
+        if _type.replaced_by >= 0:
+            continue
+        if _type.chosen and _type.addr not in type_merge_sets:
+            continue
+        redirect_replaced_refs(_type, types)
+        pass
+    print(' merged', merged_cnt, end='')
+    pass
+
+# Generate (address, is_param) pairs of types referenced by the type.
+def iter_merge_deps(_type):
+    if _type.type >= 0:
+        yield _type.type, False
+        pass
+    if _type.members:
+        for member in _type.comm_params:
+            yield member.value, False
+            pass
+        pass
+    if _type.params:
+        for param in _type.comm_params:
+            yield param.value, True
+            pass
+        pass
+    pass
+
+def redirect_replaced_refs(_type, types):
+    if _type.type >= 0 and types[_type.type].replaced_by >= 0:
+        _type.type = types[_type.type].replaced_by
+        pass
+    if _type.members or _type.params:
+        for param in _type.comm_params:
+            replaced_by = types[param.value].replaced_by
+            if replaced_by >= 0:
+                param.value = replaced_by
                 pass
             pass
-        rounds += 1
-        #print('   - rounds', rounds, 'replacing_cnt', replacing_cnt, 'choosing_cnt', choosing_cnt)
         pass
     pass
 
@@ -1231,17 +2546,17 @@ def init_merge_set_of_types_with_placeholders(subprograms, types, context):
         type_merge_sets[_type.addr] = id(merge_sets[name])
         pass
 
-    context['merge_sets'] = merge_sets.values()
+    context['merge_sets'] = list(merge_sets.values())
     print(': merge_sets', len(merge_sets), end='')
     context['type_merge_sets'] = type_merge_sets
     pass
 
 # Divide a marge set to subsets of same signature.
-def divide_merge_set_sig(merge_set, type_merge_sets, types):
+def divide_merge_set_sig(merge_set, type_merge_sets, types, sig_table):
     sigs = dict()
     for addr in merge_set:
         _type = types[addr]
-        sig = make_sig_recur(_type, types)
+        sig = make_sig_recur(_type, types, sig_table)
         if sig not in sigs:
             sigs[sig] = set()
             pass
@@ -1255,8 +2570,10 @@ def divide_merge_sets_sig(subprograms, types, context):
     merge_sets = context['merge_sets']
     type_merge_sets = context['type_merge_sets']
     new_merge_sets = []
+    sig_table = SignatureTable()
     for merge_set in merge_sets:
-        sigs = divide_merge_set_sig(merge_set, type_merge_sets, types)
+        sigs = divide_merge_set_sig(merge_set, type_merge_sets, types,
+                                    sig_table)
         new_merge_sets.extend(sigs)
         pass
     context['merge_sets'] = new_merge_sets
@@ -1419,8 +2736,10 @@ def replace_merge_sets(subprograms, types, context):
 
 # Do replacements for a merge set.
 def replace_merge_set(merge_set, types):
-    # Find the representative type.
-    rep_type = types[list(merge_set).pop()]
+    # Find the representative type.  Take the one at the lowest
+    # address instead of relying on the order of the set, which is
+    # different once the set is loaded from a checkpoint.
+    rep_type = types[min(merge_set)]
     rep_type.chosen = True
     # Replace all types in the merge set with the representative type.
     for addr in merge_set:
@@ -1455,15 +2774,11 @@ def borrow_name_from_specification(subprograms, types, context):
     pass
 
 def redirect_calls_to_origin(subprograms, types, context):
+    origins = get_origin_resolver(subprograms, context)
     for caller in subprograms.values():
         if not caller.calls:
             continue
-        for i, callee in enumerate(caller.calls):
-            while subprograms[callee].origin >= 0:
-                callee = subprograms[callee].origin
-                pass
-            caller.calls[i] = callee
-            pass
+        caller.calls = [origins.find(callee) for callee in caller.calls]
         pass
     pass
 
@@ -1477,22 +2792,26 @@ def set_call_names(subprograms, types, context):
     pass
 
 def merge_call_names_to_original(subprograms, types, context):
+    origins = get_origin_resolver(subprograms, context)
+    merged_names = OrderedSets()
     for subp in subprograms.values():
         if subp.is_original():
             continue
-        origin = subp
-        while not origin.is_original():
-            origin = subprograms[origin.origin]
-            pass
-        for call in subp.call_names:
-            if call not in origin.call_names:
-                origin.call_names.append(call)
-                pass
+        origin_addr = origins.find(subp.origin)
+        if origin_addr not in merged_names:
+            merged_names.init(origin_addr,
+                              subprograms[origin_addr].call_names)
             pass
+        merged_names.add_all(origin_addr, subp.call_names)
+        pass
+    for addr, call_names in merged_names.items():
+        subprograms[addr].call_names = call_names
         pass
     pass
 
 def remove_not_original(subprograms, types, context):
+    # Instances are gone; so are the origins resolved for them.
+    context.pop('origin_resolver', None)
     addrs = [subp.addr for subp in subprograms.values()]
     for addr in addrs:
         subp = subprograms[addr]
@@ -1604,39 +2923,457 @@ type_process_phases = [
     remove_replaced_types,
 ]
 
+# Find the build-id of an ELF file.
+#
+# Fall back to a SHA256 digest of the content of the file if it has no
+# .note.gnu.build-id section.
+def get_build_id(filename):
+    mapped = open_ELF(filename)
+    elffile = ELFFile(mapped)
+    section = elffile.get_section_by_name('.note.gnu.build-id')
+    if section is not None:
+        for note in section.iter_notes():
+            if note['n_type'] == 'NT_GNU_BUILD_ID':
+                return note['n_desc']
+            pass
+        pass
+    return 'sha256-' + hashlib.sha256(mapped).hexdigest()
+
+# Checkpoints of the state between stages for --resume-from.
+#
+# A checkpoint is a pickle of subprograms, types and context taken
+# after parsing or after a phase.  It is named by the build-id of the
+# binary and the stage.  Resuming from a phase loads the checkpoint
+# taken right before the phase.  Options changing the state, like
+# CU filters, are kept in checkpoints and must match.
+class Checkpoints:
+    VERSION = 1
+
+    def __init__(self, dirname, build_id, settings):
+        self.dirname = dirname
+        self.build_id = build_id
+        self.settings = settings
+        pass
+
+    def get_path(self, stage):
+        return os.path.join(self.dirname, '%s-%s.pickle' % (self.build_id, stage))
+
+    def save(self, stage, subprograms, types, context):
+        os.makedirs(self.dirname, exist_ok=True)
+        path = self.get_path(stage)
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as fo:
+            pickle.dump((self.VERSION, self.settings,
+                         subprograms, types, context),
+                        fo, pickle.HIGHEST_PROTOCOL)
+            pass
+        os.replace(tmp, path)
+        pass
+
+    def load(self, stage):
+        path = self.get_path(stage)
+        if not os.path.exists(path):
+            raise Exception('no checkpoint %s; run with --checkpoint-phases first' % path)
+        with open(path, 'rb') as fo:
+            version, settings, subprograms, types, context = pickle.load(fo)
+            pass
+        if version != self.VERSION:
+            raise Exception('checkpoint %s is of an old version' % path)
+        if settings != self.settings:
+            raise Exception('checkpoint %s was made with %s' % (path, settings))
+        # Merge sets are identified by id() of sets, which are
+        # different after loading.
+        if 'merge_sets' in context and 'type_merge_sets' in context:
+            type_merge_sets = context['type_merge_sets']
+            for merge_set in context['merge_sets']:
+                for addr in merge_set:
+                    type_merge_sets[addr] = id(merge_set)
+                    pass
+                pass
+            pass
+        return subprograms, types, context
+    pass
+
+# Measurements of stages for --metrics.
+#
+# A stage is parsing, a phase in type_process_phases, or persisting.
+# For every stage, it records wall and CPU time, the growth of the peak
+# RSS, and counts of objects before and after the stage.  CPU time and
+# RSS include worker processes of -j.
+class Metrics:
+    def __init__(self, filename):
+        self.filename = filename
+        self.stages = []
+        self.current = None
+        self.start_time = time.time()
+        self.start_cpu = self.get_cpu_time()
+        self.db_rows = {}
+        self.binaries = []
+        pass
+
+    @staticmethod
+    def get_cpu_time():
+        cpu = 0.0
+        for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN):
+            usage = resource.getrusage(who)
+            cpu += usage.ru_utime + usage.ru_stime
+            pass
+        return cpu
+
+    @staticmethod
+    def get_max_rss():
+        # In KiB on Linux.
+        return max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                   resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+
+    @staticmethod
+    def count_objects(subprograms, types, context):
+        if subprograms is None:
+            return {}
+        counts = {'subprograms': len(subprograms), 'types': len(types)}
+        counts['placeholders'] = sum(1 for _type in types.values()
+                                     if _type.meta_type == MT_placeholder)
+        if 'placeholder_names' in context:
+            counts['placeholder_names'] = len(context['placeholder_names'])
+            pass
+        if 'merge_sets' in context:
+            counts['merge_sets'] = len(context['merge_sets'])
+            pass
+        return counts
+
+    def start_stage(self, name, subprograms=None, types=None, context=None):
+        self.current = {
+            'name': name,
+            'in': self.count_objects(subprograms, types, context),
+            'wall': time.time(),
+            'cpu': self.get_cpu_time(),
+            'max_rss_kb': self.get_max_rss(),
+        }
+        pass
+
+    def stop_stage(self, subprograms=None, types=None, context=None):
+        stage = self.current
+        max_rss = self.get_max_rss()
+        stage['wall'] = time.time() - stage['wall']
+        stage['cpu'] = self.get_cpu_time() - stage['cpu']
+        stage['max_rss_delta_kb'] = max_rss - stage['max_rss_kb']
+        stage['max_rss_kb'] = max_rss
+        stage['out'] = self.count_objects(subprograms, types, context)
+        self.stages.append(stage)
+        self.current = None
+        pass
+
+    # Stages of a binary ingested by a worker process.
+    def add_binary(self, binary, stages):
+        self.binaries.append({'binary': binary, 'stages': stages})
+        pass
+
+    def count_db_rows(self, output):
+        conn = sqlite3.connect(output)
+        tables = [row[0] for row in conn.execute(
+            "select name from sqlite_master where type = 'table'")]
+        for table in tables:
+            self.db_rows[table] = conn.execute(
+                'select count(*) from "%s"' % table).fetchone()[0]
+            pass
+        conn.close()
+        pass
+
+    def save(self, binary, output):
+        data = {
+            'binary': binary,
+            'output': output,
+            'wall': time.time() - self.start_time,
+            'cpu': self.get_cpu_time() - self.start_cpu,
+            'max_rss_kb': self.get_max_rss(),
+            'stages': self.stages,
+            'db_rows': self.db_rows,
+        }
+        if self.binaries:
+            data['binaries'] = self.binaries
+            pass
+        with open(self.filename, 'w') as fo:
+            json.dump(data, fo, indent=2)
+            fo.write('\n')
+            pass
+        pass
+    pass
+
+# Find ELF files in the given paths.
+#
+# Directories are searched recursively.  Files are identified by the
+# magic number at the beginning.  The order of the paths is kept, and
+# files in a directory are sorted by names.
+def find_binaries(paths):
+    def is_elf(path):
+        with open(path, 'rb') as fo:
+            return fo.read(4) == b'\x7fELF'
+        pass
+
+    binaries = []
+    for path in paths:
+        if not os.path.isdir(path):
+            binaries.append(path)
+            continue
+        for dirpath, dirnames, filenames in os.walk(path):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                filename = os.path.join(dirpath, filename)
+                if os.path.isfile(filename) and is_elf(filename):
+                    binaries.append(filename)
+                    pass
+                pass
+            pass
+        pass
+    # Remove duplicates
+    return list(dict.fromkeys(binaries))
+
+def run_phases(subprograms, types, context, phases,
+               metrics=None, checkpoints=None):
+    for phase in phases:
+        print(' - processing phase', phase.__name__, end='', flush=True)
+        start_time = time.time()
+        if metrics:
+            metrics.start_stage(phase.__name__, subprograms, types, context)
+            pass
+        phase(subprograms, types, context)
+        if metrics:
+            metrics.stop_stage(subprograms, types, context)
+            pass
+        if checkpoints:
+            checkpoints.save(phase.__name__, subprograms, types, context)
+            pass
+        print(': done in %.2f seconds' % (time.time() - start_time))
+        pass
+    pass
+
+# Settings of ingesting binaries for ingest_binary().
+#
+# (fast, include_cu, exclude_cu, metrics)
+ingest_settings = None
+
+def init_ingest_worker(settings, quiet):
+    global ingest_settings
+    ingest_settings = settings
+    if quiet:
+        # Messages of processes would be mixed up.
+        sys.stdout = open(os.devnull, 'w')
+        pass
+    pass
+
+# Parse and process a binary for ingest_binaries().
+#
+# Return the filename, subprograms, types, and stages of metrics.
+# Subprograms and types are None if the binary has no DWARF.
+def ingest_binary(filename):
+    fast, include_cu, exclude_cu, with_metrics = ingest_settings
+    metrics = Metrics(None) if with_metrics else None
+    if metrics:
+        metrics.start_stage('parse')
+        pass
+    result = parse_DIEs(filename, 1, None, fast, include_cu, exclude_cu)
+    if result is None:
+        return filename, None, None, metrics and metrics.stages
+    subprograms, types = result
+    context = {}
+    if metrics:
+        metrics.stop_stage(subprograms, types, context)
+        pass
+    run_phases(subprograms, types, context, type_process_phases, metrics)
+    return filename, subprograms, types, metrics and metrics.stages
+
+def ingest_binaries_quietly(filenames):
+    with open(os.devnull, 'w') as devnull:
+        for filename in filenames:
+            with contextlib.redirect_stdout(devnull):
+                result = ingest_binary(filename)
+                pass
+            yield result
+            pass
+        pass
+    pass
+
+# Ingest many binaries into one database.
+#
+# Binaries are parsed and processed independently, in -j processes.
+# Results are persisted to the same database in the order of the
+# binaries as soon as they are ready.  Symbols are shared by names
+# across binaries, while types are kept per binary.
+def ingest_binaries(filenames, output, opts):
+    metrics = Metrics(opts.metrics) if opts.metrics else None
+
+    db = create_CFDB(output)
+
+    settings = (opts.die_reader == 'fast',
+                opts.include_cu, opts.exclude_cu, metrics is not None)
+    print('ingesting %d binaries' % len(filenames))
+    start_time = time.time()
+    pool = None
+    if opts.jobs > 1:
+        pool = multiprocessing.Pool(opts.jobs, init_ingest_worker,
+                                    (settings, True))
+        results = pool.imap(ingest_binary, filenames)
+    else:
+        init_ingest_worker(settings, False)
+        results = ingest_binaries_quietly(filenames)
+        pass
+    for i, (filename, subprograms, types, stages) in enumerate(results):
+        if subprograms is None:
+            print('[%d/%d] %s: no dwarf info, skipped' %
+                  (i + 1, len(filenames), filename))
+            continue
+        if metrics:
+            metrics.start_stage('persist', subprograms, types, {})
+            pass
+        persist_info(subprograms, types, db, filename)
+        if metrics:
+            metrics.stop_stage(subprograms, types, {})
+            metrics.add_binary(filename, stages + [metrics.stages.pop()])
+            pass
+        print('[%d/%d] %s: %d subprograms and %d types, %.2f seconds' %
+              (i + 1, len(filenames), filename, len(subprograms), len(types),
+               time.time() - start_time))
+        pass
+    if pool is not None:
+        pool.close()
+        pool.join()
+        pass
+    finish_CFDB(db)
+
+    if metrics:
+        metrics.count_db_rows(output)
+        metrics.save(filenames, output)
+        pass
+    pass
+
 def main():
     optparser = optparse.OptionParser()
     optparser.add_option('-o', '--output', dest='output', default='callgraph.sqlite3',
                          help='output file name')
+    optparser.add_option('-j', '--jobs', dest='jobs', type='int', default=1,
+                         help='number of processes parsing DIEs')
+    optparser.add_option('-i', '--incremental', dest='incremental',
+                         action='store_true', default=False,
+                         help='reuse parsing results of unchanged compile units')
+    optparser.add_option('--cu-cache', dest='cu_cache',
+                         help='cache file of compile units for --incremental'
+                         ' (default: <output>.cu-cache)')
+    optparser.add_option('--die-reader', dest='die_reader', default='pyelftools',
+                         type='choice', choices=('pyelftools', 'fast'),
+                         help='decoder of DIEs; pyelftools or fast'
+                         ' (default: pyelftools)')
+    optparser.add_option('--include-cu', dest='include_cu', action='append',
+                         default=[], metavar='GLOB',
+                         help='parse only compile units with names matching'
+                         ' the glob (can be repeated)')
+    optparser.add_option('--exclude-cu', dest='exclude_cu', action='append',
+                         default=[], metavar='GLOB',
+                         help='skip compile units with names matching'
+                         ' the glob (can be repeated)')
+    optparser.add_option('--metrics', dest='metrics', metavar='FILE',
+                         help='write time, memory and object counts of'
+                         ' every stage to a JSON file')
+    optparser.add_option('--checkpoint', dest='checkpoint',
+                         action='store_true', default=False,
+                         help='save the state after parsing DIEs')
+    optparser.add_option('--checkpoint-phases', dest='checkpoint_phases',
+                         action='store_true', default=False,
+                         help='save the state after parsing DIEs and'
+                         ' after every phase')
+    optparser.add_option('--checkpoint-dir', dest='checkpoint_dir',
+                         help='directory of checkpoints'
+                         ' (default: <output>.checkpoints)')
+    phase_names = [phase.__name__ for phase in type_process_phases]
+    optparser.add_option('--resume-from', dest='resume_from', metavar='PHASE',
+                         type='choice', choices=phase_names + ['persist'],
+                         help='load the checkpoint taken before the phase'
+                         ' and continue from the phase')
     opts, args = optparser.parse_args()
 
-    filename = args[0]
+    filenames = find_binaries(args)
+    if not filenames:
+        optparser.error('no ELF file is given')
+        pass
     output = opts.output
+    if len(filenames) > 1:
+        if opts.incremental or opts.cu_cache or opts.checkpoint or \
+           opts.checkpoint_phases or opts.resume_from:
+            optparser.error('-i, --cu-cache, --checkpoint, --checkpoint-phases'
+                            ' and --resume-from work with a single binary')
+            pass
+        ingest_binaries(filenames, output, opts)
+        return
+    filename = filenames[0]
 
-    print('parsing DIEs from %s' % filename, end='', flush=True)
-    fo = open(filename, 'rb')
-    start_time = time.time()
-    subprograms, types = parse_DIEs(fo)
-    print(' - done in %.2f seconds' % (time.time() - start_time))
+    cu_cache = None
+    if opts.incremental or opts.cu_cache:
+        cu_cache = CUCache(opts.cu_cache or output + '.cu-cache')
+        cu_cache.load()
+        pass
 
-    # Check if the file exists. If yes, delete it.
-    if os.path.exists(output):
-        print('output file %s already exists, delete it' % output)
-        os.remove(output)
+    metrics = Metrics(opts.metrics) if opts.metrics else None
+
+    checkpoints = None
+    if opts.checkpoint or opts.checkpoint_phases or opts.resume_from:
+        settings = {'include_cu': opts.include_cu,
+                    'exclude_cu': opts.exclude_cu}
+        checkpoints = Checkpoints(opts.checkpoint_dir or output + '.checkpoints',
+                                  get_build_id(filename), settings)
         pass
 
-    context = {}
-    print('processing subprograms (%d) and types (%d types)' % (len(subprograms), len(types)))
-    for phase in type_process_phases:
-        print(' - processing phase', phase.__name__, end='', flush=True)
+    stages = ['parse'] + phase_names + ['persist']
+    if opts.resume_from:
+        stage = stages[stages.index(opts.resume_from) - 1]
+        print('loading checkpoint after %s' % stage, end='', flush=True)
         start_time = time.time()
-        phase(subprograms, types, context)
-        print(': done in %.2f seconds' % (time.time() - start_time))
+        subprograms, types, context = checkpoints.load(stage)
+        print(' - done in %.2f seconds' % (time.time() - start_time))
+        first_phase = stages.index(opts.resume_from) - 1
+    else:
+        print('parsing DIEs from %s' % filename, end='', flush=True)
+        start_time = time.time()
+        if metrics:
+            metrics.start_stage('parse')
+            pass
+        subprograms, types = parse_DIEs(filename, opts.jobs, cu_cache,
+                                        opts.die_reader == 'fast',
+                                        opts.include_cu, opts.exclude_cu)
+        if cu_cache is not None:
+            cu_cache.save(merge=bool(opts.include_cu or opts.exclude_cu))
+            pass
+        print(' - done in %.2f seconds' % (time.time() - start_time))
+        context = {}
+        if metrics:
+            metrics.stop_stage(subprograms, types, context)
+            pass
+        if opts.checkpoint or opts.checkpoint_phases:
+            checkpoints.save('parse', subprograms, types, context)
+            pass
+        first_phase = 0
         pass
+
+    print('processing subprograms (%d) and types (%d types)' % (len(subprograms), len(types)))
+    run_phases(subprograms, types, context, type_process_phases[first_phase:],
+               metrics, checkpoints if opts.checkpoint_phases else None)
     print(' - processing phase done (%d subprograms and %d types)' % (len(subprograms), len(types)))
 
-    print('persisting to %s...' % output)
-    persist_info(subprograms, types, output)
+    print('persisting to %s' % output, end='', flush=True)
+    start_time = time.time()
+    if metrics:
+        metrics.start_stage('persist', subprograms, types, context)
+        pass
+    db = create_CFDB(output)
+    persist_info(subprograms, types, db, filename)
+    finish_CFDB(db)
+    if metrics:
+        metrics.stop_stage(subprograms, types, context)
+        pass
+    print(' - done in %.2f seconds' % (time.time() - start_time))
+
+    if metrics:
+        metrics.count_db_rows(output)
+        metrics.save(filename, output)
+        pass
     pass
 
 if __name__ == '__main__':
@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+#
+# Answer queries of draw-callflow.py, draw-types.py and list-cu-calls.py
+# from a database loaded into memory once.
+#
+# Usage: query-server.py [-a <host>:<port>] <database>
+#
+# Options:
+#   -a <host>:<port>   Address to listen on. (default: localhost:8765)
+#
+# Run the scripts with '--server <host>:<port>' to send their queries
+# here.  The call graph (callgraph.CallGraph) and the types
+# (typegraph.TypeGraph) stay in memory, so a query costs only its
+# traversal.  When the database file is replaced, e.g. rebuilt by
+# mk-dwarf-db.py, it is loaded again at the next query.
+#
+# Endpoints; requests and responses are JSON (see queryclient.py):
+#   POST /callflow   {"options": <options of draw-callflow.py>}
+#   POST /types      {"options": <options of draw-types.py>}
+#   POST /cu-calls   {"cu1": <name>, "cu2": <name>}
+#   GET  /status
+#
+import os
+import io
+import sys
+import json
+import time
+import argparse
+import optparse
+import threading
+import traceback
+import importlib.util
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import dbpool
+import callgraph
+import typegraph
+import queryclient
+
+def load_script(name):
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        name + '.py')
+    spec = importlib.util.spec_from_file_location(name.replace('-', '_'),
+                                                  path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+draw_callflow = load_script('draw-callflow')
+draw_types = load_script('draw-types')
+list_cu_calls = load_script('list-cu-calls')
+
+# Defaults of draw-types.py options.
+types_defaults = {
+    'type': None,
+    'max_levels': None,
+    'exclude_type': None,
+    'strict_exclude_type': None,
+    'highlight': None,
+    'show_id': False,
+}
+
+# The graphs of a database file.
+class LoadedDB:
+    def __init__(self, filename):
+        self.filename = filename
+        self.key = dbpool.get_file_key(filename)
+        start_time = time.time()
+        conn = dbpool.connect(filename)
+        self.graph = callgraph.load(conn)
+        self.types = typegraph.load(conn)
+        conn.close()
+        self.load_time = time.time() - start_time
+        # Identifies this build of the DB; mk-dwarf-db.py replaces the
+        # file with a new one for every build.
+        self.build_id = '%x-%x-%x' % self.key
+        pass
+
+    def is_stale(self):
+        return dbpool.get_file_key(self.filename) != self.key
+    pass
+
+# A LoadedDB shared by threads, loaded at the first use and loaded
+# again when the file has been replaced.
+class ResidentDB:
+    def __init__(self, filename):
+        self.filename = os.path.realpath(filename)
+        self.lock = threading.Lock()
+        self.db = None
+        pass
+
+    def load(self):
+        db = LoadedDB(self.filename)
+        print('loaded %s: %d symbols, %d calls and %d types in %.2f seconds' %
+              (self.filename, db.graph.num_symbols(), db.graph.num_calls(),
+               db.types.num_types(), db.load_time), file=sys.stderr)
+        return db
+
+    def get(self):
+        with self.lock:
+            if self.db is None or self.db.is_stale():
+                self.db = self.load()
+                pass
+            return self.db
+        pass
+    pass
+
+class QueryServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, filename):
+        self.resident_db = ResidentDB(filename)
+        self.resident_db.get()
+        super().__init__(address, QueryHandler)
+        pass
+
+    def get_db(self):
+        return self.resident_db.get()
+    pass
+
+def query_callflow(db, request):
+    options = optparse.Values(request.get('options') or {})
+    draw_callflow.normalize_options(options)
+    out = io.StringIO()
+    err = io.StringIO()
+    draw_callflow.draw_callflow(db.graph, options, out, err)
+    return {'output': out.getvalue(), 'warnings': err.getvalue()}
+
+def query_types(db, request):
+    args = argparse.Namespace(**dict(types_defaults,
+                                     **(request.get('options') or {})))
+    out = io.StringIO()
+    draw_types.draw_types_diagram(db.types, args, out)
+    return {'output': out.getvalue()}
+
+def query_cu_calls(db, request):
+    cu1 = request.get('cu1')
+    cu2 = request.get('cu2')
+    cu1_id = db.graph.get_cu_id(cu1)
+    if cu1_id is None:
+        raise queryclient.QueryError(f'CU {cu1} not found.')
+    cu2_id = db.graph.get_cu_id(cu2)
+    if cu2_id is None:
+        raise queryclient.QueryError(f'CU {cu2} not found.')
+    out = io.StringIO()
+    list_cu_calls.print_cu_calls(cu1, cu2,
+                                 sorted(db.graph.get_cu_callee_names(cu1_id,
+                                                                     cu2_id)),
+                                 out)
+    return {'output': out.getvalue()}
+
+queries = {
+    '/callflow': query_callflow,
+    '/types': query_types,
+    '/cu-calls': query_cu_calls,
+}
+
+class QueryHandler(BaseHTTPRequestHandler):
+    def send_json(self, code, obj):
+        body = json.dumps(obj).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        pass
+
+    def send_text(self, code, text):
+        body = (text + '\n').encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'text/plain; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        pass
+
+    def do_GET(self):
+        if self.path != '/status':
+            self.send_text(404, 'unknown path %s' % self.path)
+            return
+        db = self.server.get_db()
+        self.send_json(200, {
+            'db': db.filename,
+            'symbols': db.graph.num_symbols(),
+            'calls': db.graph.num_calls(),
+            'types': db.types.num_types(),
+            'load_time': db.load_time,
+        })
+        pass
+
+    def do_POST(self):
+        query = queries.get(self.path)
+        if query is None:
+            self.send_text(404, 'unknown path %s' % self.path)
+            return
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            request = json.loads(self.rfile.read(length).decode('utf-8'))
+            db = self.server.get_db()
+            if os.path.realpath(request.get('db', '')) != db.filename:
+                raise queryclient.QueryError('the server has loaded %s, not %s' %
+                                             (db.filename, request.get('db')))
+            self.send_json(200, query(db, request))
+        except (queryclient.QueryError, ValueError) as e:
+            self.send_text(400, str(e))
+        except Exception as e:
+            traceback.print_exc()
+            self.send_text(500, 'internal error: %s' % e)
+            pass
+        pass
+    pass
+
+def parse_address(address):
+    host, _, port = address.rpartition(':')
+    return (host or 'localhost', int(port))
+
+def main():
+    parser = optparse.OptionParser(usage='usage: %prog [-a <host>:<port>] <database>')
+    parser.add_option('-a', '--address', dest='address',
+                      default=queryclient.DEFAULT_SERVER,
+                      help='address to listen on (default: %default)')
+    (options, args) = parser.parse_args()
+    if len(args) != 1:
+        parser.print_usage()
+        sys.exit(1)
+        pass
+
+    try:
+        server = QueryServer(parse_address(options.address), args[0])
+    except typegraph.SchemaError as e:
+        print('%s: %s' % (sys.argv[0], e), file=sys.stderr)
+        sys.exit(1)
+        pass
+    print('listening on %s:%d' % server.server_address[:2], file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+    pass
+
+if __name__ == '__main__':
+    main()
+    pass
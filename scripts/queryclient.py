@@ -0,0 +1,49 @@
+#
+# Client of query-server.py.
+#
+# draw-callflow.py, draw-types.py and list-cu-calls.py send their
+# queries to a running query-server.py with '--server <host>:<port>'
+# instead of loading the database themselves.
+#
+# Requests are JSON objects POSTed to a path of the server, carrying
+# the absolute path of the database in "db"; the server refuses
+# queries for a database other than the one it has loaded.  Responses
+# are JSON objects too, with the text a script would print in "output"
+# and its warnings in "warnings".  Errors come back as HTTP 400 with a
+# message in the body.
+#
+import os
+import sys
+import json
+import urllib.request
+import urllib.error
+
+DEFAULT_SERVER = 'localhost:8765'
+
+# An error of a query, e.g. an unknown symbol.  The message is for
+# users.
+class QueryError(Exception):
+    pass
+
+# Send a query and return the response object.
+def query(server, path, db, payload):
+    payload = dict(payload, db=os.path.abspath(db))
+    req = urllib.request.Request('http://%s%s' % (server, path),
+                                 json.dumps(payload).encode('utf-8'),
+                                 {'Content-Type': 'application/json'})
+    try:
+        with urllib.request.urlopen(req) as resp:
+            return json.loads(resp.read().decode('utf-8'))
+    except urllib.error.HTTPError as e:
+        raise QueryError(e.read().decode('utf-8').strip())
+    except urllib.error.URLError as e:
+        raise QueryError('cannot connect to %s: %s' % (server, e.reason))
+    pass
+
+# Send a query, write its warnings to "err" and return its output.
+def query_output(server, path, db, payload, err=sys.stderr):
+    resp = query(server, path, db, payload)
+    if resp.get('warnings'):
+        err.write(resp['warnings'])
+        pass
+    return resp['output']
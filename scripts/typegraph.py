@@ -0,0 +1,115 @@
+#
+# Types of a database generated by mk-dwarf-db.py.
+#
+# TypeQueries queries the database for every lookup; it is cheap to
+# create and good for a single diagram.  TypeGraph loads all types and
+# members into memory once, for processes answering many queries, like
+# query-server.py.  Both provide the same lookups:
+#
+#   get_type_ids(name)       ids of types of a name
+#   get_type(id)             (id, name, addr, meta type name, declaration)
+#   get_members(id)          [(type_id, name, type, offset)] in order
+#   get_dependant_ids(id)    ids of types having a member of the type
+#
+# The oldest schema version having what these classes use.  Newer
+# versions only add to it.
+SCHEMA_VERSION = 2
+
+class SchemaError(Exception):
+    pass
+
+# Raise SchemaError if the DB is older than the schema these classes
+# know.
+def check_schema_version(conn):
+    version = 1
+    row = conn.execute("select name from sqlite_master"
+                       " where type = 'table' and name = 'schema_info'").fetchone()
+    if row:
+        row = conn.execute("select value from schema_info"
+                           " where key = 'version'").fetchone()
+        version = int(row[0])
+        pass
+    if version < SCHEMA_VERSION:
+        raise SchemaError('schema version %d is not supported;'
+                          ' run upgrade-dwarf-db.py' % version)
+    pass
+
+class TypeQueries:
+    def __init__(self, conn):
+        check_schema_version(conn)
+        self.conn = conn
+        pass
+
+    def get_type_ids(self, name):
+        return [row[0] for row in
+                self.conn.execute('select id from types where name = ?',
+                                  (name,))]
+
+    def get_type(self, type_id):
+        return self.conn.execute('select types.id, types.name, addr, meta_types.name, declaration from types join meta_types on meta_types.id = meta_type where types.id = ?',
+                                 (type_id,)).fetchone()
+
+    def get_members(self, type_id):
+        return self.conn.execute('select type_id, name, type, offset from members where type_id = ? order by seq',
+                                 (type_id,)).fetchall()
+
+    def get_dependant_ids(self, type_id):
+        return [row[0] for row in
+                self.conn.execute('select distinct type_id from members'
+                                  ' where type = ? order by type_id',
+                                  (type_id,))]
+    pass
+
+class TypeGraph:
+    def __init__(self, types, members, dependants):
+        # id -> (id, name, addr, meta type name, declaration)
+        self.types = types
+        # id -> [(type_id, name, type, offset)]
+        self.members = members
+        # id -> [type_id]
+        self.dependants = dependants
+        self.ids_by_name = {}
+        for type_id, row in types.items():
+            self.ids_by_name.setdefault(row[1], []).append(type_id)
+            pass
+        pass
+
+    def get_type_ids(self, name):
+        return self.ids_by_name.get(name, [])
+
+    def get_type(self, type_id):
+        return self.types.get(type_id)
+
+    def get_members(self, type_id):
+        return self.members.get(type_id, [])
+
+    def get_dependant_ids(self, type_id):
+        return self.dependants.get(type_id, [])
+
+    def num_types(self):
+        return len(self.types)
+    pass
+
+# Load all types and members from a database connection.
+def load(conn):
+    check_schema_version(conn)
+    meta_types = dict(conn.execute('select id, name from meta_types'))
+    types = {}
+    for type_id, name, addr, meta_type, declaration in \
+        conn.execute('select id, name, addr, meta_type, declaration'
+                     ' from types order by id'):
+        types[type_id] = (type_id, name, addr, meta_types[meta_type],
+                          declaration)
+        pass
+    members = {}
+    for row in conn.execute('select type_id, name, type, offset'
+                            ' from members order by type_id, seq'):
+        members.setdefault(row[0], []).append(row)
+        pass
+    dependants = {}
+    for type_id, member_type in \
+        conn.execute('select distinct type_id, type from members'
+                     ' order by type, type_id'):
+        dependants.setdefault(member_type, []).append(type_id)
+        pass
+    return TypeGraph(types, members, dependants)
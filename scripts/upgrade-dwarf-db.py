@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+#
+# Upgrade a database generated by an older mk-dwarf-db.py to the
+# current schema.
+#
+# Usage: upgrade-dwarf-db.py [-o <output-file>] <database>
+#
+# Options:
+#   -o <output-file>   Write the upgraded database to the file instead
+#                      of replacing the given database.
+#
+# The schema is defined by CFDB.init_schema in mk-dwarf-db.py. This
+# script creates a new database of the current schema, copies rows
+# from the old one, and replaces the old file only after all rows are
+# copied (see create_CFDB() and finish_CFDB()).
+#
+import os
+import sys
+import optparse
+import sqlite3
+import importlib.util
+
+def load_mk_dwarf_db():
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        'mk-dwarf-db.py')
+    spec = importlib.util.spec_from_file_location('mk_dwarf_db', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+# Return the schema version of a database.
+#
+# Databases without a schema_info table are version 1.
+def get_schema_version(conn):
+    row = conn.execute("select name from sqlite_master"
+                       " where type = 'table' and name = 'schema_info'").fetchone()
+    if row is None:
+        return 1
+    row = conn.execute("select value from schema_info"
+                       " where key = 'version'").fetchone()
+    return int(row[0])
+
+def get_columns(conn, schema, table):
+    return [row[1] for row in
+            conn.execute('pragma %s.table_info(%s)' % (schema, table))]
+
+def has_table(conn, schema, table):
+    row = conn.execute("select name from %s.sqlite_master"
+                       " where type = 'table' and name = ?" % schema,
+                       (table,)).fetchone()
+    return row is not None
+
+# Copy rows of a version 1 database, attached as "old", to a new
+# database.
+#
+# Version 1 databases keep meta types in text, and the ones built
+# before multi-binary support have no "binaries" table and "binary"
+# columns.  Rows of such a database get NULL binaries.
+def upgrade_from_v1(conn):
+    if 'binary' in get_columns(conn, 'old', 'symbols'):
+        binary = 'binary'
+    else:
+        binary = 'null'
+        pass
+    conn.execute('insert into main.symbols(id, name, cu, binary)'
+                 ' select id, name, cu, %s from old.symbols' % binary)
+    conn.execute('insert or ignore into main.calls(caller, callee)'
+                 ' select caller, callee from old.calls')
+    unknown = conn.execute('select distinct meta_type from old.types'
+                           ' where meta_type not in'
+                           ' (select name from main.meta_types)').fetchall()
+    if unknown:
+        raise Exception('unknown meta types: %s' %
+                        ', '.join(str(row[0]) for row in unknown))
+    conn.execute('insert into main.types(id, name, addr, meta_type, declaration, binary)'
+                 ' select t.id, t.name, t.addr, m.id, t.declaration, %s'
+                 ' from old.types t'
+                 ' join main.meta_types m on m.name = t.meta_type' % binary)
+    # Members were inserted in order; rowid keeps it.
+    conn.execute('insert into main.members(type_id, name, type, offset, seq)'
+                 ' select type_id, name, type, offset,'
+                 ' row_number() over (partition by type_id order by rowid) - 1'
+                 ' from old.members')
+    conn.execute('insert into main.compile_units(id, name)'
+                 ' select id, name from old.compile_units')
+    if has_table(conn, 'old', 'binaries'):
+        conn.execute('insert into main.binaries(id, name)'
+                     ' select id, name from old.binaries')
+        pass
+    conn.commit()
+    pass
+
+# Copy rows of a version 2 database, attached as "old", to a new
+# database.
+#
+# Version 3 adds only the name index, which is built by finish_CFDB().
+def upgrade_from_v2(conn):
+    for table, columns in (('symbols', 'id, name, cu, binary'),
+                           ('calls', 'caller, callee'),
+                           ('types', 'id, name, addr, meta_type, declaration, binary'),
+                           ('members', 'type_id, name, type, offset, seq'),
+                           ('compile_units', 'id, name'),
+                           ('binaries', 'id, name')):
+        conn.execute('insert into main.%s(%s) select %s from old.%s' %
+                     (table, columns, columns, table))
+        pass
+    conn.commit()
+    pass
+
+upgraders = {
+    1: upgrade_from_v1,
+    2: upgrade_from_v2,
+}
+
+def upgrade(filename, output, mk_dwarf_db):
+    conn = sqlite3.connect(filename)
+    version = get_schema_version(conn)
+    conn.close()
+    if version == mk_dwarf_db.SCHEMA_VERSION:
+        print('%s is already at schema version %d' % (filename, version))
+        return
+    if version not in upgraders:
+        raise Exception('%s: unknown schema version %d' % (filename, version))
+
+    db = mk_dwarf_db.create_CFDB(output)
+    db.conn.execute('attach database ? as old', (filename,))
+    upgraders[version](db.conn)
+    db.conn.execute('detach database old')
+    mk_dwarf_db.finish_CFDB(db)
+    print('upgraded %s from schema version %d to %d' %
+          (output, version, mk_dwarf_db.SCHEMA_VERSION))
+    pass
+
+def main():
+    parser = optparse.OptionParser(usage='usage: %prog [-o <output-file>] <database>')
+    parser.add_option('-o', '--output', dest='output',
+                      help='Output file name. If not specified, replace the'
+                      ' given database.')
+    (options, args) = parser.parse_args()
+    if len(args) != 1:
+        parser.print_usage()
+        sys.exit(1)
+        pass
+    filename = args[0]
+    output = options.output or filename
+
+    upgrade(filename, output, load_mk_dwarf_db())
+    pass
+
+if __name__ == '__main__':
+    main()
+    pass
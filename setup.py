@@ -33,9 +33,13 @@ setup(
         'Programming Language :: Python :: 3',
         ],
     install_requires=["pyelftools >= 0.30"],
+    # Modules imported by the scripts.
+    package_dir={'': 'scripts'},
+    py_modules=['callgraph', 'dbpool', 'queryclient', 'typegraph'],
     scripts=['scripts/mk-dwarf-db.py',
              'scripts/draw-callflow.py',
-             'scripts/draw-compile-units.py',
              'scripts/draw-types.py',
-             'scripts/list-cu-calls.py'],
+             'scripts/list-cu-calls.py',
+             'scripts/query-server.py',
+             'scripts/upgrade-dwarf-db.py'],
 )
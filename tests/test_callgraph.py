@@ -0,0 +1,223 @@
+#
+# Check shortest_path() and k_shortest_paths() of scripts/callgraph.py,
+# and -t of draw-callflow.py, against enumerating all loopless paths of
+# small random graphs.
+#
+# Run with 'python -m unittest discover tests' or pytest.
+#
+import io
+import os
+import re
+import sys
+import random
+import sqlite3
+import unittest
+import importlib.util
+
+SCRIPTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           '..', 'scripts')
+sys.path.insert(0, SCRIPTS_DIR)
+
+import callgraph
+
+spec = importlib.util.spec_from_file_location(
+    'draw_callflow', os.path.join(SCRIPTS_DIR, 'draw-callflow.py'))
+draw_callflow = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(draw_callflow)
+
+NUM_GRAPHS = 300
+
+# Return a CallGraph of "calls", loaded from a database like the ones
+# of mk-dwarf-db.py.
+def make_graph(num_ids, calls):
+    conn = sqlite3.connect(':memory:')
+    conn.execute('create table symbols (id integer primary key, name text,'
+                 ' cu integer)')
+    conn.execute('create table compile_units (id integer primary key,'
+                 ' name text)')
+    conn.execute('create table calls (caller integer, callee integer,'
+                 ' primary key(caller, callee)) without rowid')
+    conn.executemany('insert into symbols values (?, ?, 0)',
+                     [(id, 'f%d' % id) for id in range(num_ids)])
+    conn.executemany('insert into calls values (?, ?)', calls)
+    graph = callgraph.load(conn)
+    conn.close()
+    return graph
+
+# Return all loopless paths from src to tgt not going through
+# "blocked" ids or "blocked_edges" calls.
+def all_paths(calls, src, tgt, blocked=frozenset(), blocked_edges=frozenset()):
+    callees = {}
+    for caller, callee in calls:
+        callees.setdefault(caller, []).append(callee)
+        pass
+    paths = []
+    def walk(path):
+        id = path[-1]
+        if id == tgt:
+            paths.append(list(path))
+            return
+        for callee in callees.get(id, []):
+            if callee in path or callee in blocked or \
+               (id, callee) in blocked_edges:
+                continue
+            path.append(callee)
+            walk(path)
+            path.pop()
+            pass
+        pass
+    walk([src])
+    return paths
+
+def random_case(rnd):
+    num_ids = rnd.randint(1, 8)
+    density = rnd.random() * 0.6
+    calls = [(caller, callee)
+             for caller in range(num_ids) for callee in range(num_ids)
+             if rnd.random() < density]
+    src = rnd.randrange(num_ids)
+    tgt = rnd.randrange(num_ids)
+    others = [id for id in range(num_ids) if id not in (src, tgt)]
+    blocked = frozenset(id for id in others if rnd.random() < 0.2)
+    blocked_edges = frozenset(call for call in calls if rnd.random() < 0.2)
+    return num_ids, calls, src, tgt, blocked, blocked_edges
+
+# Return the calls on paths of at most "levels" calls from src to tgt,
+# as -t of draw-callflow.py had found them by enumerating the paths.
+# Paths end at tgt; other ids appear once, and only if "loopless" is
+# set.  Recursive calls are never followed.
+def path_calls(calls, src, tgt, levels, loopless):
+    callees = {}
+    for caller, callee in calls:
+        callees.setdefault(caller, []).append(callee)
+        pass
+    found = set()
+    def walk(path):
+        id = path[-1]
+        for callee in callees.get(id, []):
+            if callee == tgt:
+                found.update(zip(path, path[1:] + [tgt]))
+            elif callee == src or callee == id or \
+                 (loopless and callee in path):
+                continue
+            elif len(path) < levels:
+                path.append(callee)
+                walk(path)
+                path.pop()
+                pass
+            pass
+        pass
+    walk([src])
+    return found
+
+# Return the calls drawn by -t src:tgt of draw-callflow.py.
+def draw_target(graph, src, tgt, levels):
+    searches = draw_callflow.TargetSearches(graph, levels)
+    tree = draw_callflow.create_callflow_tree_target(
+        graph, 'f%d' % src, 'f%d' % tgt, levels, set(), searches)
+    out = io.StringIO()
+    tree.draw(out, set())
+    return set((int(caller), int(callee)) for caller, callee in
+               re.findall(r'"f(\d+)" -> "f(\d+)"', out.getvalue()))
+
+class PathTest(unittest.TestCase):
+    def check_path(self, path, calls, src, tgt, blocked, blocked_edges):
+        self.assertEqual(path[0], src)
+        self.assertEqual(path[-1], tgt)
+        self.assertEqual(len(set(path)), len(path))
+        for caller, callee in zip(path, path[1:]):
+            self.assertIn((caller, callee), calls)
+            self.assertNotIn((caller, callee), blocked_edges)
+            pass
+        self.assertFalse(blocked.intersection(path))
+        pass
+
+    def test_shortest_path(self):
+        rnd = random.Random(1)
+        for i in range(NUM_GRAPHS):
+            num_ids, calls, src, tgt, blocked, blocked_edges = random_case(rnd)
+            with self.subTest(case=i, calls=calls, src=src, tgt=tgt,
+                              blocked=blocked, blocked_edges=blocked_edges):
+                graph = make_graph(num_ids, calls)
+                path = callgraph.shortest_path(graph, src, tgt, blocked,
+                                               blocked_edges)
+                expected = all_paths(calls, src, tgt, blocked, blocked_edges)
+                if not expected:
+                    self.assertIsNone(path)
+                    continue
+                self.assertIsNotNone(path)
+                self.check_path(path, calls, src, tgt, blocked, blocked_edges)
+                self.assertEqual(len(path), min(map(len, expected)))
+                pass
+            pass
+        pass
+
+    def test_k_shortest_paths(self):
+        rnd = random.Random(2)
+        for i in range(NUM_GRAPHS):
+            num_ids, calls, src, tgt, blocked, _ = random_case(rnd)
+            k = rnd.randint(1, 6)
+            with self.subTest(case=i, calls=calls, src=src, tgt=tgt,
+                              blocked=blocked, k=k):
+                graph = make_graph(num_ids, calls)
+                paths = callgraph.k_shortest_paths(graph, src, tgt, k,
+                                                   blocked)
+                expected = all_paths(calls, src, tgt, blocked)
+                self.assertEqual(len(paths), min(k, len(expected)))
+                self.assertEqual(len(set(map(tuple, paths))), len(paths))
+                for path in paths:
+                    self.check_path(path, calls, src, tgt, blocked,
+                                    frozenset())
+                    pass
+                # The lengths are the k shortest, in order.
+                self.assertEqual([len(path) for path in paths],
+                                 sorted(map(len, expected))[:len(paths)])
+                pass
+            pass
+        pass
+
+    def test_target(self):
+        rnd = random.Random(3)
+        for i in range(NUM_GRAPHS):
+            num_ids, calls, src, tgt, _, _ = random_case(rnd)
+            levels = rnd.randint(1, 6)
+            with self.subTest(case=i, calls=calls, src=src, tgt=tgt,
+                              levels=levels):
+                graph = make_graph(num_ids, calls)
+                drawn = draw_target(graph, src, tgt, levels)
+                # Every call on a loopless path is drawn, and so are
+                # calls on cycles within the bound, as long as the
+                # cycles pass through neither the source nor the
+                # target.
+                self.assertLessEqual(
+                    path_calls(calls, src, tgt, levels, True), drawn)
+                self.assertEqual(
+                    path_calls(calls, src, tgt, levels, False), drawn)
+                pass
+            pass
+        pass
+
+    def test_target_acyclic(self):
+        rnd = random.Random(4)
+        for i in range(NUM_GRAPHS):
+            num_ids = rnd.randint(1, 8)
+            density = rnd.random() * 0.6
+            calls = [(caller, callee)
+                     for caller in range(num_ids)
+                     for callee in range(caller + 1, num_ids)
+                     if rnd.random() < density]
+            src = rnd.randrange(num_ids)
+            tgt = rnd.randrange(num_ids)
+            levels = rnd.randint(1, 6)
+            with self.subTest(case=i, calls=calls, src=src, tgt=tgt,
+                              levels=levels):
+                graph = make_graph(num_ids, calls)
+                self.assertEqual(draw_target(graph, src, tgt, levels),
+                                 path_calls(calls, src, tgt, levels, True))
+                pass
+            pass
+        pass
+    pass
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+#
+# Check that TypeDedup of mk-dwarf-db.py drops the copies of types
+# repeated by CUs and redirects references to the types kept.
+#
+# Run with 'python -m unittest discover tests' or pytest.
+#
+import os
+import unittest
+import importlib.util
+
+ROOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+MK_DWARF_DB = os.path.join(ROOT_DIR, 'scripts', 'mk-dwarf-db.py')
+
+def load_module(name, path):
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+mk = load_module('mk_dwarf_db', MK_DWARF_DB)
+
+# Return the types of a CU at "base" having a list of nodes pointing
+# to each other and a node with an int.
+#
+#   struct node { struct node *next; int value; };
+def make_CU_types(base, value_type='int'):
+    int_type = mk.TypeInfo(base + 1, mk.MT_base, name=value_type)
+    node = mk.TypeInfo(base + 2, mk.MT_structure, name='node')
+    node.choose_params(members=True)
+    node.comm_params = [
+        mk.TypeCommonParam(mk.MT_member, 'next', value=base + 3, offset=0),
+        mk.TypeCommonParam(mk.MT_member, 'value', value=base + 1, offset=8),
+    ]
+    ptr = mk.TypeInfo(base + 3, mk.MT_pointer, type=base + 2)
+    return [int_type, node, ptr]
+
+class TypeDedupTest(unittest.TestCase):
+    def make_dedup(self):
+        void = mk.TypeInfo(0, mk.MT_base, name='void')
+        return mk.TypeDedup({0: void})
+
+    def test_same_types(self):
+        dedup = self.make_dedup()
+        for base in (100, 200, 300):
+            dedup.extend(make_CU_types(base))
+            pass
+        types = dedup.finish()
+        self.assertEqual(list(types), [0, 101, 102, 103])
+        self.assertEqual(dedup.dropped, 6)
+        pass
+
+    def test_different_types(self):
+        dedup = self.make_dedup()
+        dedup.extend(make_CU_types(100))
+        dedup.extend(make_CU_types(200, 'long'))
+        types = dedup.finish()
+        self.assertEqual(list(types), [0, 101, 102, 103, 201, 202, 203])
+        self.assertEqual(dedup.dropped, 0)
+        pass
+
+    def test_batches(self):
+        # A CU compared with the types kept before has its references
+        # redirected to them.
+        dedup = self.make_dedup()
+        dedup.MIN_BATCH = 1
+        dedup.extend(make_CU_types(100))
+        cu_types = make_CU_types(200)
+        cu_types.append(mk.TypeInfo(204, mk.MT_pointer, type=203))
+        dedup.extend(cu_types)
+        self.assertEqual(list(dedup.types), [0, 101, 102, 103, 204])
+        dedup.extend(make_CU_types(300, 'long'))
+        types = dedup.finish()
+        self.assertEqual(list(types),
+                         [0, 101, 102, 103, 204, 301, 302, 303])
+        self.assertEqual(types[204].type, 103)
+        self.assertEqual(types[302].comm_params[0].value, 303)
+        self.assertEqual(types[302].comm_params[1].value, 301)
+        pass
+    pass
+
+if __name__ == '__main__':
+    unittest.main()
@@ -4,6 +4,20 @@ def create_app():
     app = Flask(__name__)
     app.config.from_object('config.Config')  # Load configurations from config.py
 
+    # The database, its connections, the SVG renderer and the
+    # background jobs are shared by all requests.
+    from .graphs import ResidentDB, ConnectionPool
+    from .render import create_renderer
+    from .jobs import create_job_queue
+    app.extensions['trace_dwarf_db'] = ResidentDB(app.config['DATABASE'])
+    app.extensions['trace_dwarf_pool'] = \
+        ConnectionPool(app.config['DATABASE'],
+                       app.config['DB_POOL_MAX_IDLE'])
+    app.extensions['trace_dwarf_renderer'] = create_renderer(app.config)
+    app.extensions['trace_dwarf_jobs'] = \
+        create_job_queue(app.config, app.extensions['trace_dwarf_db'],
+                         app.extensions['trace_dwarf_renderer'])
+
     # Import routes and register them with the app
     from .routes import main
     app.register_blueprint(main)
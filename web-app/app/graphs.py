@@ -0,0 +1,103 @@
+# Diagrams of the database for the routes.
+#
+# The database is kept in memory by query-server.py's ResidentDB,
+# shared by all requests, and diagrams are drawn by the same code as
+# draw-callflow.py and draw-types.py.  Routes querying the database
+# itself take read-only connections from dbpool.ConnectionPool.
+import os
+import sys
+import importlib.util
+
+scripts_dir = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                            '..', '..', 'scripts'))
+if scripts_dir not in sys.path:
+    sys.path.insert(0, scripts_dir)
+    pass
+
+import dbpool
+import queryclient
+
+QueryError = queryclient.QueryError
+
+def load_script(name):
+    path = os.path.join(scripts_dir, name + '.py')
+    spec = importlib.util.spec_from_file_location(name.replace('-', '_'),
+                                                  path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+query_server = load_script('query-server')
+
+ResidentDB = query_server.ResidentDB
+ConnectionPool = dbpool.ConnectionPool
+
+MODES = ('callflow', 'types')
+DIRECTIONS = ('callees', 'callers')
+MAX_LEVELS = 20
+
+# Return the query of a diagram from request arguments or a form.
+#
+# The query is a tuple of (name, value) pairs in a fixed order with
+# sorted lists, so that the same diagram always gets the same query
+# no matter how it is asked.
+#
+#   mode       'callflow' or 'types'
+#   start      symbols or types to start with
+#   end        symbols to end with; callflow only
+#   highlight  symbols or types to highlight
+#   levels     number of levels to follow
+#   direction  'callees' (members for types) or 'callers' (dependants)
+def normalize_query(args):
+    mode = args.get('mode') or 'callflow'
+    if mode not in MODES:
+        raise QueryError('Unknown mode %s.' % mode)
+    direction = args.get('direction') or 'callees'
+    if direction not in DIRECTIONS:
+        raise QueryError('Unknown direction %s.' % direction)
+    try:
+        levels = int(args.get('levels') or 5)
+    except ValueError:
+        raise QueryError('Levels must be a number.')
+    if levels < 1 or levels > MAX_LEVELS:
+        raise QueryError('Levels must be between 1 and %d.' % MAX_LEVELS)
+
+    def names(key):
+        return tuple(sorted(set(name.strip() for name in args.getlist(key)
+                                if name.strip())))
+    end = names('end') if mode == 'callflow' else ()
+    return (('mode', mode),
+            ('start', names('start')),
+            ('end', end),
+            ('highlight', names('highlight')),
+            ('levels', levels),
+            ('direction', direction))
+
+# Return arguments of a URL for a query.
+def query_to_args(query):
+    return {name: list(value) if isinstance(value, tuple) else value
+            for name, value in query}
+
+# Return the dot file of the diagram of a query.
+def make_dot(db, query):
+    query = dict(query)
+    prefix = '+' if query['direction'] == 'callees' else '~'
+    if query['mode'] == 'callflow':
+        if query['end']:
+            options = {'target': ['%s:%s' % (start, end)
+                                  for start in query['start']
+                                  for end in query['end']]}
+        else:
+            options = {'follow': [prefix + start
+                                  for start in query['start']]}
+            pass
+        options['levels'] = query['levels']
+        options['highlight'] = list(query['highlight'])
+        result = query_server.query_callflow(db, {'options': options})
+    else:
+        options = {'type': [prefix + start for start in query['start']],
+                   'max_levels': query['levels'],
+                   'highlight': list(query['highlight'])}
+        result = query_server.query_types(db, {'options': options})
+        pass
+    return result['output']
@@ -0,0 +1,241 @@
+# Diagrams rendered in the background.
+#
+# Drawing a big diagram, e.g. the types of '+net' at 5 levels, and
+# laying it out with dot may take minutes; too long for a request.
+# Such diagrams are submitted as jobs instead.  A job gets an id at
+# once, and JOB_WORKERS threads run the jobs in the order submitted.
+# Clients poll the state of a job and fetch the SVG when it is done.
+#
+# A job is in one of these states:
+#
+#   queued     waiting for a worker thread
+#   drawing    traversing the graph; "visited" counts the nodes
+#              expanded so far
+#   layout     dot is running, or waiting for a dot worker of the
+#              renderer, shared with /content
+#   done       the SVG is ready
+#   failed     "error" tells why
+#   cancelling cancelled but still drawing or waiting for dot to end
+#   cancelled
+#
+# Jobs are identified by the DB build and the query, like /content;
+# submitting a diagram already queued or running gives the same job,
+# so a cancellation cancels it for all its clients.  Submitting it
+# again after a cancellation gives a new job.  Finished jobs are kept
+# for JOB_TTL seconds, and at most MAX_FINISHED_JOBS of them.
+import time
+import uuid
+import queue
+import threading
+import traceback
+from . import graphs
+from .render import RenderError, RenderCancelled
+
+QUEUED = 'queued'
+DRAWING = 'drawing'
+LAYOUT = 'layout'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLING = 'cancelling'
+CANCELLED = 'cancelled'
+
+FINISHED = (DONE, FAILED, CANCELLED)
+
+class JobCancelled(Exception):
+    pass
+
+class Job:
+    def __init__(self, key, query):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.query = query
+        self.state = QUEUED
+        self.visited = 0
+        self.dot_size = None
+        self.error = None
+        self.svg = None
+        self.cancel_event = threading.Event()
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        pass
+
+    def is_finished(self):
+        return self.state in FINISHED
+
+    # Called by the traversal for every node it visits.
+    def visit(self):
+        if self.cancel_event.is_set():
+            raise JobCancelled()
+        self.visited += 1
+        pass
+
+    def to_dict(self):
+        end = self.finished or time.time()
+        state = self.state
+        if state not in FINISHED and self.cancel_event.is_set():
+            state = CANCELLING
+            pass
+        return {'id': self.id,
+                'query': graphs.query_to_args(self.query),
+                'state': state,
+                'visited': self.visited,
+                'dot_size': self.dot_size,
+                'error': self.error,
+                'elapsed': end - (self.started or end)}
+    pass
+
+# A graph of a LoadedDB reporting to a job every node a traversal
+# visits; draw-callflow.py and draw-types.py reach the neighbors of a
+# node only through these methods.
+class TrackedGraph:
+    visiting_methods = ('neighbors', 'callees', 'callers',
+                        'get_members', 'get_dependant_ids')
+
+    def __init__(self, graph, job):
+        self.graph = graph
+        self.job = job
+        pass
+
+    def __getattr__(self, name):
+        attr = getattr(self.graph, name)
+        if name not in self.visiting_methods:
+            return attr
+        job = self.job
+        def visiting(*args):
+            job.visit()
+            return attr(*args)
+        return visiting
+    pass
+
+class TrackedDB:
+    def __init__(self, db, job):
+        self.graph = TrackedGraph(db.graph, job)
+        self.types = TrackedGraph(db.types, job)
+        pass
+    pass
+
+class JobQueue:
+    def __init__(self, resident_db, renderer, workers, timeout, ttl,
+                 max_finished):
+        self.resident_db = resident_db
+        self.renderer = renderer
+        # Timeout of dot for jobs, instead of RENDER_TIMEOUT.
+        self.timeout = timeout
+        self.ttl = ttl
+        self.max_finished = max_finished
+        self.lock = threading.Lock()
+        # id -> Job, in the order submitted.
+        self.jobs = {}
+        # key -> Job not finished yet.
+        self.in_flight = {}
+        self.queue = queue.Queue()
+        for i in range(workers):
+            threading.Thread(target=self.work, name='render-job-%d' % i,
+                             daemon=True).start()
+            pass
+        pass
+
+    # Return the job of a query, submitting a new one if there is none
+    # queued or running.
+    def submit(self, query):
+        db = self.resident_db.get()
+        key = (db.build_id, query)
+        with self.lock:
+            self.expire()
+            job = self.in_flight.get(key)
+            if job is not None:
+                return job
+            job = Job(key, query)
+            self.jobs[job.id] = job
+            svg = self.renderer.cache.get(key)
+            if svg is not None:
+                job.svg = svg
+                job.state = DONE
+                job.finished = time.time()
+                return job
+            self.in_flight[key] = job
+            pass
+        self.queue.put((job, db))
+        return job
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+        pass
+
+    def cancel(self, job_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return None
+            job.cancel_event.set()
+            if self.in_flight.get(job.key) is job:
+                del self.in_flight[job.key]
+                pass
+            pass
+        return job
+
+    # Forget finished jobs too old or too many; called with the lock.
+    def expire(self):
+        now = time.time()
+        finished = [job for job in self.jobs.values() if job.is_finished()]
+        num_extra = len(finished) - self.max_finished
+        for job in finished:
+            if num_extra > 0 or now - job.finished > self.ttl:
+                del self.jobs[job.id]
+                num_extra -= 1
+                pass
+            pass
+        pass
+
+    def work(self):
+        while True:
+            job, db = self.queue.get()
+            self.run(job, db)
+            pass
+        pass
+
+    def run(self, job, db):
+        job.started = time.time()
+        error = None
+        try:
+            if job.cancel_event.is_set():
+                raise JobCancelled()
+            job.state = DRAWING
+            dot_text = graphs.make_dot(TrackedDB(db, job), job.query)
+            job.dot_size = len(dot_text)
+            job.state = LAYOUT
+            svg = self.renderer.render(dot_text, job.cancel_event,
+                                       self.timeout)
+            self.renderer.cache.put(job.key, svg)
+            job.svg = svg
+            state = DONE
+        except (JobCancelled, RenderCancelled):
+            state = CANCELLED
+        except (graphs.QueryError, RenderError) as e:
+            error = str(e)
+            state = FAILED
+        except Exception as e:
+            traceback.print_exc()
+            error = 'internal error: %s' % e
+            state = FAILED
+            pass
+        # A job is finished when its state is, so set the state last.
+        job.error = error
+        job.finished = time.time()
+        job.state = state
+        with self.lock:
+            if self.in_flight.get(job.key) is job:
+                del self.in_flight[job.key]
+                pass
+            pass
+        pass
+    pass
+
+def create_job_queue(config, resident_db, renderer):
+    return JobQueue(resident_db, renderer,
+                    config['JOB_WORKERS'],
+                    config['JOB_RENDER_TIMEOUT'],
+                    config['JOB_TTL'],
+                    config['MAX_FINISHED_JOBS'])
@@ -0,0 +1,80 @@
+# Completion of names of symbols, types and compile units.
+#
+# Matches are ranked in two groups:
+#  1. names starting with the query, in the alphabetical order, found
+#     through the indexes of the tables, and
+#  2. other names containing the query, in the order of name_index,
+#     the FTS5 trigram index built by mk-dwarf-db.py.
+#
+# Neither needs sorting all matches, so a page costs about the same
+# for a query matching a few names or a million.  The trigram index
+# needs a query of 3 or more characters; shorter queries, and
+# databases without name_index (schema version 2 and older), get
+# only the first group.
+import heapq
+from itertools import islice
+
+KINDS = ('symbol', 'type', 'cu')
+
+# Minimum length of a query for the trigram index.
+MIN_TRIGRAM_QUERY = 3
+
+def has_name_index(conn):
+    row = conn.execute("select name from sqlite_master"
+                       " where type = 'table' and name = 'name_index'").fetchone()
+    return row is not None
+
+# Return a string of FTS5 query syntax matching q as it is.
+def quote_fts(q):
+    return '"%s"' % q.replace('"', '""')
+
+# Names starting with q are in [q, q + the largest character).
+def prefix_range(q):
+    return (q, q + '\U0010ffff')
+
+prefix_queries = {
+    'symbol': 'select name from symbols where name >= ? and name < ? order by name',
+    'type': 'select distinct name from types where name >= ? and name < ? order by name',
+    'cu': 'select name from compile_units where name >= ? and name < ? order by name',
+}
+
+def count_prefix(conn, q, kinds):
+    return sum(conn.execute('select count(*) from (%s)' % prefix_queries[kind],
+                            prefix_range(q)).fetchone()[0]
+               for kind in kinds)
+
+def complete_prefix(conn, q, kinds, limit, offset):
+    # Read just enough names of every kind in order and merge them.
+    n = limit + offset
+    sources = [[(row[0], kind) for row in
+                conn.execute(prefix_queries[kind] + ' limit ?',
+                             prefix_range(q) + (n,))]
+               for kind in kinds]
+    return list(islice(heapq.merge(*sources), offset, n))
+
+def complete_substring(conn, q, kinds, limit, offset):
+    return conn.execute('select name, kind from name_index'
+                        ' where name_index match ?'
+                        ' and kind in (%s)'
+                        ' and not (name >= ? and name < ?)'
+                        ' limit ? offset ?' % ','.join('?' * len(kinds)),
+                        (quote_fts(q),) + kinds + prefix_range(q) +
+                        (limit, offset)).fetchall()
+
+# Return up to "limit" matches of q, as (name, kind) pairs, skipping
+# the first "offset" ones.
+def complete(conn, q, kinds=KINDS, limit=20, offset=0):
+    kinds = tuple(kinds)
+    matches = complete_prefix(conn, q, kinds, limit, offset)
+    if len(matches) == limit or len(q) < MIN_TRIGRAM_QUERY or \
+       not has_name_index(conn):
+        return matches
+    # The page reaches the second group.
+    if matches:
+        num_prefix = offset + len(matches)
+    else:
+        num_prefix = count_prefix(conn, q, kinds)
+        pass
+    return matches + complete_substring(conn, q, kinds,
+                                        limit - len(matches),
+                                        offset + len(matches) - num_prefix)
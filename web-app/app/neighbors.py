@@ -0,0 +1,99 @@
+# Direct neighbors of a node, for expanding diagrams a node at a time.
+#
+# Nodes are symbols, by name, and types, by '@<id>' since type names
+# are not unique; a type name matching exactly one type is accepted
+# too.  Every node comes with its degrees, so a page can tell which
+# nodes have more to expand.  Neighbors are read from the in-memory
+# graphs of query-server.py's ResidentDB, and a page costs only the
+# neighbors in it, however many the node has.
+#
+#   symbol  directions 'callees' and 'callers'
+#   type    directions 'members' and 'dependants'
+from .graphs import QueryError
+
+DIRECTIONS = {
+    'symbol': ('callees', 'callers'),
+    'type': ('members', 'dependants'),
+}
+
+class NodeNotFound(QueryError):
+    pass
+
+def symbol_node(graph, id):
+    return {'kind': 'symbol',
+            'name': graph.get_name(id),
+            'callees': graph.num_callees(id),
+            'callers': graph.num_callers(id)}
+
+def type_node(types, type_id):
+    row = types.get_type(type_id)
+    return {'kind': 'type',
+            'id': '@%d' % type_id,
+            'name': row[1],
+            'meta_type': row[3],
+            'declaration': bool(row[4]),
+            'members': len(types.get_members(type_id)),
+            'dependants': len(types.get_dependant_ids(type_id))}
+
+def find_symbol_id(graph, name):
+    if not graph.has_name(name):
+        raise NodeNotFound('Symbol %s is not found.' % name)
+    return graph.get_id(name)
+
+def find_type_id(types, name):
+    if name.startswith('@'):
+        try:
+            type_id = int(name[1:])
+        except ValueError:
+            raise QueryError('Bad type id %s.' % name)
+        if types.get_type(type_id) is None:
+            raise NodeNotFound('Type %s is not found.' % name)
+        return type_id
+    type_ids = types.get_type_ids(name)
+    if not type_ids:
+        raise NodeNotFound('Type %s is not found.' % name)
+    if len(type_ids) > 1:
+        raise QueryError('%d types are named %s; use one of %s.' %
+                         (len(type_ids), name,
+                          ', '.join('@%d' % type_id
+                                    for type_id in type_ids[:10])))
+    return type_ids[0]
+
+def symbol_neighbors(db, name, direction, offset, limit):
+    graph = db.graph
+    id = find_symbol_id(graph, name)
+    node = symbol_node(graph, id)
+    neighbors = [symbol_node(graph, neighbor) for neighbor in
+                 graph.neighbors_page(id, direction == 'callees',
+                                      offset, limit)]
+    return node, node[direction], neighbors
+
+def type_neighbors(db, name, direction, offset, limit):
+    types = db.types
+    type_id = find_type_id(types, name)
+    node = type_node(types, type_id)
+    if direction == 'members':
+        neighbors = []
+        for _, member_name, member_type, member_offset in \
+            types.get_members(type_id)[offset:offset + limit]:
+            neighbor = type_node(types, member_type)
+            neighbor['member'] = {'name': member_name,
+                                  'offset': member_offset}
+            neighbors.append(neighbor)
+            pass
+    else:
+        neighbors = [type_node(types, dependant_id) for dependant_id in
+                     types.get_dependant_ids(type_id)[offset:offset + limit]]
+        pass
+    return node, node[direction], neighbors
+
+# Return (node, total, neighbors) of a page of neighbors of a node.
+def get_neighbors(db, kind, name, direction, offset, limit):
+    if kind not in DIRECTIONS:
+        raise QueryError('Unknown kind %s.' % kind)
+    if direction not in DIRECTIONS[kind]:
+        raise QueryError('Direction of %s must be one of %s.' %
+                         (kind, ', '.join(DIRECTIONS[kind])))
+    if kind == 'symbol':
+        return symbol_neighbors(db, name, direction, offset, limit)
+    return type_neighbors(db, name, direction, offset, limit)
@@ -0,0 +1,149 @@
+# Render dot files to SVG with Graphviz.
+#
+# At most RENDER_WORKERS dot processes run at once.  A request waits
+# up to RENDER_QUEUE_TIMEOUT seconds for a free worker and fails with
+# RenderBusy after that, so slow renders can't pile up and hold all
+# threads of the server.  A dot process running longer than
+# RENDER_TIMEOUT seconds is killed.  Rendered SVGs are kept in an LRU
+# cache.
+#
+# Background jobs (see jobs.py) share the workers.  They wait for a
+# free worker as long as it takes, have a timeout of their own, and
+# can be cancelled while waiting or while dot is running.
+import time
+import tempfile
+import threading
+import subprocess
+from collections import OrderedDict
+
+class RenderError(Exception):
+    pass
+
+class RenderBusy(RenderError):
+    pass
+
+class RenderTimeout(RenderError):
+    pass
+
+class RenderCancelled(RenderError):
+    pass
+
+# Seconds between checks of cancellation and timeouts.
+POLL_INTERVAL = 0.2
+
+class LRUCache:
+    def __init__(self, size):
+        self.size = size
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+        pass
+
+    def get(self, key):
+        with self.lock:
+            value = self.items.get(key)
+            if value is not None:
+                self.items.move_to_end(key)
+                pass
+            return value
+        pass
+
+    def put(self, key, value):
+        with self.lock:
+            self.items[key] = value
+            self.items.move_to_end(key)
+            while len(self.items) > self.size:
+                self.items.popitem(last=False)
+                pass
+            pass
+        pass
+    pass
+
+class SVGRenderer:
+    def __init__(self, dot, workers, timeout, queue_timeout, cache_size):
+        self.dot = dot
+        self.workers = threading.BoundedSemaphore(workers)
+        self.timeout = timeout
+        self.queue_timeout = queue_timeout
+        self.cache = LRUCache(cache_size)
+        pass
+
+    # Wait for a free worker until the queue timeout, or until
+    # "cancel" is set if it is given.
+    def acquire_worker(self, cancel):
+        if cancel is None:
+            if not self.workers.acquire(timeout=self.queue_timeout):
+                raise RenderBusy('All %s workers are busy.' % self.dot)
+            return
+        while not self.workers.acquire(timeout=POLL_INTERVAL):
+            if cancel.is_set():
+                raise RenderCancelled('Cancelled.')
+            pass
+        pass
+
+    # Render a dot file.  "cancel" is a threading.Event killing dot
+    # when it is set, and "timeout" overrides RENDER_TIMEOUT.
+    def render(self, dot_text, cancel=None, timeout=None):
+        timeout = timeout or self.timeout
+        # dot reads its input from a temporary file; communicate() can
+        # be called again after a timeout to read the output, but not
+        # to write the rest of the input.
+        with tempfile.TemporaryFile() as dot_file:
+            dot_file.write(dot_text.encode('utf-8'))
+            dot_file.seek(0)
+            self.acquire_worker(cancel)
+            try:
+                proc = subprocess.Popen([self.dot, '-Tsvg'],
+                                        stdin=dot_file,
+                                        stdout=subprocess.PIPE,
+                                        stderr=subprocess.PIPE)
+            except OSError as e:
+                self.workers.release()
+                raise RenderError('Cannot run %s: %s' % (self.dot, e))
+            pass
+        try:
+            deadline = time.monotonic() + timeout
+            while True:
+                try:
+                    stdout, stderr = proc.communicate(
+                        timeout=min(POLL_INTERVAL,
+                                    max(deadline - time.monotonic(), 0)))
+                    break
+                except subprocess.TimeoutExpired:
+                    if cancel is not None and cancel.is_set():
+                        raise RenderCancelled('Cancelled.')
+                    if time.monotonic() >= deadline:
+                        raise RenderTimeout('%s took more than %d seconds.' %
+                                            (self.dot, timeout))
+                    pass
+                pass
+        finally:
+            if proc.returncode is None:
+                proc.kill()
+                proc.stdout.close()
+                proc.stderr.close()
+                proc.wait()
+                pass
+            self.workers.release()
+            pass
+        if proc.returncode != 0:
+            raise RenderError('%s failed: %s' %
+                              (self.dot, stderr.decode('utf-8', 'replace').strip()))
+        return stdout
+
+    # Return the SVG of a key, rendering the dot file given by
+    # make_dot() if it is not in the cache.
+    def get(self, key, make_dot):
+        svg = self.cache.get(key)
+        if svg is None:
+            svg = self.render(make_dot())
+            self.cache.put(key, svg)
+            pass
+        return svg
+    pass
+
+def create_renderer(config):
+    return SVGRenderer(config['DOT'],
+                       config['RENDER_WORKERS'],
+                       config['RENDER_TIMEOUT'],
+                       config['RENDER_QUEUE_TIMEOUT'],
+                       config['CONTENT_CACHE_SIZE'])
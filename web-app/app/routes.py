@@ -1,7 +1,201 @@
-from flask import Blueprint, render_template
+import hashlib
+from flask import Blueprint, render_template, request, redirect, url_for, \
+    current_app, Response, jsonify
+from . import graphs
+from . import names
+from . import neighbors
+from .render import RenderError, RenderBusy, RenderTimeout
 
 main = Blueprint('main', __name__)
 
 @main.route('/')
 def index():
     return render_template('index.html')
+
+def text_response(text, status):
+    return Response(text + '\n', status=status, mimetype='text/plain')
+
+# Return the ETag of a diagram.
+#
+# A diagram is decided by the DB build and the query, so the ETag is
+# known without drawing or rendering anything.
+def make_etag(build_id, query):
+    return hashlib.sha1(repr((build_id, query)).encode('utf-8')).hexdigest()
+
+# The SVG diagram of the query given by the arguments.
+#
+# Forms are posted here too; they are redirected to the URL of their
+# normalized query, so that browsers and the cache see the same URL for
+# the same diagram.
+@main.route('/content', methods=['GET', 'POST'])
+def content():
+    try:
+        query = graphs.normalize_query(request.values)
+    except graphs.QueryError as e:
+        return text_response(str(e), 400)
+    if request.method == 'POST':
+        return redirect(url_for('main.content',
+                                **graphs.query_to_args(query)), 303)
+    if not dict(query)['start']:
+        return text_response('No diagram is selected.', 404)
+
+    try:
+        db = current_app.extensions['trace_dwarf_db'].get()
+    except Exception as e:
+        current_app.logger.exception('cannot load the database')
+        return text_response('Cannot load the database: %s' % e, 500)
+    etag = make_etag(db.build_id, query)
+    if request.if_none_match.contains(etag):
+        return Response(status=304, headers={'ETag': '"%s"' % etag})
+
+    renderer = current_app.extensions['trace_dwarf_renderer']
+    try:
+        svg = renderer.get((db.build_id, query),
+                           lambda: graphs.make_dot(db, query))
+    except graphs.QueryError as e:
+        return text_response(str(e), 400)
+    except RenderBusy as e:
+        return Response(str(e) + '\n', status=503, mimetype='text/plain',
+                        headers={'Retry-After': '5'})
+    except RenderTimeout as e:
+        return text_response(str(e), 504)
+    except RenderError as e:
+        return text_response(str(e), 500)
+
+    response = Response(svg, mimetype='image/svg+xml')
+    response.set_etag(etag)
+    # Revalidate with the ETag; it changes when the DB is rebuilt.
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+MAX_COMPLETIONS = 100
+
+# Names starting with or containing "q", for completing the form.
+#
+# Arguments:
+#   q       the text typed so far
+#   kind    'symbol', 'type' or 'cu'; may be given more than once, and
+#           all kinds by default
+#   limit   the number of matches in a page, 1 to 100, 20 by default
+#   offset  the number of matches to skip
+@main.route('/api/complete')
+def complete():
+    q = request.args.get('q', '')
+    kinds = request.args.getlist('kind') or names.KINDS
+    for kind in kinds:
+        if kind not in names.KINDS:
+            return jsonify(error='Unknown kind %s.' % kind), 400
+        pass
+    try:
+        limit = min(max(int(request.args.get('limit', 20)), 1),
+                    MAX_COMPLETIONS)
+        offset = max(int(request.args.get('offset', 0)), 0)
+    except ValueError:
+        return jsonify(error='limit and offset must be numbers.'), 400
+    if not q:
+        return jsonify(q=q, offset=offset, matches=[], more=False)
+
+    with current_app.extensions['trace_dwarf_pool'].connection() as conn:
+        # Ask one more to know if there is a next page.
+        rows = names.complete(conn, q, kinds, limit + 1, offset)
+        pass
+    return jsonify(q=q, offset=offset,
+                   matches=[{'name': name, 'kind': kind}
+                            for name, kind in rows[:limit]],
+                   more=len(rows) > limit)
+
+MAX_NEIGHBORS = 500
+
+# A page of the direct neighbors of a node, for expanding a diagram
+# one node at a time.  See neighbors.py.
+#
+# Arguments:
+#   kind       'symbol' or 'type'
+#   name       a symbol name, or a type by '@<id>' or its name
+#   direction  'callees' or 'callers' for symbols; 'members' or
+#              'dependants' for types
+#   limit      the number of neighbors in a page, 1 to 500, 50 by
+#              default
+#   offset     the number of neighbors to skip
+@main.route('/api/neighbors')
+def get_neighbors():
+    kind = request.args.get('kind', 'symbol')
+    name = request.args.get('name', '')
+    direction = request.args.get('direction') or \
+        neighbors.DIRECTIONS.get(kind, ('',))[0]
+    try:
+        limit = min(max(int(request.args.get('limit', 50)), 1),
+                    MAX_NEIGHBORS)
+        offset = max(int(request.args.get('offset', 0)), 0)
+    except ValueError:
+        return jsonify(error='limit and offset must be numbers.'), 400
+
+    try:
+        db = current_app.extensions['trace_dwarf_db'].get()
+    except Exception as e:
+        current_app.logger.exception('cannot load the database')
+        return jsonify(error='Cannot load the database: %s' % e), 500
+    try:
+        node, total, page = neighbors.get_neighbors(db, kind, name, direction,
+                                                    offset, limit)
+    except neighbors.NodeNotFound as e:
+        return jsonify(error=str(e)), 404
+    except graphs.QueryError as e:
+        return jsonify(error=str(e)), 400
+    response = jsonify(node=node, direction=direction, offset=offset,
+                       total=total, neighbors=page,
+                       more=offset + len(page) < total)
+    response.set_etag(make_etag(db.build_id, ('neighbors', kind, name,
+                                              direction, offset, limit)))
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
+
+def job_response(job, status=200):
+    response = jsonify(job.to_dict())
+    response.status_code = status
+    response.headers['Location'] = url_for('main.get_job', job_id=job.id)
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+# Render a diagram in the background; see jobs.py.  Takes the same
+# arguments as /content and returns the job, with 202 until it is
+# done.  The same diagram queued or running gives the same job.
+@main.route('/api/jobs', methods=['POST'])
+def submit_job():
+    try:
+        query = graphs.normalize_query(request.values)
+    except graphs.QueryError as e:
+        return jsonify(error=str(e)), 400
+    if not dict(query)['start']:
+        return jsonify(error='No diagram is selected.'), 400
+    try:
+        job = current_app.extensions['trace_dwarf_jobs'].submit(query)
+    except Exception as e:
+        current_app.logger.exception('cannot load the database')
+        return jsonify(error='Cannot load the database: %s' % e), 500
+    return job_response(job, 200 if job.is_finished() else 202)
+
+# The state and progress of a job.
+@main.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    job = current_app.extensions['trace_dwarf_jobs'].get(job_id)
+    if job is None:
+        return jsonify(error='No job %s.' % job_id), 404
+    return job_response(job)
+
+@main.route('/api/jobs/<job_id>', methods=['DELETE'])
+def cancel_job(job_id):
+    job = current_app.extensions['trace_dwarf_jobs'].cancel(job_id)
+    if job is None:
+        return jsonify(error='No job %s.' % job_id), 404
+    return job_response(job)
+
+# The SVG of a job that is done.
+@main.route('/api/jobs/<job_id>/svg')
+def get_job_svg(job_id):
+    job = current_app.extensions['trace_dwarf_jobs'].get(job_id)
+    if job is None:
+        return jsonify(error='No job %s.' % job_id), 404
+    if job.svg is None:
+        return job_response(job, 409)
+    return Response(job.svg, mimetype='image/svg+xml')
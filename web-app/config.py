@@ -1,3 +1,22 @@
+import os
+
 class Config:
     SECRET_KEY = 'your_secret_key'
     DEBUG = True  # Turn off in production
+
+    # Database generated by mk-dwarf-db.py.
+    DATABASE = os.environ.get('TRACE_DWARF_DB', 'callgraph.sqlite3')
+    DB_POOL_MAX_IDLE = 16       # idle read-only connections kept
+
+    # Rendering SVG with Graphviz.
+    DOT = 'dot'
+    RENDER_WORKERS = 2          # dot processes running at once
+    RENDER_TIMEOUT = 30         # seconds for a dot process
+    RENDER_QUEUE_TIMEOUT = 10   # seconds to wait for a free worker
+    CONTENT_CACHE_SIZE = 128    # rendered SVGs kept in memory
+
+    # Rendering big diagrams in the background; see app/jobs.py.
+    JOB_WORKERS = 2             # jobs running at once
+    JOB_RENDER_TIMEOUT = 600    # seconds for a dot process of a job
+    JOB_TTL = 600               # seconds to keep a finished job
+    MAX_FINISHED_JOBS = 64      # finished jobs kept, with their SVGs